@@ -7,13 +7,26 @@ Version 1.0.0
 #################################
 """""""""""""""""""""""""""""""""
 
+import argparse
+import atexit
+import bisect
+import collections
+import copy
 import ctypes
+import hashlib
+import importlib.metadata
+import io
 import json
+import math
 import mmap
 import os
+import platform
 import queue
+import re
+import random
 import shutil
 import socket
+import struct
 import subprocess
 import sys
 import tempfile
@@ -22,6 +35,8 @@ import time
 import traceback
 import urllib.parse
 import webbrowser
+import zlib
+from http import client as http_client
 from http import server
 from http.server import ThreadingHTTPServer
 import warnings
@@ -39,6 +54,14 @@ try:
 except Exception:
     SERIAL_AVAILABLE = False
 
+# Only needed for loading recorded sessions, recording itself doesnt use it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    np = None
+    NUMPY_AVAILABLE = False
+
 # Debug mode (i dont know if this even works i havent used it in forever, dont rely on it)
 DEBUG_VERBOSE = False
 
@@ -66,24 +89,184 @@ else:
 WEB_DIR = os.path.join(RESOURCE_DIR, "web")
 STATE_FILE = os.path.join(DATA_DIR, "companion_state.json")
 PRESETS_FILE = os.path.join(DATA_DIR, "layout_presets.json")
+RECORDINGS_DIR = os.path.join(DATA_DIR, "recordings")
+FIRMWARE_DIR = os.path.join(DATA_DIR, "firmware")
+
+# Uploaded firmware is stored by its sha256, so the same .bin uploaded again is just looked up
+FIRMWARE_MAX_UPLOAD = 10 * 1024 * 1024
+FIRMWARE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+FIRMWARE_CACHE_MAX_AGE = 30 * 24 * 3600
+UPLOAD_CHUNK = 64 * 1024
+
+FLASH_LOG_LINES = 2000
+FLASH_JOB_TTL = 600.0
+FLASH_JOBS_KEEP = 16
+FLASH_STATUS_MAX_WAIT = 10.0
+FLASH_WIFI_BOOT_DELAY = 2.0
+FLASH_PROGRESS_RE = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+
+# Session recording file: magic, version, header length, JSON header describing the layout, then chunks.
+# Each chunk is CHUNK_HEADER (tag, records, stored bytes, raw bytes) followed by its columns back to back
+# ("t" float64 seconds first, then every recorded field in header order), zlib compressed if the header says so
+RECORDING_MAGIC = b"SXREC\0"
+RECORDING_VERSION = 1
+RECORDING_PREAMBLE = struct.Struct("<6sHI")
+CHUNK_HEADER = struct.Struct("<4sIII")
+CHUNK_TAG = b"CHNK"
+RECORDING_CHUNK_RECORDS = 1024
+RECORDING_FLUSH_INTERVAL = 1.0
+RECORDING_QUEUE_SIZE = 8192
+# Appended to every record after the MemMap bytes: completedLaps and normalizedCarPosition off the graphics page,
+# -1 when it wasnt available (replays, synthetic runs, AC still loading)
+RECORDING_LAP = struct.Struct("<if")
+# Expanded .npy column caches next to the recordings are kept under this many bytes, least recently used go first
+RECORDING_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Recording analysis: speed is resampled every ANALYSIS_GRID_M metres to find laps, a lap is somewhere between the
+# min and max length, and each lap start may sit ANALYSIS_LAP_SEARCH (fraction of a lap) either side of where the
+# lap length alone puts it. Frame gaps longer than ANALYSIS_MAX_DT count as stopped
+ANALYSIS_GRID_M = 2.0
+ANALYSIS_MIN_LAP_M = 1000.0
+ANALYSIS_MAX_LAP_M = 25000.0
+ANALYSIS_MIN_CORRELATION = 0.5
+# A lap shows up as the first autocorrelation peak at least this close to the best one. Runs with pit stops repeat
+# every few laps too, and that longer repeat can score higher than the lap itself
+ANALYSIS_PEAK_FRACTION = 0.8
+ANALYSIS_PEAK_RADIUS_M = 500.0
+ANALYSIS_MATCH_M = 800.0
+ANALYSIS_LAP_SEARCH = 0.05
+ANALYSIS_MAX_DT = 0.5
+ANALYSIS_REFUEL_L = 0.5
+ANALYSIS_TIRE_CHANGE = 0.5
 
 MIN_SEND_INTERVAL = 0.02
 HEARTBEAT_INTERVAL = 0.5
+DEFAULT_POLL_HZ = 200.0
+DEFAULT_IDLE_POLL_HZ = 10.0
+DEFAULT_IDLE_AFTER = 2.0
 ESP_HEARTBEAT_INTERVAL = 0.5
 ESP_HEARTBEAT_TIMEOUT = 2.0
+AC_PROCESS_NAME = "acs.exe"
+AC_WATCH_INTERVAL = 1.0
+# Graphics page (laps, position, sectors) poll interval, physics stays on the fast path
+AC_GRAPHICS_INTERVAL = 0.1
+AC_STATUS = {0: "off", 1: "replay", 2: "live", 3: "pause"}
+AC_SESSION_TYPES = {-1: "unknown", 0: "practice", 1: "qualify", 2: "race", 3: "hotlap", 4: "time_attack", 5: "drift", 6: "drag"}
+STORE_FLUSH_DELAY = 0.5
+STORE_FLUSH_MAX_DELAY = 3.0
+# Heartbeat link quality: window of heartbeats to judge over, and when the wheel link counts as degraded (slowed to
+# LINK_DEGRADED_SEND_HZ) or bad (LINK_BAD_SEND_HZ). RTTs are p95 in seconds, loss is a fraction of the window
+LINK_WINDOW = 60
+LINK_MIN_SAMPLES = 10
+LINK_DEGRADED_LOSS = 0.1
+LINK_DEGRADED_RTT = 0.1
+LINK_DEGRADED_SEND_HZ = 30.0
+LINK_BAD_LOSS = 0.3
+LINK_BAD_RTT = 0.25
+LINK_BAD_SEND_HZ = 15.0
+STREAM_DEFAULT_HZ = 30.0
+STREAM_MAX_HZ = 60.0
+STREAM_KEEPALIVE = 1.0
+# Histogram bucket upper bounds in seconds for /api/metrics. Stages are the per frame steps of the sender loop,
+# jitter is how far each loop landed from the cadence the pacing scheduler asked for
+METRICS_STAGE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1)
+METRICS_JITTER_BUCKETS = (5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 1.0)
+SLIP_THRESHOLD = 1.0  # change for tuning, i didnt find a way to 100% find if abs or tc is actively working so this is my workaround
+TIRE_LOW_WEAR = 97.9
+TIRE_DISPLAY_EMPTY_AT = 86.0
+
+# Binary telemetry frame, only used once the wheel says it understands it in its HB_ACK, text is always the fallback.
+# Layout is BIN_FLAG_KEYS/BIN_FIELDS below
+WIRE_CAP_BINARY = "BIN1"
+# What a start request can ask for, auto upgrades to binary/delta when the wheel acks them
+WIRE_FORMATS = ("auto", "text")
+WIRE_CAP_DELTA = "DELTA1"
+DEFAULT_KEYFRAME_INTERVAL = 1.0
+
+# Every telemetry field, once. Wire order is table order, and the text encoder, decode_physics, the UI snapshot and
+# the send filters are all built from this at import, so a new field is one line here (plus the firmware side).
+# Columns: wire key, text format, UI snapshot key ("name.i" is slot i of a list), value function of the MemMap
+# snapshot p and the DecodeShared values s, then the send filter (widget that shows it, quantize step, deadband,
+# max staleness in seconds). A field only triggers a send if a widget showing it is in the current layout and it
+# moved past its deadband, or it has sat slightly off for longer than its max staleness. RL/P1/P2 arent shown by
+# any widget so they never trigger one. The binary frame picks its fields by key, see BIN_FLAG_KEYS/BIN_FIELDS
+TELEMETRY_FIELDS = (
+    ("G", "", "gear", lambda p, s: "R" if p.gear == 0 else "N" if p.gear == 1 else str(p.gear - 1), ("gear", 0, 0, None)),
+    ("PIT", "", "pit", lambda p, s: p.pitLimiterOn, ("pit", 0, 0, None)),
+    ("ABS", "", "abs", lambda p, s: int(p.abs > 0 and s.slip > SLIP_THRESHOLD and p.brake > 0.5 and p.brake > p.gas), ("abs_tc", 0, 0, None)),
+    ("TC", "", "tc", lambda p, s: int(p.tc > 0 and s.slip > SLIP_THRESHOLD and p.gas > 0.5 and p.gas > p.brake), ("abs_tc", 0, 0, None)),
+    ("RL", "", "rl", lambda p, s: s.low[2], (None, 0, 0, None)),
+    ("P1", "", "p1", lambda p, s: int(p.numberOfTiresOut > 0), (None, 0, 0, None)),
+    ("P2", "", "p2", lambda p, s: int(max(p.carDamage) > 0.01), (None, 0, 0, None)),
+    ("T0", "", "Tire_low.0", lambda p, s: s.low[0], ("tires", 0, 0, None)),
+    ("T1", "", "Tire_low.1", lambda p, s: s.low[1], ("tires", 0, 0, None)),
+    ("T2", "", "Tire_low.2", lambda p, s: s.low[2], ("tires", 0, 0, None)),
+    ("T3", "", "Tire_low.3", lambda p, s: s.low[3], ("tires", 0, 0, None)),
+    ("W0", "", "Tire_display_pct.0", lambda p, s: s.display[0], ("tires", 0, 0, None)),
+    ("W1", "", "Tire_display_pct.1", lambda p, s: s.display[1], ("tires", 0, 0, None)),
+    ("W2", "", "Tire_display_pct.2", lambda p, s: s.display[2], ("tires", 0, 0, None)),
+    ("W3", "", "Tire_display_pct.3", lambda p, s: s.display[3], ("tires", 0, 0, None)),
+    ("SPD", ".0f", "speed", lambda p, s: p.speedKmh, ("speed", 1, 1, 0.5)),
+    ("RPM", "", "rpm", lambda p, s: p.rpms, ("rpm", 10, 20, 0.25)),
+    ("THR", "", "throttle", lambda p, s: int(p.gas * 100), ("throttle", 0, 1, 0.25)),
+    ("BRK", "", "brake", lambda p, s: int(p.brake * 100), ("brake", 0, 1, 0.25)),
+    ("FUEL", ".1f", "fuel", lambda p, s: p.fuel, ("fuel", 0.1, 0.1, 2.0)),
+    ("BST", ".2f", "boost", lambda p, s: p.turboBoost, ("boost", 0.01, 0.05, 0.5)),
+    ("ATMP", ".0f", "air_temp", lambda p, s: p.airTemp, ("air_temp", 1, 1, 5.0)),
+    ("RTMP", ".0f", "road_temp", lambda p, s: p.roadTemp, ("road_temp", 1, 1, 5.0)),
+    ("DRS", "", "drs", lambda p, s: p.drsEnabled, ("drs", 0, 0, None)),
+    ("CLT", "", "clutch", lambda p, s: int(p.clutch * 100), ("clutch", 0, 1, 0.25)),
+    ("STR", ".2f", "steer", lambda p, s: p.steerAngle, ("steer", 0.01, 0.02, 0.5)),
+    ("BTMP", ".0f", "brake_temp", lambda p, s: (p.brakeTemp[0] + p.brakeTemp[1] + p.brakeTemp[2] + p.brakeTemp[3]) / 4.0, ("brake_temp", 1, 2, 1.0)),
+)
+PACKET_FIELDS = tuple((key, spec) for key, spec, _ui, _value, _filter in TELEMETRY_FIELDS)
+PACKET_INDEX = {key: i for i, (key, _spec) in enumerate(PACKET_FIELDS)}
+FIELD_FILTERS = {key: send_filter for key, _spec, _ui, _value, send_filter in TELEMETRY_FIELDS}
+# The whole text packet as one format string, "G:{0}|PIT:{1}|...|SPD:{15:.0f}|...", keys and separators baked in
+TEXT_TEMPLATE = "|".join(f"{key}:{{{i}{':' + spec if spec else ''}}}" for i, (key, spec) in enumerate(PACKET_FIELDS))
+BIN_MAGIC = 0xB5
+BIN_VERSION = 1
+# Flag bits of the binary frame, bit 0 first
+BIN_FLAG_KEYS = ("PIT", "ABS", "TC", "RL", "P1", "P2", "DRS", "T0", "T1", "T2", "T3")
+# Binary frame after magic, version, flags and gear: wire key, struct code, scale. Values are rounded (half up) after
+# scaling and clamped to what the struct code holds, the firmware divides the scale back out
+BIN_FIELDS = (
+    ("W0", "B", 1), ("W1", "B", 1), ("W2", "B", 1), ("W3", "B", 1),
+    ("SPD", "H", 10), ("RPM", "H", 1), ("THR", "B", 1), ("BRK", "B", 1), ("CLT", "B", 1), ("FUEL", "H", 10),
+    ("BST", "h", 100), ("ATMP", "h", 1), ("RTMP", "h", 1), ("STR", "h", 100), ("BTMP", "H", 1),
+)
+TELEMETRY_BIN = struct.Struct("<BBHb" + "".join(code for _key, code, _scale in BIN_FIELDS))
 
-telemetry_queue = queue.Queue()
 telemetry_worker = None
-telemetry_status = "Idle"
-telemetry_last = None
+# Open /api/stream connections and the rate each asked for, the sender publishes fast enough for the quickest one
+stream_rates = {}
+stream_lock = threading.Lock()
+stream_ui_interval = None
 heartbeat_worker = None
 heartbeat_lock = threading.Lock()
 heartbeat_last = 0.0
 heartbeat_ever = False
+heartbeat_caps = frozenset()
+
+ac_watcher = None
+ac_watcher_lock = threading.Lock()
+
+transports = {}
+transports_lock = threading.Lock()
+
+recorder = None
+recorder_lock = threading.Lock()
+# (path, mtime, lap length) -> analyze_recording result, a session doesnt change once it's finished
+analysis_cache = {}
+analysis_lock = threading.Lock()
 
 flash_jobs = {}
 flash_lock = threading.Lock()
 flash_seq = 0
+esptool_module = None
+esptool_lock = threading.Lock()
+esptool_run_lock = threading.Lock()
+output_capture = threading.local()
+output_capture_users = 0
 json_io_lock = threading.Lock()
 
 # DEFINITIONS BELOW:
@@ -109,9 +292,27 @@ def is_ac_running():
         return 'acs.exe' in result.stdout.lower()
     except Exception:
         return False
-    
-def open_physics_map():
-    return mmap.mmap(-1, PHYSICS_SIZE, tagname="acpmf_physics", access=mmap.ACCESS_READ)
+
+def get_ac_watcher():
+    # One watcher for the whole app, started the first time something needs it
+    global ac_watcher
+    with ac_watcher_lock:
+        if ac_watcher is None or not ac_watcher.is_alive():
+            ac_watcher = AcProcessWatcher(make_process_backend(AC_PROCESS_NAME))
+            ac_watcher.start()
+        return ac_watcher
+
+def make_process_backend(name):
+    if os.name == "nt":
+        try:
+            return Win32ProcessBackend(name)
+        except Exception as e:
+            if DEBUG_VERBOSE:
+                print(f"Win32 process backend unavailable, using tasklist: {e}")
+            return TasklistBackend(name)
+    if os.path.isdir("/proc"):
+        return ProcScanBackend(name)
+    return TasklistBackend(name)
 
 def _atomic_write_json(path, payload):
     directory = os.path.dirname(path) or "."
@@ -131,44 +332,23 @@ def _atomic_write_json(path, payload):
                 pass
 
 def load_state():
-    with json_io_lock:
-        if not os.path.exists(STATE_FILE):
-            if DEBUG_VERBOSE:
-                print("State file not found, using default")
-            return {"onboarding_seen": False}
-
-        try:
-            with open(STATE_FILE, "r", encoding="utf-8") as f:
-                state = json.load(f)
-            if isinstance(state, dict):
-                return state
-            if DEBUG_VERBOSE:
-                print("State file had invalid format, using default")
-        except Exception as e:
-            if DEBUG_VERBOSE:
-                print(f"Error loading state file, using default: {e}")
-        return {"onboarding_seen": False}
+    return state_store.get()
 
 def save_state(state):
-    with json_io_lock:
-        _atomic_write_json(STATE_FILE, state)
-        if DEBUG_VERBOSE:
-            print("Saved state to file:", STATE_FILE)
+    state_store.put(state)
 
 def load_presets():
-    with json_io_lock:
-        if not os.path.exists(PRESETS_FILE):
-            return []
-        try:
-            with open(PRESETS_FILE, "r", encoding="utf-8") as f:
-                presets = json.load(f)
-            return presets if isinstance(presets, list) else []
-        except Exception:
-            return []
+    return preset_store.get()
 
 def save_presets(presets):
-    with json_io_lock:
-        _atomic_write_json(PRESETS_FILE, presets)
+    preset_store.put(presets)
+
+def flush_stores():
+    for store in (state_store, preset_store):
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"Error saving {store.path}: {e}")
 
 def send_layout(ip, port, layout):
     def zone_str(zone):
@@ -177,18 +357,70 @@ def send_layout(ip, port, layout):
         return f"{p},{s}"
 
     packet = f"LAYOUT:{zone_str(layout.get('left', {}))}|{zone_str(layout.get('middle', {}))}|{zone_str(layout.get('right', {}))}"
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        sock.sendto(packet.encode("utf-8"), (ip, port))
-        if DEBUG_VERBOSE:
-            print(f"Sent layout to {ip}:{port}: {packet}")
-        return True
+        transport = acquire_transport(ip, port)
     except Exception as e:
         if DEBUG_VERBOSE:
             print(f"Layout send error: {e}")
         return False
+    try:
+        transport.send(packet.encode("utf-8"), "layout")
+        if DEBUG_VERBOSE:
+            print(f"Sent layout to {ip}:{port}: {packet}")
+        return True
     finally:
-        sock.close()
+        release_transport(transport)
+
+def send_wifi_credentials(port, baud, ssid, pwd):
+    # Writes "ssid,password" to the board over serial, (ok, error message)
+    payload = f"{ssid},{pwd}\n"
+    last_err = None
+    for attempt in range(3):
+        try:
+            with serial.Serial(port, baud, timeout=2, write_timeout=2) as ser:
+                try:
+                    ser.dtr = False
+                    ser.rts = False
+                except Exception:
+                    pass
+
+                if attempt == 0:
+                    time.sleep(1.2)
+                else:
+                    time.sleep(0.35)
+
+                try:
+                    ser.reset_input_buffer()
+                    ser.reset_output_buffer()
+                except Exception:
+                    pass
+
+                raw = payload.encode("utf-8")
+                ser.write(raw)
+                ser.flush()
+                time.sleep(0.2)
+                ser.write(raw)
+                ser.flush()
+                time.sleep(0.2)
+            return True, None
+        except Exception as e:
+            last_err = e
+            time.sleep(0.35)
+
+    msg = str(last_err) if last_err else "Unknown serial error"
+    lower = msg.lower()
+    if "permission" in lower or "access is denied" in lower or "writefile failed" in lower:
+        msg = (
+            "COM port is busy or wrong interface selected. Close Serial Monitor/other apps, "
+            "pick the USB Serial port (not JTAG), unplug/replug the board, then retry. "
+            f"Raw error: {last_err}"
+        )
+    elif "does not recognize the command" in lower or "device does not understand the command" in lower:
+        msg = (
+            "Windows rejected write on this COM interface. Select the USB Serial port (not JTAG) and retry. "
+            f"Raw error: {last_err}"
+        )
+    return False, msg
 
 def list_ports():
     if not SERIAL_AVAILABLE:
@@ -233,25 +465,23 @@ def find_esp_port(ports):
         return pick
     return ""
 
-def telemetry_sender():
-    global telemetry_status, telemetry_last
-    while True:
-        try:
-            kind, payload = telemetry_queue.get(timeout=0.5)
-            if kind == "status":
-                telemetry_status = payload
-            elif kind == "error":
-                telemetry_status = "Error"
-            elif kind == "telemetry":
-                telemetry_last = payload
-        except queue.Empty:
-            pass
+def set_stream_rate(token, hz):
+    # hz None drops the client. Keeps stream_ui_interval at the fastest rate anyone is watching
+    global stream_ui_interval
+    with stream_lock:
+        if hz is None:
+            stream_rates.pop(token, None)
+        else:
+            stream_rates[token] = hz
+        stream_ui_interval = 1.0 / max(stream_rates.values()) if stream_rates else None
 
 def reset_heartbeat_state():
-    global heartbeat_last, heartbeat_ever
+    global heartbeat_last, heartbeat_ever, heartbeat_caps
     with heartbeat_lock:
         heartbeat_last = 0.0
         heartbeat_ever = False
+        heartbeat_caps = frozenset()
+    link_stats.reset()
 
 def get_heartbeat_status():
     with heartbeat_lock:
@@ -266,391 +496,3312 @@ def get_heartbeat_status():
         "ever_seen": ever,
         "last_seen": last,
         "timeout_s": ESP_HEARTBEAT_TIMEOUT,
+        "caps": sorted(heartbeat_caps),
+        "link": link_stats.status(),
     }
 
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def _clamp(value, lo, hi):
+    return lo if value < lo else hi if value > hi else value
+
+_BIN_RANGES = {"B": (0, 255), "H": (0, 65535), "h": (-32768, 32767)}
+_BIN_GEAR = PACKET_INDEX["G"]
+_BIN_FLAGS = tuple((PACKET_INDEX[key], 1 << bit) for bit, key in enumerate(BIN_FLAG_KEYS))
+_BIN_BODY = tuple((PACKET_INDEX[key], scale) + _BIN_RANGES[code] for key, code, scale in BIN_FIELDS)
+
+def pack_binary_frame(buf, values):
+    gear = values[_BIN_GEAR]
+    gear_num = -1 if gear == "R" else 0 if gear == "N" else int(gear)
+    flags = 0
+    for i, bit in _BIN_FLAGS:
+        if values[i]:
+            flags |= bit
+    TELEMETRY_BIN.pack_into(
+        buf, 0,
+        BIN_MAGIC, BIN_VERSION, flags,
+        _clamp(gear_num, -1, 127),
+        *[_clamp(math.floor(values[i] * scale + 0.5), lo, hi) for i, scale, lo, hi in _BIN_BODY],
+    )
+
+def packet_parts(values):
+    # "KEY:value" strings for the delta format, same order as PACKET_FIELDS. One format call then a split is quicker
+    # than formatting each field on its own
+    return TEXT_TEMPLATE.format(*values).split("|")
+
+def encode_text(values):
+    return TEXT_TEMPLATE.format(*values).encode()
+
+class DecodeShared:
+    # Worked out once per frame before the field values, several fields share them
+    __slots__ = ("slip", "low", "display")
+
+    def __init__(self, p):
+        self.slip = max(abs(p.wheelSlip[0]), abs(p.wheelSlip[1]), abs(p.wheelSlip[2]), abs(p.wheelSlip[3]))
+        wear = [max(0.0, min(100.0, w)) for w in p.TireWear]
+        self.low = [int(w < TIRE_LOW_WEAR) for w in wear]
+        self.display = [int(round(max(0.0, min(1.0, (w - TIRE_DISPLAY_EMPTY_AT) / (100.0 - TIRE_DISPLAY_EMPTY_AT))) * 100.0)) for w in wear]
+
+def compile_field_table(fields=TELEMETRY_FIELDS, shared=DecodeShared):
+    # decode_physics and the UI snapshot builder for a field table, both just walk what was pulled out of it here
+    getters = tuple(value for _key, _spec, _ui, value, _filter in fields)
+    scalars = []
+    lists = {}
+    for i, (_key, _spec, ui, _value, _filter) in enumerate(fields):
+        name, _sep, slot = ui.partition(".")
+        if slot:
+            lists.setdefault(name, {})[int(slot)] = i
+        else:
+            scalars.append((name, i))
+    lists = tuple((name, tuple(slots[n] for n in sorted(slots))) for name, slots in lists.items())
+
+    def decode_physics(p):
+        s = shared(p)
+        return [get(p, s) for get in getters]
+
+    def build_snapshot(v, wear_pct):
+        snap = {"ac_running": True}
+        for name, i in scalars:
+            snap[name] = v[i]
+        for name, slots in lists:
+            snap[name] = [v[i] for i in slots]
+        snap["wear_pct"] = list(wear_pct)
+        return snap
+
+    return decode_physics, build_snapshot
+
+decode_physics, build_snapshot = compile_field_table()
+
+def _filter_number(value):
+    # Whole steps stay ints so int fields dont turn into "7000.0" on the wire
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def store_firmware(stream, length, suffix=".bin"):
+    # Copies length bytes from stream into the firmware cache, hashing on the way. Returns (path, sha256, reused)
+    os.makedirs(FIRMWARE_DIR, exist_ok=True)
+    suffix = suffix if suffix.startswith(".") and suffix[1:].isalnum() else ".bin"
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(prefix=".upload_", suffix=".part", dir=FIRMWARE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(UPLOAD_CHUNK, remaining))
+                if not chunk:
+                    raise IOError(f"Upload ended early, {remaining} bytes missing")
+                digest.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+        sha = digest.hexdigest()
+        path = os.path.join(FIRMWARE_DIR, sha + suffix)
+        reused = os.path.exists(path)
+        if reused:
+            # Touch it so eviction sees it as recently used
+            os.utime(path)
+        else:
+            os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            try:
+                os.unlink(temp_path)
+            except Exception:
+                pass
+    evict_firmware_cache(keep=path)
+    return path, sha, reused
+
+def cached_firmware(sha):
+    # Path of an already uploaded image with this sha256, or None
+    sha = (sha or "").lower()
+    if len(sha) != 64 or any(ch not in "0123456789abcdef" for ch in sha) or not os.path.isdir(FIRMWARE_DIR):
+        return None
+    for name in os.listdir(FIRMWARE_DIR):
+        if name.startswith(sha) and not name.endswith(".part"):
+            path = os.path.join(FIRMWARE_DIR, name)
+            os.utime(path)
+            return path
+    return None
+
+def evict_firmware_cache(keep=None):
+    # Drops images older than FIRMWARE_CACHE_MAX_AGE, then the least recently used until under FIRMWARE_CACHE_MAX_BYTES.
+    # Anything a running flash is reading from is left alone
+    if not os.path.isdir(FIRMWARE_DIR):
+        return 0
+    with flash_lock:
+        busy = {os.path.abspath(j.bin_path) for j in flash_jobs.values() if not j.done and j.bin_path}
+    if keep:
+        busy.add(os.path.abspath(keep))
+    now = time.time()
+    entries = []
+    for name in os.listdir(FIRMWARE_DIR):
+        path = os.path.join(FIRMWARE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        # Stale partial uploads from a crash go once they are old enough to not be in progress
+        if name.endswith(".part") and now - st.st_mtime < 3600:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for _mtime, size, _path in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if os.path.abspath(path) in busy:
+            continue
+        if now - mtime < FIRMWARE_CACHE_MAX_AGE and total <= FIRMWARE_CACHE_MAX_BYTES and not path.endswith(".part"):
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def layout_widgets(layout):
+    # Set of widget names a layout shows, None if we dont know the layout
+    if not isinstance(layout, dict):
+        return None
+    widgets = set()
+    for zone in ("left", "middle", "right"):
+        z = layout.get(zone) or {}
+        for slot in ("primary", "secondary"):
+            name = z.get(slot)
+            if name and name != "none":
+                widgets.add(str(name).lower())
+    return widgets
+
 # End definitions
 
-class TelemetrySender(threading.Thread):
-    def __init__(self, ip, port, Tire_live, out_queue):
+# Cached copy of one of the json files. Reads come from memory, writes land in memory and a background thread
+# writes them out once things go quiet for STORE_FLUSH_DELAY (or STORE_FLUSH_MAX_DELAY at most, if they dont).
+# The file itself is still only ever replaced atomically, so a crash loses the last few clicks at worst, never the file
+class JsonStore:
+    def __init__(self, path, default, kind):
+        self.path = path
+        self.default = default
+        self.kind = kind
+        self.lock = threading.Lock()
+        # One flush at a time, so an older snapshot can never land on disk after a newer one
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.value = None
+        self.generation = 0
+        self.dirty_since = None
+        self.last_put = 0.0
+        self.thread = None
+        self.flushes = 0
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            if DEBUG_VERBOSE:
+                print("File not found, using default:", self.path)
+            return copy.deepcopy(self.default)
+        try:
+            with json_io_lock:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+            if isinstance(value, self.kind):
+                return value
+            if DEBUG_VERBOSE:
+                print("File had invalid format, using default:", self.path)
+        except Exception as e:
+            if DEBUG_VERBOSE:
+                print(f"Error loading {self.path}, using default: {e}")
+        return copy.deepcopy(self.default)
+
+    def get(self):
+        # Callers edit what they get and put it back, so they get their own copy
+        with self.lock:
+            if self.value is None:
+                self.value = self._load()
+            return copy.deepcopy(self.value)
+
+    def put(self, value):
+        value = copy.deepcopy(value)
+        now = time.monotonic()
+        with self.lock:
+            self.value = value
+            self.generation += 1
+            if self.dirty_since is None:
+                self.dirty_since = now
+            self.last_put = now
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def flush(self):
+        # The disk write happens outside the store lock so get()/put() never wait on it. put() always swaps in a
+        # fresh object, so the reference taken here is a stable snapshot. Only marked clean once the write worked and
+        # nothing was put in the meantime, a failed write raises and leaves it dirty for the next try
+        with self.write_lock:
+            with self.lock:
+                if self.dirty_since is None:
+                    return
+                value = self.value
+                generation = self.generation
+                taken = time.monotonic()
+            with json_io_lock:
+                _atomic_write_json(self.path, value)
+            with self.lock:
+                if self.generation == generation:
+                    self.dirty_since = None
+                else:
+                    # Whatever came in during the write is at most this old
+                    self.dirty_since = taken
+                self.flushes += 1
+        if DEBUG_VERBOSE:
+            print("Saved to file:", self.path)
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            while True:
+                with self.lock:
+                    if self.dirty_since is None:
+                        break
+                    due = min(self.last_put + STORE_FLUSH_DELAY, self.dirty_since + STORE_FLUSH_MAX_DELAY)
+                delay = due - time.monotonic()
+                if delay <= 0:
+                    try:
+                        self.flush()
+                        break
+                    except Exception as e:
+                        print(f"Error saving {self.path}: {e}")
+                        # Still dirty, have another go in a bit
+                        delay = STORE_FLUSH_MAX_DELAY
+                self.wake.wait(delay)
+                self.wake.clear()
+
+state_store = JsonStore(STATE_FILE, {"onboarding_seen": False}, dict)
+preset_store = JsonStore(PRESETS_FILE, [], list)
+atexit.register(flush_stores)
+
+# Process liveness backends for AcProcessWatcher. find() returns a pid (or None), wait_exit() blocks for up to
+# timeout and returns True once that process is gone, mapping_exists() is a cheap "is AC even up" probe (None = cant tell)
+class Win32ProcessBackend:
+    name = "win32"
+    wait_slice = 0.5
+
+    TH32CS_SNAPPROCESS = 0x2
+    SYNCHRONIZE = 0x100000
+    FILE_MAP_READ = 0x4
+    WAIT_OBJECT_0 = 0
+
+    class PROCESSENTRY32W(ctypes.Structure):
+        _fields_ = [
+            ("dwSize", ctypes.c_uint32),
+            ("cntUsage", ctypes.c_uint32),
+            ("th32ProcessID", ctypes.c_uint32),
+            ("th32DefaultHeapID", ctypes.c_size_t),
+            ("th32ModuleID", ctypes.c_uint32),
+            ("cntThreads", ctypes.c_uint32),
+            ("th32ParentProcessID", ctypes.c_uint32),
+            ("pcPriClassBase", ctypes.c_long),
+            ("dwFlags", ctypes.c_uint32),
+            ("szExeFile", ctypes.c_wchar * 260),
+        ]
+
+    def __init__(self, image_name):
+        from ctypes import wintypes
+        self.image_name = image_name.lower()
+        k32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        k32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+        k32.CreateToolhelp32Snapshot.argtypes = [wintypes.DWORD, wintypes.DWORD]
+        k32.Process32FirstW.argtypes = [wintypes.HANDLE, ctypes.POINTER(self.PROCESSENTRY32W)]
+        k32.Process32NextW.argtypes = [wintypes.HANDLE, ctypes.POINTER(self.PROCESSENTRY32W)]
+        k32.OpenProcess.restype = wintypes.HANDLE
+        k32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+        k32.OpenFileMappingW.restype = wintypes.HANDLE
+        k32.OpenFileMappingW.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.LPCWSTR]
+        k32.WaitForSingleObject.restype = wintypes.DWORD
+        k32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+        k32.CloseHandle.argtypes = [wintypes.HANDLE]
+        self.k32 = k32
+        self.handle = None
+        self.handle_pid = None
+
+    def mapping_exists(self):
+        # OpenFileMapping (unlike mmap with a tagname) never creates the section, so this is a real probe
+        h = self.k32.OpenFileMappingW(self.FILE_MAP_READ, False, "acpmf_physics")
+        if not h:
+            return False
+        self.k32.CloseHandle(h)
+        return True
+
+    def find(self):
+        snap = self.k32.CreateToolhelp32Snapshot(self.TH32CS_SNAPPROCESS, 0)
+        if not snap or snap == ctypes.c_void_p(-1).value:
+            return None
+        try:
+            entry = self.PROCESSENTRY32W()
+            entry.dwSize = ctypes.sizeof(entry)
+            ok = self.k32.Process32FirstW(snap, ctypes.byref(entry))
+            while ok:
+                if entry.szExeFile.lower() == self.image_name:
+                    return entry.th32ProcessID
+                ok = self.k32.Process32NextW(snap, ctypes.byref(entry))
+        finally:
+            self.k32.CloseHandle(snap)
+        return None
+
+    def wait_exit(self, pid, timeout):
+        # Keep one handle per pid and just wait on it, the kernel tells us the moment it exits
+        if self.handle_pid != pid:
+            self.release()
+            self.handle = self.k32.OpenProcess(self.SYNCHRONIZE, False, pid)
+            self.handle_pid = pid
+        if not self.handle:
+            # No handle to wait on (AC running elevated, or it's already gone), check the process list each slice
+            time.sleep(timeout)
+            return self.find() != pid
+        if self.k32.WaitForSingleObject(self.handle, int(timeout * 1000)) == self.WAIT_OBJECT_0:
+            self.release()
+            return True
+        return False
+
+    def release(self):
+        if self.handle:
+            self.k32.CloseHandle(self.handle)
+        self.handle = None
+        self.handle_pid = None
+
+# Linux stand in (wine, or a fake acs.exe for testing), just scans /proc
+class ProcScanBackend:
+    name = "proc"
+    wait_slice = 0.5
+
+    def __init__(self, image_name):
+        self.image_name = image_name.lower()
+
+    def mapping_exists(self):
+        return None
+
+    def _matches(self, pid):
+        try:
+            with open(f"/proc/{pid}/comm", "r", encoding="utf-8", errors="ignore") as f:
+                comm = f.read().strip().lower()
+        except OSError:
+            return False
+        # comm is cut at 15 chars
+        return comm and self.image_name.startswith(comm)
+
+    def find(self):
+        try:
+            entries = os.listdir("/proc")
+        except OSError:
+            return None
+        for entry in entries:
+            if entry.isdigit() and self._matches(entry):
+                return int(entry)
+        return None
+
+    def wait_exit(self, pid, timeout):
+        time.sleep(timeout)
+        return not self._matches(pid)
+
+    def release(self):
+        pass
+
+# Old behaviour, only used if the win32 calls arent available
+class TasklistBackend:
+    name = "tasklist"
+    wait_slice = 3.0
+
+    def __init__(self, image_name):
+        self.image_name = image_name
+
+    def mapping_exists(self):
+        return None
+
+    def find(self):
+        return 0 if is_ac_running() else None
+
+    def wait_exit(self, pid, timeout):
+        time.sleep(timeout)
+        return not is_ac_running()
+
+    def release(self):
+        pass
+
+# Keeps track of whether AC is running on its own thread so the telemetry loop only ever reads a bool
+class AcProcessWatcher(threading.Thread):
+    def __init__(self, backend, interval=AC_WATCH_INTERVAL):
         super().__init__(daemon=True)
-        self.ip = ip
-        self.port = port
-        self.Tire_live = Tire_live
-        self.out_queue = out_queue
+        self.backend = backend
+        self.interval = interval
+        self.running = False
+        self.pid = None
+        self.checks = 0
         self.stop_event = threading.Event()
 
     def stop(self):
         self.stop_event.set()
 
-    def run(self):
-        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 0)
-
-        last_print = time.time()
-        last_send = 0.0
-        last_packet = ""
-        last_gear = "N"
-        last_heartbeat = 0.0
-        last_ac_check = 0.0
-        ac_running = False
-        print_interval = 0.1 if self.Tire_live else 1.0
-
-        self.out_queue.put(("status", "Telemetry running"))
+    def status(self):
+        return {
+            "running": self.running,
+            "pid": self.pid,
+            "backend": self.backend.name,
+            "checks": self.checks,
+        }
 
+    def run(self):
+        backend = self.backend
         while not self.stop_event.is_set():
             try:
-                now = time.time()
-
-                # Check if Assetto Corsa is running
-                if now - last_ac_check >= 3.0:
-                    ac_running = is_ac_running()
-                    last_ac_check = now
-
-                if not ac_running:
-                    # Dont send data if its not running
-                    if time.time() - last_print > print_interval:
-                        self.out_queue.put(("telemetry", {"ac_running": False}))
-                        last_print = time.time()
-                    time.sleep(0.5)
-                    last_packet = ""
+                # No physics page means no AC, dont bother walking the process list
+                if backend.mapping_exists() is False:
+                    self.running = False
+                    self.pid = None
+                    self.stop_event.wait(self.interval)
                     continue
 
-                
-                try:
-                    mm = open_physics_map()
-                except Exception:
-                    # ac is probably starting so wait and retry
-                    time.sleep(0.5)
+                self.checks += 1
+                pid = backend.find()
+                if pid is None:
+                    self.running = False
+                    self.pid = None
+                    self.stop_event.wait(self.interval)
                     continue
-                try:
-                    mm.seek(0)
-                    data = mm.read(PHYSICS_SIZE)
-                finally:
-                    mm.close()
-
-                physics = MemMap.from_buffer_copy(data)
-
-                raw_gear = physics.gear
-                if raw_gear == 0:
-                    gear_str = "R"
-                elif raw_gear == 1:
-                    gear_str = "N"
-                else:
-                    gear_str = str(raw_gear - 1)
 
-                try:
-                    max_wheel_slip = max(abs(float(physics.wheelSlip[i])) for i in range(4))
-                except Exception:
-                    max_wheel_slip = 0.0
-
-                SLIP_THRESHOLD = 1.0  # change for tuning, i didnt find a way to 100% find if abs or tc is actively working so this is my workaround
-                abs_alert = int(float(physics.abs) > 0 and max_wheel_slip > SLIP_THRESHOLD and physics.brake > 0.5 and physics.brake > physics.gas)
-                tc_alert  = int(float(physics.tc) > 0 and max_wheel_slip > SLIP_THRESHOLD and physics.gas > 0.5 and physics.gas > physics.brake)
-                # print(f"ABS: {physics.abs:.3f}, TC: {physics.tc:.3f}, ABS Alert: {abs_alert}, TC Alert: {tc_alert}, Max Slip: {max_wheel_slip:.3f}, brake: {physics.brake:.3f}, gas: {physics.gas:.3f}")
-
-                low_wear = 97.9
-                display_empty_at = 86.0
-
-                Tire_low = [0, 0, 0, 0]
-                Tire_wear_pct = [0, 0, 0, 0]
-                Tire_display_pct = [100, 100, 100, 100]
-
-                for i in range(4):
-                    wear_raw = float(physics.TireWear[i])
-                    wear_pct = max(0.0, min(100.0, wear_raw))
-                    Tire_wear_pct[i] = wear_pct
-
-                    low = wear_pct < low_wear
-                    Tire_low[i] = int(low)
-
-                    remapped = (wear_pct - display_empty_at) / (100.0 - display_empty_at)
-                    remapped = max(0.0, min(1.0, remapped))
-                    Tire_display_pct[i] = int(round(remapped * 100.0))
-
-                check_rl = Tire_low[2]
-                placeholder_1 = int(physics.numberOfTiresOut > 0)
-                placeholder_2 = int(max(physics.carDamage) > 0.01)
-                pit = physics.pitLimiterOn
-                speed_kmh = physics.speedKmh
-                rpms = physics.rpms
-                throttle = int(physics.gas * 100)
-                brake_pct = int(physics.brake * 100)
-                fuel = physics.fuel
-                boost = physics.turboBoost
-                air_temp = physics.airTemp
-                road_temp = physics.roadTemp
-                drs_on = physics.drsEnabled
-                clutch_pct = int(physics.clutch * 100)
-                steer_angle = physics.steerAngle
-                avg_brake_temp = sum(physics.brakeTemp[i] for i in range(4)) / 4.0
-
-                packet = (
-                    f"G:{gear_str}|PIT:{pit}|ABS:{abs_alert}|TC:{tc_alert}|"
-                    f"RL:{check_rl}|P1:{placeholder_1}|P2:{placeholder_2}|"
-                    f"T0:{Tire_low[0]}|T1:{Tire_low[1]}|T2:{Tire_low[2]}|T3:{Tire_low[3]}|"
-                    f"W0:{Tire_display_pct[0]}|W1:{Tire_display_pct[1]}|W2:{Tire_display_pct[2]}|W3:{Tire_display_pct[3]}|"
-                    f"SPD:{speed_kmh:.0f}|RPM:{rpms}|THR:{throttle}|BRK:{brake_pct}|"
-                    f"FUEL:{fuel:.1f}|BST:{boost:.2f}|ATMP:{air_temp:.0f}|RTMP:{road_temp:.0f}|"
-                    f"DRS:{drs_on}|CLT:{clutch_pct}|STR:{steer_angle:.2f}|BTMP:{avg_brake_temp:.0f}"
+                self.pid = pid
+                self.running = True
+                while not self.stop_event.is_set():
+                    if backend.wait_exit(pid, backend.wait_slice):
+                        break
+                    self.checks += 1
+                self.running = False
+                self.pid = None
+            except Exception as e:
+                if DEBUG_VERBOSE:
+                    print(f"AC watcher error: {e}")
+                self.running = False
+                self.stop_event.wait(self.interval)
+        backend.release()
+
+# Delta mode for the text packets. A keyframe "K:<seq>|..." carries every field, a delta "D:<seq>:<key>|..." only the
+# fields that differ from keyframe <key>. Deltas are always against the last keyframe the wheel acked (KACK), so a lost
+# delta never corrupts anything, and if the wheel doesnt have the keyframe a delta points at it asks for a RESYNC
+class DeltaEncoder:
+    MAX_PENDING = 4
+
+    def __init__(self, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = float(keyframe_interval)
+        self.seq = 0
+        self.pending = {}
+        self.base_seq = None
+        self.base_parts = None
+        self.last_keyframe = 0.0
+        self.resync = True
+        self.keyframes = 0
+        self.deltas = 0
+        self.acks = 0
+        self.resyncs = 0
+        self.peer_lost = 0
+
+    def on_reply(self, data):
+        if data.startswith(b"KACK:"):
+            try:
+                fields = data[5:].split(b":")
+                seq = int(fields[0])
+                if len(fields) > 1:
+                    self.peer_lost = int(fields[1])
+            except ValueError:
+                return
+            parts = self.pending.pop(seq, None)
+            if parts is not None:
+                self.base_seq = seq
+                self.base_parts = parts
+                self.acks += 1
+        elif data.startswith(b"RESYNC"):
+            self.resync = True
+            self.resyncs += 1
+
+    def encode(self, parts, now):
+        self.seq = (self.seq + 1) & 0xFFFF
+        if self.resync or self.base_parts is None or now - self.last_keyframe >= self.keyframe_interval:
+            self.resync = False
+            self.last_keyframe = now
+            self.pending[self.seq] = parts
+            if len(self.pending) > self.MAX_PENDING:
+                del self.pending[next(iter(self.pending))]
+            self.keyframes += 1
+            return (f"K:{self.seq}|" + "|".join(parts)).encode()
+
+        self.deltas += 1
+        changed = [p for p, b in zip(parts, self.base_parts) if p != b]
+        head = f"D:{self.seq}:{self.base_seq}"
+        return (head + "|" + "|".join(changed) if changed else head).encode()
+
+    def stats(self):
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "acks": self.acks,
+            "resyncs": self.resyncs,
+            "peer_lost": self.peer_lost,
+            "keyframe_interval": self.keyframe_interval,
+        }
+
+# Decides whether a frame is worth sending, from FIELD_FILTERS and whatever the wheel is currently showing
+class SendFilter:
+    def __init__(self, layout=None, overrides=None):
+        table = dict(FIELD_FILTERS)
+        # What each field decodes to, quantizing has to keep that: G is text, int fields are packed as ints
+        kinds = [type(v) for v in decode_physics(MemMap())] if overrides else None
+        for key, override in (overrides or {}).items():
+            if key not in table or not isinstance(override, dict):
+                continue
+            widget, step, deadband, max_stale = table[key]
+            try:
+                new_step = _filter_number(override.get("step", step))
+                kind = kinds[PACKET_INDEX[key]]
+                if new_step < 0 or (new_step and kind is str) or (kind is int and not isinstance(new_step, int)):
+                    new_step = step
+                table[key] = (
+                    widget,
+                    new_step,
+                    _filter_number(override.get("deadband", deadband)),
+                    None if override.get("max_stale", max_stale) is None else float(override.get("max_stale", max_stale)),
                 )
+            except (TypeError, ValueError):
+                continue
+        self.table = table
+        self.steps = [(PACKET_INDEX[key], step) for key, (_w, step, _d, _s) in table.items() if step]
+        self.sent = None
+        self.sent_at = 0.0
+        self.set_layout(layout)
 
-                now = time.time()
-                changed = packet != last_packet or gear_str != last_gear
-                heartbeat_due = (now - last_heartbeat) >= HEARTBEAT_INTERVAL
-                rate_ok = (now - last_send) >= MIN_SEND_INTERVAL
-
-                if changed or (heartbeat_due and rate_ok):
-                    if changed or rate_ok:
-                        udp_sock.sendto(packet.encode(), (self.ip, self.port))
-                        last_send = now
-                        last_packet = packet
-                        last_gear = gear_str
-                        if heartbeat_due:
-                            last_heartbeat = now
-
-                if time.time() - last_print > print_interval:
-                    self.out_queue.put(("telemetry", {
-                        "ac_running": True,
-                        "gear": gear_str,
-                        "pit": pit,
-                        "abs": abs_alert,
-                        "tc": tc_alert,
-                        "rl": check_rl,
-                        "wear_pct": Tire_wear_pct,
-                        "Tire_low": Tire_low,
-                        "Tire_display_pct": Tire_display_pct,
-                        "p1": placeholder_1,
-                        "p2": placeholder_2,
-                        "speed": speed_kmh,
-                        "rpm": rpms,
-                        "throttle": throttle,
-                        "brake": brake_pct,
-                        "fuel": fuel,
-                        "boost": boost,
-                        "air_temp": air_temp,
-                        "road_temp": road_temp,
-                        "drs": drs_on,
-                        "clutch": clutch_pct,
-                        "steer": steer_angle,
-                        "brake_temp": avg_brake_temp,
-                    }))
-                    last_print = time.time()
+    def set_layout(self, layout):
+        widgets = layout_widgets(layout)
+        rules = []
+        for key, (widget, _step, deadband, max_stale) in self.table.items():
+            if widget is None or (widgets is not None and widget not in widgets):
+                continue
+            rules.append((PACKET_INDEX[key], deadband, max_stale))
+        self.rules = rules
+        self.layout = layout
+        # New widgets on screen need fresh values straight away
+        self.sent = None
 
-            except Exception as e:
-                self.out_queue.put(("error", f"Telemetry error: {e}"))
-                if DEBUG_VERBOSE:
-                    print(f"Telemetry error: {e}")
-                break
+    def quantize(self, values):
+        for i, step in self.steps:
+            values[i] = round(values[i] / step) * step
 
-            time.sleep(0.005)
+    def should_send(self, values, now):
+        sent = self.sent
+        if sent is None:
+            return True
+        for i, deadband, max_stale in self.rules:
+            value = values[i]
+            old = sent[i]
+            if value == old:
+                continue
+            if not deadband or abs(value - old) >= deadband:
+                return True
+            if max_stale is not None and now - self.sent_at >= max_stale:
+                return True
+        return False
 
-        udp_sock.close()
-        self.out_queue.put(("status", "Telemetry stopped"))
+    def mark_sent(self, values, now):
+        self.sent = values
+        self.sent_at = now
+
+# Decides how long the sender sleeps between polls. While driving it polls at the target rate (or faster than AC
+# publishes, whichever is slower), when nothing is changing (menus, paused, sat in the pits) it backs off to the idle rate
+class PacingScheduler:
+    def __init__(self, target_hz=DEFAULT_POLL_HZ, idle_hz=DEFAULT_IDLE_POLL_HZ, idle_after=DEFAULT_IDLE_AFTER):
+        self.min_interval = 1.0 / max(1.0, float(target_hz))
+        self.max_interval = max(self.min_interval, 1.0 / max(0.1, float(idle_hz)))
+        self.idle_after = float(idle_after)
+        self.interval = self.min_interval
+        self.frame_interval = None
+        self.last_frame = None
+        self.last_active = time.monotonic()
+        self.next_tick = self.last_active
+        self.window_start = self.last_active
+        self.window_polls = 0
+        self.window_frames = 0
+        self.poll_hz = 0.0
+        self.frame_hz = 0.0
+
+    def tick(self, now, new_frame, active):
+        self.window_polls += 1
+        if new_frame:
+            self.window_frames += 1
+            # A gap longer than the idle poll is a pause, not AC's frame rate. Averaging it in would keep us polling
+            # slowly for seconds after the car moves again, so start the estimate over instead
+            if self.last_frame is None or now - self.last_frame > self.max_interval:
+                self.frame_interval = None
+            else:
+                dt = now - self.last_frame
+                if self.frame_interval is None:
+                    self.frame_interval = dt
+                else:
+                    self.frame_interval += (dt - self.frame_interval) * 0.2
+            self.last_frame = now
+
+        if active:
+            if self.idle():
+                # Waking up, go straight to the target rate and let the next frames set the pace
+                self.frame_interval = None
+            self.last_active = now
+            # Poll twice per AC frame so we're never more than half a frame late
+            fast = self.min_interval
+            if self.frame_interval:
+                fast = max(fast, self.frame_interval / 2.0)
+            self.interval = min(fast, self.max_interval)
+        elif now - self.last_active >= self.idle_after:
+            self.interval = min(self.interval * 1.5, self.max_interval)
+
+        if now - self.window_start >= 1.0:
+            span = now - self.window_start
+            self.poll_hz = self.window_polls / span
+            self.frame_hz = self.window_frames / span
+            self.window_start = now
+            self.window_polls = 0
+            self.window_frames = 0
+
+    def wait(self, stop_event):
+        # Deadline based so the work done each loop doesnt stretch the period
+        now = time.monotonic()
+        self.next_tick = max(self.next_tick + self.interval, now)
+        delay = self.next_tick - now
+        if delay > 0:
+            stop_event.wait(delay)
+
+    def idle(self):
+        return self.interval >= self.max_interval
+
+    def stats(self):
+        return {
+            "target_hz": round(1.0 / self.min_interval, 1),
+            "idle_hz": round(1.0 / self.max_interval, 1),
+            "current_hz": round(1.0 / self.interval, 1),
+            "achieved_hz": round(self.poll_hz, 1),
+            "ac_frame_hz": round(self.frame_hz, 1),
+            "idle": self.idle(),
+        }
+
+# Fixed buckets so recording is one bisect and an add, no locks. Each histogram has one writing thread (send is the
+# exception, one per wheel, and a rare lost increment there doesnt matter for monitoring)
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value, _bisect=bisect.bisect_left):
+        self.counts[_bisect(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return counts, sum(counts), self.sum
+
+    def quantile(self, q, counts=None, total=None):
+        # Upper bound of the bucket the quantile lands in, the last bucket has no bound so it reports the top one
+        if counts is None:
+            counts, total, _sum = self.snapshot()
+        if not total:
+            return 0.0
+        want = q * total
+        seen = 0
+        for bound, count in zip(self.bounds, counts):
+            seen += count
+            if seen >= want:
+                return bound
+        return self.bounds[-1]
+
+# Process wide hot path numbers for /api/metrics. Lives for the whole app run so the counters only ever go up,
+# senders come and go but keep adding to the same histograms
+class TelemetryMetrics:
+    STAGES = ("read", "decode", "build", "send")
+    COUNTERS = ("frames", "frames_skipped", "sends", "drops", "deferred", "errors")
+
+    def __init__(self):
+        self.started = time.time()
+        self.read = Histogram(METRICS_STAGE_BUCKETS)
+        self.decode = Histogram(METRICS_STAGE_BUCKETS)
+        self.build = Histogram(METRICS_STAGE_BUCKETS)
+        self.send = Histogram(METRICS_STAGE_BUCKETS)
+        self.jitter = Histogram(METRICS_JITTER_BUCKETS)
+        self.frames = 0
+        self.frames_skipped = 0
+        self.sends = 0
+        self.drops = 0
+        self.deferred = 0
+        self.errors = 0
+
+    def counters(self):
+        out = {name: getattr(self, name) for name in self.COUNTERS}
+        watcher = ac_watcher
+        out["ac_checks"] = watcher.checks if watcher is not None and hasattr(watcher, "checks") else 0
+        return out
+
+    def _histograms(self):
+        return [(name, getattr(self, name)) for name in self.STAGES] + [("jitter", self.jitter)]
+
+    def to_dict(self):
+        out = {"uptime_s": round(time.time() - self.started, 1), "counters": self.counters(), "stages": {}}
+        for name, hist in self._histograms():
+            counts, total, total_sum = hist.snapshot()
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(hist.bounds, counts):
+                cumulative += count
+                buckets.append([bound, cumulative])
+            buckets.append(["+Inf", total])
+            out["stages"][name] = {
+                "count": total,
+                "sum_s": round(total_sum, 6),
+                "mean_us": round(total_sum / total * 1e6, 2) if total else 0.0,
+                "p50_us": round(hist.quantile(0.5, counts, total) * 1e6, 1),
+                "p99_us": round(hist.quantile(0.99, counts, total) * 1e6, 1),
+                "buckets": buckets,
+            }
+        return out
+
+    def prometheus(self):
+        lines = []
+        for name, hist in self._histograms():
+            metric = "screenx_loop_jitter_seconds" if name == "jitter" else f"screenx_{name}_seconds"
+            lines.append(f"# HELP {metric} " + (
+                "Distance of each sender loop from its target cadence." if name == "jitter"
+                else f"Time spent in the sender {name} stage."))
+            lines.append(f"# TYPE {metric} histogram")
+            counts, total, total_sum = hist.snapshot()
+            cumulative = 0
+            for bound, count in zip(hist.bounds, counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {total}')
+            lines.append(f"{metric}_sum {total_sum:.9f}")
+            lines.append(f"{metric}_count {total}")
+        for name, value in self.counters().items():
+            metric = f"screenx_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+telemetry_metrics = TelemetryMetrics()
+
+# The one UDP socket we use per wheel. connect()ed so sends skip the address lookup and the wheel's replies (which go
+# back to whichever socket sent the packet) all land here. Sends go through a small scheduler thread that always
+# takes telemetry first, then layout, then heartbeat, and only ever keeps the newest telemetry packet if it falls
+# behind. A receive thread hands replies to whoever subscribed to their prefix
+class UdpTransport:
+    KINDS = ("telemetry", "layout", "heartbeat")
 
-class HeartbeatSender(threading.Thread):
     def __init__(self, ip, port):
+        self.ip = ip
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 0)
+        self.sock.connect((ip, port))
+        self.sock.settimeout(0.2)
+        self.cond = threading.Condition()
+        self.telemetry = None
+        self.layout = collections.deque(maxlen=8)
+        self.heartbeat = collections.deque(maxlen=4)
+        self.closing = False
+        self.subscribers = []
+        self.sent = dict.fromkeys(self.KINDS, 0)
+        self.superseded = 0
+        self.errors = 0
+        self.received = 0
+        self.send_thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.recv_thread = threading.Thread(target=self._recv_loop, daemon=True)
+        self.send_thread.start()
+        self.recv_thread.start()
+
+    def send(self, payload, kind="telemetry"):
+        with self.cond:
+            if kind == "telemetry":
+                if self.telemetry is not None:
+                    self.superseded += 1
+                    telemetry_metrics.drops += 1
+                self.telemetry = payload
+            elif kind == "layout":
+                self.layout.append(payload)
+            else:
+                self.heartbeat.append(payload)
+            self.cond.notify()
+
+    def subscribe(self, prefixes, callback):
+        entry = (tuple(prefixes), callback)
+        with self.cond:
+            self.subscribers = self.subscribers + [entry]
+        return entry
+
+    def unsubscribe(self, entry):
+        with self.cond:
+            self.subscribers = [s for s in self.subscribers if s is not entry]
+
+    def close(self):
+        # Whatever is still queued goes out first, a layout sent right before close still arrives
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+
+    def _next(self):
+        with self.cond:
+            while True:
+                if self.telemetry is not None:
+                    payload, self.telemetry = self.telemetry, None
+                    return payload, "telemetry"
+                if self.layout:
+                    return self.layout.popleft(), "layout"
+                if self.heartbeat:
+                    return self.heartbeat.popleft(), "heartbeat"
+                if self.closing:
+                    return None, None
+                self.cond.wait()
+
+    def _send_loop(self):
+        sock = self.sock
+        metrics = telemetry_metrics
+        observe_send = metrics.send.observe
+        perf = time.perf_counter
+        while True:
+            payload, kind = self._next()
+            if payload is None:
+                break
+            try:
+                started = perf()
+                sock.send(payload)
+                observe_send(perf() - started)
+                self.sent[kind] += 1
+                metrics.sends += 1
+            except OSError:
+                # Connected UDP reports an earlier ICMP unreachable here, the wheel might just not be up yet
+                self.errors += 1
+                metrics.errors += 1
+        self.recv_thread.join(1.0)
+        sock.close()
+
+    def _recv_loop(self):
+        sock = self.sock
+        while not self.closing:
+            try:
+                data = sock.recv(256)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.closing:
+                    break
+                time.sleep(0.05)
+                continue
+            self.received += 1
+            for prefixes, callback in self.subscribers:
+                if data.startswith(prefixes):
+                    try:
+                        callback(data)
+                    except Exception as e:
+                        if DEBUG_VERBOSE:
+                            print(f"Reply handler error: {e}")
+
+    def stats(self):
+        return {
+            "peer": f"{self.ip}:{self.port}",
+            "sent": dict(self.sent),
+            "superseded": self.superseded,
+            "received": self.received,
+            "errors": self.errors,
+        }
+
+def acquire_transport(ip, port):
+    # Shared per ip:port and reference counted, the last release closes it
+    key = (ip, int(port))
+    with transports_lock:
+        entry = transports.get(key)
+        if entry is None:
+            entry = transports[key] = [UdpTransport(ip, int(port)), 0]
+        entry[1] += 1
+        return entry[0]
+
+def release_transport(transport):
+    key = (transport.ip, int(transport.port))
+    with transports_lock:
+        entry = transports.get(key)
+        if entry is None or entry[0] is not transport:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del transports[key]
+            transport.close()
+
+# What the UI sees of the latest frame. One of these lives in the channel and the sender fills it in place
+class TelemetryRecord:
+    __slots__ = ("ac_running", "values", "wear_pct")
+
+    def __init__(self):
+        self.ac_running = False
+        self.values = None
+        self.wear_pct = [0.0, 0.0, 0.0, 0.0]
+
+    def fill(self, values, wear):
+        # values in PACKET_FIELDS order, straight from decode_physics. The sender never touches that list again
+        # so it's kept as is, the dict only gets built when somebody reads it
+        self.ac_running = True
+        self.values = values
+        for i in range(4):
+            self.wear_pct[i] = max(0.0, min(100.0, float(wear[i])))
+
+    def to_dict(self):
+        if not self.ac_running or self.values is None:
+            return {"ac_running": False}
+        return build_snapshot(self.values, self.wear_pct)
+
+# Single slot, latest value only handoff from the sender to the web side. The sender is the only writer and never
+# waits, readers retry if they catch it mid write (same idea as the packetId check on the physics page).
+# version goes up on every publish so readers can tell if theres anything new
+class SnapshotChannel:
+    READ_RETRIES = 100
+
+    def __init__(self):
+        self.seq = 0
+        self.version = 0
+        self.status = "Idle"
+        self.record = TelemetryRecord()
+        self.has_record = False
+        self.last_read = (0, "Idle", None)
+
+    def set_status(self, status):
+        self.status = status
+        self.version += 1
+
+    def begin(self):
+        self.seq += 1
+        return self.record
+
+    def commit(self):
+        self.has_record = True
+        self.version += 1
+        self.seq += 1
+
+    def read(self):
+        # (version, status, last dict or None). Writes are a few microseconds, if it's still mid write after
+        # READ_RETRIES tries something went wrong on the sender side, hand back the last good read instead of spinning
+        for _ in range(self.READ_RETRIES):
+            seq = self.seq
+            if seq & 1:
+                time.sleep(0)
+                continue
+            version, status = self.version, self.status
+            last = self.record.to_dict() if self.has_record else None
+            if self.seq == seq:
+                self.last_read = (version, status, last)
+                return self.last_read
+        return self.last_read
+
+telemetry_channel = SnapshotChannel()
+
+# One display the sender feeds. Everything that depends on who is listening lives here: the layout aware send
+# filter, the wire format it negotiated, its delta encoder and acks, its rate limit and its socket. The primary
+# target is the one the app's own heartbeat/caps globals describe, extra ones bring their own HeartbeatSender
+class TelemetryTarget:
+    def __init__(self, ip, port, layout=None, filters=None, wire_format="auto", delta=False,
+                 keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, min_send_interval=MIN_SEND_INTERVAL,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, max_hz=None, heartbeat=None, primary=False):
+        self.ip = ip
+        self.port = int(port)
+        self.wire_format = wire_format
+        self.min_send_interval = min_send_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_interval = 1.0 / float(max_hz) if max_hz else 0.0
+        self.heartbeat = heartbeat
+        self.primary = primary
+        self.send_filter = SendFilter(layout, filters)
+        self.delta = DeltaEncoder(keyframe_interval) if delta else None
+        self.replies = collections.deque(maxlen=64)
+        self.transport = None
+        self.replies_sub = None
+        self.last_send = 0.0
+        self.last_heartbeat = 0.0
+        self.last_payload = b""
+        self.frames_deferred = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.bytes_per_sec = 0.0
+        self.rate_window_start = time.monotonic()
+        self.rate_window_bytes = 0
+
+    def open(self):
+        if self.transport is None:
+            self.transport = acquire_transport(self.ip, self.port)
+            if self.delta is not None:
+                self.replies_sub = self.transport.subscribe((b"KACK:", b"RESYNC"), self.replies.append)
+
+    def close(self):
+        if self.heartbeat is not None and not self.primary:
+            self.heartbeat.stop()
+        if self.transport is not None:
+            if self.replies_sub is not None:
+                self.transport.unsubscribe(self.replies_sub)
+                self.replies_sub = None
+            release_transport(self.transport)
+            self.transport = None
+
+    def caps(self):
+        if self.heartbeat is not None:
+            return self.heartbeat.caps
+        return heartbeat_caps if self.primary else frozenset()
+
+    def link(self):
+        if self.heartbeat is not None:
+            return self.heartbeat.link
+        return link_stats if self.primary else None
+
+    def link_mode(self):
+        # Delta was asked for explicitly so it wins over binary when the wheel can do both
+        caps = self.caps()
+        if self.delta is not None and WIRE_CAP_DELTA in caps:
+            return "delta"
+        if self.wire_format == "auto" and WIRE_CAP_BINARY in caps:
+            return "binary"
+        return "text"
+
+    def send_interval(self):
+        # Whichever is slower of its own rate limit and what its wifi can take right now
+        link = self.link()
+        link_interval = link.send_interval if link is not None else 0.0
+        return link_interval if link_interval > self.max_interval else self.max_interval
+
+    def poll_replies(self):
+        # KACK / RESYNC are queued by the transport's receive thread, the encoder itself only runs on the sender thread
+        replies = self.replies
+        while replies:
+            self.delta.on_reply(replies.popleft())
+
+    def send(self, payload, now):
+        self.transport.send(payload, "telemetry")
+        self.last_send = now
+        self.frames_sent += 1
+        self.bytes_sent += len(payload)
+        self.rate_window_bytes += len(payload)
+        if now - self.rate_window_start >= 1.0:
+            self.bytes_per_sec = self.rate_window_bytes / (now - self.rate_window_start)
+            self.rate_window_start = now
+            self.rate_window_bytes = 0
+
+    def counters(self):
+        return {
+            "ip": self.ip,
+            "port": self.port,
+            "frames_deferred": self.frames_deferred,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_sec": round(self.bytes_per_sec, 1),
+            "wire_format": self.link_mode(),
+            "max_hz": round(1.0 / self.max_interval, 1) if self.max_interval else None,
+            "delta": self.delta.stats() if self.delta else None,
+            "transport": self.transport.stats() if self.transport else None,
+        }
+
+def make_fanout_target(spec, layout=None, filters=None, wire_format="auto", delta=False,
+                       keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, min_send_interval=MIN_SEND_INTERVAL,
+                       heartbeat_interval=HEARTBEAT_INTERVAL):
+    # spec is one entry of the targets list from the web side, anything it leaves out comes from the primary's settings
+    ip = spec.get("ip")
+    if not ip:
+        raise ValueError("Target is missing an ip")
+    port = int(spec.get("port", DEFAULT_PORT))
+    wire_format = spec.get("wire_format", wire_format)
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError("wire_format must be auto or text")
+    max_hz = spec.get("max_hz")
+    max_hz = float(max_hz) if max_hz else None
+    if max_hz is not None and max_hz <= 0:
+        raise ValueError("max_hz must be positive")
+    target_filters = spec.get("filters")
+    return TelemetryTarget(
+        ip, port,
+        layout=spec.get("layout") or layout,
+        filters=target_filters if isinstance(target_filters, dict) else filters,
+        wire_format=wire_format,
+        delta=bool(spec.get("delta", delta)),
+        keyframe_interval=keyframe_interval,
+        min_send_interval=min_send_interval,
+        heartbeat_interval=heartbeat_interval,
+        max_hz=max_hz,
+        heartbeat=HeartbeatSender(ip, port, primary=False),
+    )
+
+class TelemetrySender(threading.Thread):
+    def __init__(self, ip, port, Tire_live, channel, physics_map=None, pacing=None,
+                 min_send_interval=MIN_SEND_INTERVAL, heartbeat_interval=HEARTBEAT_INTERVAL, wire_format="auto",
+                 delta=False, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, layout=None, filters=None, ac_watcher=None,
+                 max_hz=None):
         super().__init__(daemon=True)
         self.ip = ip
         self.port = port
+        self.Tire_live = Tire_live
+        self.channel = channel
+        # Replays and synthetic runs only have physics, the graphics/static pages are for the real game
+        self.session_pages = AcSessionPages() if physics_map is None else None
+        self.physics_map = physics_map or PhysicsMap()
+        self.pacing = pacing or PacingScheduler()
+        self.bin_buf = bytearray(TELEMETRY_BIN.size)
+        # Swapped whole, never edited in place, so the web side can add/remove targets while this thread loops
+        self.targets = (TelemetryTarget(
+            ip, port, layout, filters, wire_format, delta, keyframe_interval,
+            min_send_interval, heartbeat_interval, max_hz, primary=True,
+        ),)
+        self.targets_lock = threading.Lock()
+        self.ac_watcher = ac_watcher or get_ac_watcher()
+        self.recorder = None
         self.stop_event = threading.Event()
+        self.frames_seen = 0
+        self.frames_skipped = 0
+
+    @property
+    def primary(self):
+        return self.targets[0]
+
+    @property
+    def transport(self):
+        return self.primary.transport
 
     def stop(self):
         self.stop_event.set()
 
+    def add_target(self, target):
+        with self.targets_lock:
+            if any(t.ip == target.ip and t.port == target.port for t in self.targets):
+                return False
+            self.targets = self.targets + (target,)
+        return True
+
+    def remove_target(self, ip, port):
+        # The primary stays, stopping telemetry is how that one goes away
+        with self.targets_lock:
+            keep = tuple(t for t in self.targets if t.primary or not (t.ip == ip and t.port == int(port)))
+            gone = [t for t in self.targets if t not in keep]
+            self.targets = keep
+        # The sender thread closes it next time round, it might be halfway through a send to it right now
+        return bool(gone)
+
+    def find_target(self, ip, port):
+        for target in self.targets:
+            if target.ip == ip and target.port == int(port):
+                return target
+        return None
+
+    def counters(self):
+        primary = self.primary
+        out = {
+            "frames_seen": self.frames_seen,
+            "frames_skipped": self.frames_skipped,
+            "frames_deferred": primary.frames_deferred,
+            "frames_sent": primary.frames_sent,
+            "bytes_sent": primary.bytes_sent,
+            "bytes_per_sec": round(primary.bytes_per_sec, 1),
+            "wire_format": primary.link_mode(),
+            "delta": primary.delta.stats() if primary.delta else None,
+        }
+        if len(self.targets) > 1:
+            out["targets"] = [t.counters() for t in self.targets]
+        return out
+
+    def link_mode(self):
+        return self.primary.link_mode()
+
     def run(self):
-        global heartbeat_last, heartbeat_ever
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(("0.0.0.0", 0))
-        sock.settimeout(0.1)
+        opened = []
+        last_print = time.monotonic()
+        last_packet_id = None
+        last_values = None
+        ac_watcher = self.ac_watcher
+        mapped_pid = None
+        print_interval = 0.1 if self.Tire_live else 1.0
+        bin_buf = self.bin_buf
+        metrics = telemetry_metrics
+        perf = time.perf_counter
+        observe_read = metrics.read.observe
+        observe_decode = metrics.decode.observe
+        observe_build = metrics.build.observe
+        observe_jitter = metrics.jitter.observe
+        pacing = self.pacing
+        pages = self.session_pages
+        last_loop = None
 
-        last_send = 0.0
-        while not self.stop_event.is_set():
-            now = time.time()
-            if now - last_send >= ESP_HEARTBEAT_INTERVAL:
-                try:
-                    sock.sendto(b"HB", (self.ip, self.port))
-                except Exception:
-                    if DEBUG_VERBOSE:
-                        print("Heartbeat send error")
-                    pass
-                last_send = now
+        self.channel.set_status("Telemetry running")
 
+        while not self.stop_event.is_set():
+            # How far this loop landed from where the pacing scheduler meant it to, interval is still the one it waited on
+            loop_start = perf()
+            if last_loop is not None:
+                observe_jitter(abs(loop_start - last_loop - pacing.interval))
+            last_loop = loop_start
             try:
-                data, _addr = sock.recvfrom(64)
-                if data.startswith(b"HB_ACK"):
-                    with heartbeat_lock:
-                        heartbeat_last = time.time()
-                        heartbeat_ever = True
-            except socket.timeout:
-                pass
-            except Exception:
-                if DEBUG_VERBOSE:
-                    print("Heartbeat receive error")
+                targets = self.targets
+                if len(opened) != len(targets) or any(a is not b for a, b in zip(opened, targets)):
+                    for target in opened:
+                        if target not in targets:
+                            target.close()
+                    for target in targets:
+                        target.open()
+                    opened = list(targets)
+
+                # Check if Assetto Corsa is running, the watcher thread keeps this up to date
+                if not ac_watcher.running:
+                    # Dont send data if its not running, and let go of the mapping so a restart gets a fresh one
+                    self.physics_map.close()
+                    if pages is not None:
+                        pages.close()
+                    now = time.monotonic()
+                    if now - last_print > print_interval:
+                        try:
+                            self.channel.begin().ac_running = False
+                        finally:
+                            self.channel.commit()
+                        last_print = now
+                    self.stop_event.wait(0.5)
+                    for target in targets:
+                        target.last_payload = b""
+                    last_packet_id = None
+                    last_loop = None
+                    continue
+
+                # Different pid than when we mapped it means AC restarted in between watcher checks
+                if self.physics_map.is_open() and ac_watcher.pid != mapped_pid:
+                    self.physics_map.close()
+                    if pages is not None:
+                        pages.close()
+                    last_packet_id = None
+
+                if not self.physics_map.is_open():
+                    try:
+                        mapped_pid = ac_watcher.pid
+                        self.physics_map.open()
+                    except Exception:
+                        # ac is probably starting so wait and retry
+                        self.stop_event.wait(0.5)
+                        last_loop = None
+                        continue
+
+                started = perf()
+                physics = self.physics_map.read()
+                observe_read(perf() - started)
+                # Graphics/static only when due, on every other frame this is the one comparison
+                if pages is not None and started >= pages.next_poll:
+                    pages.poll(started)
+                self.frames_seen += 1
+                for target in targets:
+                    if target.delta is not None:
+                        target.poll_replies()
+
+                # AC hasnt published a new frame, nothing below would change so skip it and just keep the links alive
+                if physics.packetId == last_packet_id:
+                    self.frames_skipped += 1
+                    metrics.frames_skipped += 1
+                    now = time.monotonic()
+                    for target in targets:
+                        if (target.last_payload and (now - target.last_heartbeat) >= target.heartbeat_interval
+                                and (now - target.last_send) >= target.min_send_interval):
+                            target.send(target.last_payload, now)
+                            target.last_heartbeat = now
+                    pacing.tick(now, False, False)
+                    pacing.wait(self.stop_event)
+                    continue
+                last_packet_id = physics.packetId
+                metrics.frames += 1
+                rec = self.recorder
+                if rec is not None:
+                    rec.push(physics, time.monotonic(), pages.lap if pages is not None else None)
+
+                # Decoded once per frame. Each target quantizes its own copy (filters can differ), and identical
+                # results share one encode per format
+                started = perf()
+                values = decode_physics(physics)
+                observe_decode(perf() - started)
+                now = time.monotonic()
+                encoded = {}
+                for target in targets:
+                    send_filter = target.send_filter
+                    tv = list(values)
+                    send_filter.quantize(tv)
+                    changed = send_filter.should_send(tv, now)
+                    heartbeat_due = (now - target.last_heartbeat) >= target.heartbeat_interval
+                    rate_ok = (now - target.last_send) >= target.min_send_interval
+                    # Struggling wifi or a rate capped target gets fewer packets, the change stays pending for later
+                    interval = target.send_interval()
+                    if changed and interval and (now - target.last_send) < interval:
+                        changed = False
+                        target.frames_deferred += 1
+                        metrics.deferred += 1
+
+                    if changed or (heartbeat_due and rate_ok):
+                        started = perf()
+                        mode = target.link_mode()
+                        key = tuple(tv)
+                        if mode == "binary":
+                            payload = encoded.get(("binary", key))
+                            if payload is None:
+                                pack_binary_frame(bin_buf, tv)
+                                payload = encoded[("binary", key)] = bytes(bin_buf)
+                        elif mode == "delta":
+                            parts = encoded.get(("parts", key))
+                            if parts is None:
+                                parts = encoded[("parts", key)] = packet_parts(tv)
+                            payload = target.delta.encode(parts, now)
+                        else:
+                            payload = encoded.get(("text", key))
+                            if payload is None:
+                                payload = encoded[("text", key)] = encode_text(tv)
+                        observe_build(perf() - started)
+                        send_filter.mark_sent(tv, now)
+                        target.last_payload = payload
+                        target.send(payload, now)
+                        if heartbeat_due:
+                            target.last_heartbeat = now
+                # Active is the raw decode moving, not a target wanting a send. A gear only layout filters out
+                # most frames but the car is still driving
+                pacing.tick(now, True, values != last_values)
+                last_values = values
+
+                ui_interval = stream_ui_interval
+                if now - last_print > (min(print_interval, ui_interval) if ui_interval else print_interval):
+                    # values is still the unrounded decode, targets only ever quantized copies of it
+                    channel = self.channel
+                    record = channel.begin()
+                    try:
+                        record.fill(values, physics.TireWear)
+                    finally:
+                        # Even if fill blows up, an odd seq left behind would have readers retrying forever
+                        channel.commit()
+                    last_print = now
+
+            except Exception as e:
+                metrics.errors += 1
+                self.channel.set_status("Error")
+                if DEBUG_VERBOSE:
+                    print(f"Telemetry error: {e}")
+                break
+
+            pacing.wait(self.stop_event)
+
+        for target in set(opened) | set(self.targets):
+            target.close()
+        self.physics_map.close()
+        if pages is not None:
+            pages.close()
+        self.channel.set_status("Telemetry stopped")
+
+# Round trip stats from echoed heartbeats. Each HB carries seq:sent_us, the wheel sends that back in its HB_ACK.
+# One unanswered for longer than ESP_HEARTBEAT_TIMEOUT counts as lost, but only once the wheel has shown it echoes,
+# firmware that doesnt would otherwise look like 100% loss
+class LinkStats:
+    def __init__(self, window=LINK_WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.pending = collections.OrderedDict()
+            self.samples = collections.deque(maxlen=self.window)
+            self.echo = False
+            self.level = "unknown"
+            # Read by the telemetry sender every frame, so its worked out here and not there
+            self.send_interval = 0.0
+
+    def on_send(self, seq, now):
+        with self.lock:
+            self.pending[seq] = now
+            while self.pending:
+                old_seq, sent = next(iter(self.pending.items()))
+                if now - sent < ESP_HEARTBEAT_TIMEOUT:
+                    break
+                del self.pending[old_seq]
+                if self.echo:
+                    self.samples.append(None)
+            self._judge()
+
+    def on_ack(self, seq, sent_us, now):
+        with self.lock:
+            # Late acks for something already counted lost are ignored, so are duplicates
+            if self.pending.pop(seq, None) is None:
+                return
+            self.echo = True
+            self.samples.append(max(0.0, now - sent_us / 1e6))
+            self._judge()
+
+    def _stats(self):
+        rtts = [r for r in self.samples if r is not None]
+        lost = len(self.samples) - len(rtts)
+        jitter = (sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)) if len(rtts) > 1 else 0.0
+        return rtts, lost, jitter
+
+    def _judge(self):
+        rtts, lost, _jitter = self._stats()
+        if len(self.samples) < LINK_MIN_SAMPLES:
+            self.level, self.send_interval = ("unknown" if not self.echo else "ok"), 0.0
+            return
+        loss = lost / len(self.samples)
+        p95 = _percentile(sorted(rtts), 95) if rtts else float("inf")
+        if loss >= LINK_BAD_LOSS or p95 >= LINK_BAD_RTT:
+            self.level, self.send_interval = "bad", 1.0 / LINK_BAD_SEND_HZ
+        elif loss >= LINK_DEGRADED_LOSS or p95 >= LINK_DEGRADED_RTT:
+            self.level, self.send_interval = "degraded", 1.0 / LINK_DEGRADED_SEND_HZ
+        else:
+            self.level, self.send_interval = "ok", 0.0
+
+    def status(self):
+        with self.lock:
+            rtts, lost, jitter = self._stats()
+            ordered = sorted(rtts)
+            return {
+                "echo": self.echo,
+                "samples": len(self.samples),
+                "loss": round(lost / len(self.samples), 3) if self.samples else None,
+                "rtt_ms": {
+                    "p50": round(_percentile(ordered, 50) * 1000, 2),
+                    "p95": round(_percentile(ordered, 95) * 1000, 2),
+                    "p99": round(_percentile(ordered, 99) * 1000, 2),
+                    "max": round(ordered[-1] * 1000, 2),
+                } if ordered else None,
+                "jitter_ms": round(jitter * 1000, 2),
+                "level": self.level,
+                "send_hz_cap": round(1.0 / self.send_interval, 1) if self.send_interval else None,
+            }
+
+link_stats = LinkStats()
+
+# The primary one (the wheel telemetry/start was pointed at) feeds the app wide heartbeat globals and link_stats,
+# extra fan-out displays keep their caps and round trips to themselves
+class HeartbeatSender(threading.Thread):
+    def __init__(self, ip, port, offer_caps=(WIRE_CAP_BINARY, WIRE_CAP_DELTA), primary=True):
+        super().__init__(daemon=True)
+        self.ip = ip
+        self.port = port
+        self.primary = primary
+        # Old firmware acks anything starting with HB with a bare HB_ACK, so offering caps is harmless.
+        # Anything after | is echoed back by firmware that measures round trips, older firmware just ignores it
+        self.hb_prefix = "HB:" + ",".join(offer_caps) if offer_caps else "HB"
+        self.seq = 0
+        self.caps = frozenset()
+        self.last_ack = 0.0
+        self.link = link_stats if primary else LinkStats()
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _on_ack(self, data):
+        # Runs on the transport's receive thread
+        global heartbeat_last, heartbeat_ever, heartbeat_caps
+        arrived = time.monotonic()
+        body, _sep, echo = data.partition(b"|")
+        caps = body[7:].decode("ascii", "ignore").split(",") if body.startswith(b"HB_ACK:") else []
+        self.caps = frozenset(c for c in caps if c)
+        self.last_ack = time.time()
+        if self.primary:
+            with heartbeat_lock:
+                heartbeat_last = self.last_ack
+                heartbeat_ever = True
+                heartbeat_caps = self.caps
+        if echo:
+            seq, _sep, sent_us = echo.partition(b":")
+            try:
+                self.link.on_ack(int(seq), int(sent_us), arrived)
+            except ValueError:
                 pass
 
-        sock.close()
+    def status(self):
+        return {
+            "connected": bool(self.last_ack) and (time.time() - self.last_ack) <= ESP_HEARTBEAT_TIMEOUT,
+            "caps": sorted(self.caps),
+            "link": self.link.status(),
+        }
+
+    def run(self):
+        transport = acquire_transport(self.ip, self.port)
+        sub = transport.subscribe((b"HB_ACK",), self._on_ack)
+        link = self.link
+        while not self.stop_event.is_set():
+            self.seq += 1
+            sent = time.monotonic()
+            transport.send(f"{self.hb_prefix}|{self.seq}:{int(sent * 1e6)}".encode(), "heartbeat")
+            link.on_send(self.seq, sent)
+            self.stop_event.wait(ESP_HEARTBEAT_INTERVAL)
+        transport.unsubscribe(sub)
+        release_transport(transport)
+
+# Flashing
+# Flash output as a ring of numbered lines, so pollers ask for "everything after line N" instead of the whole log.
+# Line numbers keep counting when old lines fall off the front, skipped tells a slow reader how many it missed
+class FlashJob:
+    def __init__(self, bin_path=None, port=None, steps=(), kind="flash"):
+        self.port = port
+        self.steps = list(steps)
+        self.kind = kind
+        self.state = "queued"
+        self.lines = collections.deque(maxlen=FLASH_LOG_LINES)
+        self.next_line = 0
+        self.done = False
+        self.ok = False
+        self.bin_path = bin_path
+        self.progress = None
+        self.finished_at = None
+        self.cond = threading.Condition()
+
+    def add(self, line):
+        with self.cond:
+            self.lines.append((self.next_line, line))
+            self.next_line += 1
+            # esptool prints "Writing at 0x00010000... (12 %)" (or a bar ending in "12.5%" on newer versions)
+            if "Writing at" in line:
+                m = FLASH_PROGRESS_RE.search(line)
+                if m:
+                    self.progress = min(100.0, float(m.group(1)))
+            elif "Hash of data verified" in line:
+                self.progress = 100.0
+            self.cond.notify_all()
+
+    def finish(self, ok):
+        with self.cond:
+            self.ok = ok
+            self.done = True
+            self.state = "done"
+            self.finished_at = time.monotonic()
+            self.cond.notify_all()
+
+    def read(self, since=0, wait=0.0):
+        # Lines numbered since and up, waiting up to wait seconds for some if there arent any yet
+        with self.cond:
+            if wait > 0 and since >= self.next_line and not self.done:
+                self.cond.wait(wait)
+            first = self.lines[0][0] if self.lines else self.next_line
+            lines = [text for n, text in self.lines if n >= since]
+            return {
+                "ok": self.ok,
+                "done": self.done,
+                "state": self.state,
+                "lines": lines,
+                "next": self.next_line,
+                "skipped": max(0, first - since),
+                "progress": self.progress,
+            }
+
+    def summary(self, job_id):
+        return {
+            "job": job_id,
+            "port": self.port,
+            "kind": self.kind,
+            "state": self.state,
+            "ok": self.ok,
+            "progress": self.progress,
+            "last": self.lines[-1][1] if self.lines else None,
+        }
+
+def evict_flash_jobs():
+    # Finished jobs go after FLASH_JOB_TTL, and only the newest FLASH_JOBS_KEEP finished ones are kept at all
+    now = time.monotonic()
+    with flash_lock:
+        finished = sorted((j.finished_at, job_id) for job_id, j in flash_jobs.items() if j.done)
+        extra = len(finished) - FLASH_JOBS_KEEP
+        for i, (finished_at, job_id) in enumerate(finished):
+            if i < extra or now - finished_at > FLASH_JOB_TTL:
+                del flash_jobs[job_id]
+
+# esptool write-flash as one step of a FlashJob, run() logs into the job and returns whether it worked
+def load_esptool():
+    # Imported once and kept, run_server warms this up in the background so the first flash doesnt pay for it
+    global esptool_module
+    with esptool_lock:
+        if esptool_module is None:
+            try:
+                import esptool
+                esptool_module = esptool
+            except Exception as e:
+                if DEBUG_VERBOSE:
+                    print(f"esptool not importable, flashing will use a subprocess: {e}")
+                esptool_module = False
+        return esptool_module or None
+
+# Version of the imported module, or of the installed package (without importing it) when there's no module
+def esptool_version(mod=None):
+    try:
+        version = mod.__version__ if mod is not None else importlib.metadata.version("esptool")
+        return tuple(int(part) for part in str(version).split(".")[:2])
+    except Exception:
+        return (0,)
+
+# sys.stdout/stderr stand in that sends writes from a capturing thread to that thread's sink, everyone else still
+# gets the real console. Only there while a capture is running, the last one out puts the real streams back
+class _ThreadOutput:
+    def __init__(self, original):
+        self.original = original
+
+    def write(self, text):
+        sink = getattr(output_capture, "sink", None)
+        if sink is None:
+            return self.original.write(text) if self.original else len(text)
+        sink.feed(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(output_capture, "sink", None) is None and self.original:
+            self.original.flush()
+
+    def isatty(self):
+        # esptool redraws progress with \r on a tty, one line per update otherwise which is what the log wants
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+class _LineSink:
+    def __init__(self, add):
+        self.add = add
+        self.partial = ""
+
+    def feed(self, text):
+        text = self.partial + text.replace("\r", "\n")
+        *lines, self.partial = text.split("\n")
+        for line in lines:
+            if line.strip():
+                self.add(line.rstrip())
+
+    def close(self):
+        if self.partial.strip():
+            self.add(self.partial.rstrip())
+        self.partial = ""
+
+class ThreadOutputCapture:
+    def __init__(self, add):
+        self.sink = _LineSink(add)
+
+    def __enter__(self):
+        global output_capture_users
+        with esptool_lock:
+            output_capture_users += 1
+            if not isinstance(sys.stdout, _ThreadOutput):
+                sys.stdout = _ThreadOutput(sys.stdout)
+            if not isinstance(sys.stderr, _ThreadOutput):
+                sys.stderr = _ThreadOutput(sys.stderr)
+        output_capture.sink = self.sink
+        return self.sink
+
+    def __exit__(self, *exc):
+        global output_capture_users
+        output_capture.sink = None
+        self.sink.close()
+        with esptool_lock:
+            output_capture_users -= 1
+            if output_capture_users == 0:
+                if isinstance(sys.stdout, _ThreadOutput):
+                    sys.stdout = sys.stdout.original
+                if isinstance(sys.stderr, _ThreadOutput):
+                    sys.stderr = sys.stderr.original
+        return False
+
+class FlashRunner:
+    def __init__(self, chip, port, baud, bin_path, compress=True, skip_unchanged=True, mode="auto"):
+        self.chip = chip
+        self.port = port
+        self.baud = baud
+        self.bin_path = bin_path
+        self.compress = compress
+        self.skip_unchanged = skip_unchanged
+        self.mode = mode
+
+    def __call__(self, job):
+        return self.run(job)
+
+    def _args(self, version):
+        args = ["--chip", self.chip, "--port", self.port, "--baud", str(self.baud), "write-flash"]
+        if self.compress:
+            args.append("--compress")
+        # Checks the md5 of what's on the chip first and skips the write if it matches. Only esptool 5.5+ has it,
+        # older ones reject unknown options so leave it out when the version isn't known
+        if self.skip_unchanged and version >= (5, 5):
+            args.append("--skip-flashed")
+        return args + ["0x0", self.bin_path]
+
+    def run(self, job):
+        esptool_mod = load_esptool() if self.mode in ("auto", "inprocess") else None
+        if esptool_mod is None:
+            if self.mode == "inprocess":
+                job.add("Flash error: esptool could not be imported in this build")
+                job.add("Install esptool with: pip install esptool")
+                return False
+            return self._run_subprocess(job)
+        # esptool logs through a process wide singleton, so two main() calls at once mix up each other's state.
+        # One port flashes in-process at a time, the others get a subprocess (or wait if there's nothing to start)
+        wait = self.mode == "inprocess" or self._subprocess_cmd() is None
+        if not esptool_run_lock.acquire(blocking=wait):
+            job.add("Another port is flashing in-process, using a separate esptool process")
+            return self._run_subprocess(job)
+        try:
+            return self._run_inprocess(job, esptool_mod)
+        finally:
+            esptool_run_lock.release()
+
+    def _run_inprocess(self, job, esptool_mod):
+        # Same esptool, already imported, no interpreter start. Its prints for this thread go into the job log
+        args = self._args(esptool_version(esptool_mod))
+        job.add("Running esptool " + " ".join(args))
+        with ThreadOutputCapture(job.add):
+            try:
+                esptool_mod.main(args)
+                return True
+            except SystemExit as e:
+                return e.code in (0, None)
+            except Exception as e:
+                job.add(f"Flash error: {e}")
+                return False
+
+    def _subprocess_cmd(self):
+        if getattr(sys, "frozen", False):
+            # Whatever python/esptool is on PATH, no telling which version
+            base_args = self._args((0,))
+            py_launcher = shutil.which("py")
+            python_cmd = shutil.which("python")
+            esptool_exe = shutil.which("esptool") or shutil.which("esptool.exe")
+
+            if py_launcher:
+                return [py_launcher, "-m", "esptool", *base_args]
+            elif python_cmd:
+                return [python_cmd, "-m", "esptool", *base_args]
+            elif esptool_exe:
+                return [esptool_exe, *base_args]
+            return None
+        return [sys.executable, "-m", "esptool", *self._args(esptool_version())]
+
+    def _run_subprocess(self, job):
+        cmd = self._subprocess_cmd()
+        if cmd is None:
+            job.add("Flash error: cannot find Python launcher or esptool in PATH")
+            job.add("Install esptool with: pip install esptool")
+            return False
+
+        job.add("Running: " + " ".join(cmd))
+        if DEBUG_VERBOSE:
+            print("Running flash command:", " ".join(cmd))
+
+        creationflags = 0
+        startupinfo = None
+        if os.name == "nt":
+            creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = 0
+
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                startupinfo=startupinfo,
+                creationflags=creationflags,
+            )
+        except Exception as e:
+            job.add(f"Flash error: Failed to start esptool: {e}")
+            if "esptool" in str(e).lower() or "module" in str(e).lower():
+                job.add("Make sure esptool is installed: pip install esptool")
+            return False
+
+        try:
+            for line in proc.stdout:
+                job.add(line.rstrip())
+        except Exception as e:
+            job.add(f"Error reading output: {e}")
+
+        rc = proc.wait()
+        return rc == 0
+
+# Wifi provisioning as a job step, for "flash then send wifi" chains. The board reboots after esptool is done,
+# give it a moment before opening the port again
+class WifiStep:
+    def __init__(self, port, baud, ssid, password, delay=0.0):
+        self.port = port
+        self.baud = baud
+        self.ssid = ssid
+        self.password = password
+        self.delay = delay
+
+    def __call__(self, job):
+        if not SERIAL_AVAILABLE:
+            job.add("WiFi error: pyserial not installed")
+            return False
+        if self.delay:
+            job.add(f"Waiting {self.delay:.0f}s for the board to boot...")
+            time.sleep(self.delay)
+        job.add(f"Sending WiFi credentials for {self.ssid} on {self.port}")
+        ok, err = send_wifi_credentials(self.port, self.baud, self.ssid, self.password)
+        job.add("WiFi credentials sent" if ok else f"WiFi error: {err}")
+        return ok
+
+# One of these per serial port. Jobs on the same port run one after the other, different ports run side by side
+class PortWorker(threading.Thread):
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.port = port
+        self.jobs = queue.Queue()
+        self.current = None
+        self.pending = []
+
+    def submit(self, job_id, job):
+        with flash_lock:
+            self.pending.append(job_id)
+        self.jobs.put((job_id, job))
+
+    def run(self):
+        while True:
+            job_id, job = self.jobs.get()
+            with flash_lock:
+                self.pending.remove(job_id)
+                self.current = job_id
+            job.state = "running"
+            ok = True
+            try:
+                for step in job.steps:
+                    ok = step(job)
+                    if not ok:
+                        break
+            except Exception as e:
+                job.add(f"Job error: {e}")
+                ok = False
+            job.finish(ok)
+            with flash_lock:
+                self.current = None
+
+class FlashScheduler:
+    def __init__(self):
+        self.workers = {}
+
+    def submit(self, port, steps, bin_path=None, kind="flash"):
+        global flash_seq
+        evict_flash_jobs()
+        job = FlashJob(bin_path, port=port, steps=steps, kind=kind)
+        with flash_lock:
+            flash_seq += 1
+            job_id = f"job_{flash_seq}"
+            flash_jobs[job_id] = job
+            worker = self.workers.get(port)
+            if worker is None:
+                worker = self.workers[port] = PortWorker(port)
+                worker.start()
+        worker.submit(job_id, job)
+        return job_id
+
+    def busy(self, port):
+        with flash_lock:
+            worker = self.workers.get(port)
+            return worker is not None and (worker.current is not None or bool(worker.pending))
+
+    def status(self):
+        evict_flash_jobs()
+        with flash_lock:
+            ports = {
+                port: {"running": w.current, "queued": list(w.pending)}
+                for port, w in self.workers.items()
+            }
+            jobs = [job.summary(job_id) for job_id, job in flash_jobs.items()]
+        return {
+            "ports": ports,
+            "jobs": jobs,
+            "active": sum(1 for p in ports.values() if p["running"]),
+            "queued": sum(len(p["queued"]) for p in ports.values()),
+        }
+
+flash_scheduler = FlashScheduler()
+
+# Shared memory map, more of these may be added later to the esp32's gui, it depends on demand for specific features
+class MemMap(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [
+        ("packetId", ctypes.c_int32),
+        ("gas", ctypes.c_float),
+        ("brake", ctypes.c_float),
+        ("fuel", ctypes.c_float),
+        ("gear", ctypes.c_int32),
+        ("rpms", ctypes.c_int32),
+        ("steerAngle", ctypes.c_float),
+        ("speedKmh", ctypes.c_float),
+        ("velocity", ctypes.c_float * 3),
+        ("accG", ctypes.c_float * 3),
+        ("wheelSlip", ctypes.c_float * 4),
+        ("wheelLoad", ctypes.c_float * 4),
+        ("wheelsPressure", ctypes.c_float * 4),
+        ("wheelAngularSpeed", ctypes.c_float * 4),
+        ("TireWear", ctypes.c_float * 4),
+        ("TireDirtyLevel", ctypes.c_float * 4),
+        ("TireCoreTemperature", ctypes.c_float * 4),
+        ("camberRAD", ctypes.c_float * 4),
+        ("suspensionTravel", ctypes.c_float * 4),
+        ("drs", ctypes.c_float),
+        ("tc", ctypes.c_float),
+        ("heading", ctypes.c_float),
+        ("pitch", ctypes.c_float),
+        ("roll", ctypes.c_float),
+        ("cgHeight", ctypes.c_float),
+        ("carDamage", ctypes.c_float * 5),
+        ("numberOfTiresOut", ctypes.c_int32),
+        ("pitLimiterOn", ctypes.c_int32),
+        ("abs", ctypes.c_float),
+        ("kersCharge", ctypes.c_float),
+        ("kersInput", ctypes.c_float),
+        ("autoShifterOn", ctypes.c_int32),
+        ("rideHeight", ctypes.c_float * 2),
+        ("turboBoost", ctypes.c_float),
+        ("ballast", ctypes.c_float),
+        ("airDensity", ctypes.c_float),
+        ("airTemp", ctypes.c_float),
+        ("roadTemp", ctypes.c_float),
+        ("localAngularVel", ctypes.c_float * 3),
+        ("finalFF", ctypes.c_float),
+        ("performanceMeter", ctypes.c_float),
+        ("engineBrake", ctypes.c_int32),
+        ("ersRecoveryLevel", ctypes.c_int32),
+        ("ersPowerLevel", ctypes.c_int32),
+        ("ersHeatCharging", ctypes.c_int32),
+        ("ersIsCharging", ctypes.c_int32),
+        ("kersCurrentKJ", ctypes.c_float),
+        ("drsAvailable", ctypes.c_int32),
+        ("drsEnabled", ctypes.c_int32),
+        ("brakeTemp", ctypes.c_float * 4),
+        ("clutch", ctypes.c_float),
+    ]
+
+PHYSICS_SIZE = ctypes.sizeof(MemMap)
+
+# acpmf_graphics, AC writes it a few times a second. Strings are wchar_t (2 bytes on windows) so theyre read as
+# uint16 and decoded with _wstr, that way the layout is the same on linux for file backed testing
+class GraphicsPage(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [
+        ("packetId", ctypes.c_int32),
+        ("status", ctypes.c_int32),
+        ("session", ctypes.c_int32),
+        ("currentTime", ctypes.c_uint16 * 15),
+        ("lastTime", ctypes.c_uint16 * 15),
+        ("bestTime", ctypes.c_uint16 * 15),
+        ("split", ctypes.c_uint16 * 15),
+        ("completedLaps", ctypes.c_int32),
+        ("position", ctypes.c_int32),
+        ("iCurrentTime", ctypes.c_int32),
+        ("iLastTime", ctypes.c_int32),
+        ("iBestTime", ctypes.c_int32),
+        ("sessionTimeLeft", ctypes.c_float),
+        ("distanceTraveled", ctypes.c_float),
+        ("isInPit", ctypes.c_int32),
+        ("currentSectorIndex", ctypes.c_int32),
+        ("lastSectorTime", ctypes.c_int32),
+        ("numberOfLaps", ctypes.c_int32),
+        ("tyreCompound", ctypes.c_uint16 * 33),
+        ("replayTimeMultiplier", ctypes.c_float),
+        ("normalizedCarPosition", ctypes.c_float),
+        ("carCoordinates", ctypes.c_float * 3),
+        ("penaltyTime", ctypes.c_float),
+        ("flag", ctypes.c_int32),
+        ("idealLineOn", ctypes.c_int32),
+        ("isInPitLane", ctypes.c_int32),
+        ("surfaceGrip", ctypes.c_float),
+        ("mandatoryPitDone", ctypes.c_int32),
+        ("windSpeed", ctypes.c_float),
+        ("windDirection", ctypes.c_float),
+        ("isSetupMenuVisible", ctypes.c_int32),
+        ("mainDisplayIndex", ctypes.c_int32),
+        ("secondaryDisplayIndex", ctypes.c_int32),
+        ("TC", ctypes.c_int32),
+        ("TCCut", ctypes.c_int32),
+        ("EngineMap", ctypes.c_int32),
+        ("ABS", ctypes.c_int32),
+        ("fuelXLap", ctypes.c_float),
+    ]
+
+# acpmf_static, written once when a session loads
+class StaticPage(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [
+        ("smVersion", ctypes.c_uint16 * 15),
+        ("acVersion", ctypes.c_uint16 * 15),
+        ("numberOfSessions", ctypes.c_int32),
+        ("numCars", ctypes.c_int32),
+        ("carModel", ctypes.c_uint16 * 33),
+        ("track", ctypes.c_uint16 * 33),
+        ("playerName", ctypes.c_uint16 * 33),
+        ("playerSurname", ctypes.c_uint16 * 33),
+        ("playerNick", ctypes.c_uint16 * 33),
+        ("sectorCount", ctypes.c_int32),
+        ("maxTorque", ctypes.c_float),
+        ("maxPower", ctypes.c_float),
+        ("maxRpm", ctypes.c_int32),
+        ("maxFuel", ctypes.c_float),
+        ("suspensionMaxTravel", ctypes.c_float * 4),
+        ("tyreRadius", ctypes.c_float * 4),
+        ("maxTurboBoost", ctypes.c_float),
+        ("deprecated_1", ctypes.c_float),
+        ("deprecated_2", ctypes.c_float),
+        ("penaltiesEnabled", ctypes.c_int32),
+        ("aidFuelRate", ctypes.c_float),
+        ("aidTireRate", ctypes.c_float),
+        ("aidMechanicalDamage", ctypes.c_float),
+        ("aidAllowTyreBlankets", ctypes.c_int32),
+        ("aidStability", ctypes.c_float),
+        ("aidAutoClutch", ctypes.c_int32),
+        ("aidAutoBlip", ctypes.c_int32),
+        ("hasDRS", ctypes.c_int32),
+        ("hasERS", ctypes.c_int32),
+        ("hasKERS", ctypes.c_int32),
+        ("kersMaxJ", ctypes.c_float),
+        ("engineBrakeSettingsCount", ctypes.c_int32),
+        ("ersPowerControllerCount", ctypes.c_int32),
+        ("trackSPlineLength", ctypes.c_float),
+        ("trackConfiguration", ctypes.c_uint16 * 33),
+    ]
+
+# Long lived view of the physics page. Mapping it every tick was two copies and a kernel round trip 200 times a second,
+# so this maps it once, overlays MemMap straight on top of the mapping and copies out a snapshot when asked.
+# The graphics and static pages are the same thing with a different STRUCT and TAGNAME
+class PhysicsMap:
+    STRUCT = MemMap
+    TAGNAME = "acpmf_physics"
+    SNAPSHOT_RETRIES = 4
+
+    def __init__(self):
+        self.size = ctypes.sizeof(self.STRUCT)
+        self.mm = None
+        self.live = None
+        self.live_id = None
+        self.snapshot = self.STRUCT()
+        self.snapshot_bytes = memoryview(self.snapshot).cast("B")
+        self.torn_reads = 0
+
+    def _open_mmap(self):
+        return mmap.mmap(-1, self.size, tagname=self.TAGNAME, access=mmap.ACCESS_READ)
+
+    def is_open(self):
+        return self.mm is not None
+
+    def open(self):
+        if self.mm is not None:
+            return
+        mm = self._open_mmap()
+        try:
+            # Read only, so no ctypes overlay (that needs a writable buffer). Views copy straight out of the mapping,
+            # and live_id watches packetId for torn reads
+            live = memoryview(mm)[:self.size]
+            offset = self.STRUCT.packetId.offset if hasattr(self.STRUCT, "packetId") else 0
+            self.live_id = live[offset:offset + 4].cast("i")
+            self.live = live
+        except Exception:
+            self.live = self.live_id = None
+            mm.close()
+            raise
+        self.mm = mm
+
+    def close(self):
+        # The views have to go first or mmap.close() refuses with exported pointers
+        for view in (self.live_id, self.live):
+            if view is not None:
+                view.release()
+        self.live = self.live_id = None
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except Exception:
+                pass
+            self.mm = None
+
+    def read(self):
+        # AC can be halfway through writing a frame, so copy and make sure packetId didnt move under us
+        live = self.live
+        if live is None:
+            return None
+        live_id = self.live_id
+        dst = self.snapshot_bytes
+        for _ in range(self.SNAPSHOT_RETRIES):
+            before = live_id[0]
+            dst[:] = live
+            if live_id[0] == before:
+                return self.snapshot
+            self.torn_reads += 1
+        return self.snapshot
+
+class GraphicsMap(PhysicsMap):
+    STRUCT = GraphicsPage
+    TAGNAME = "acpmf_graphics"
+
+class StaticMap(PhysicsMap):
+    STRUCT = StaticPage
+    TAGNAME = "acpmf_static"
+
+    def read(self):
+        # No packetId, it only changes between sessions so a plain copy is fine
+        live = self.live
+        if live is None:
+            return None
+        self.snapshot_bytes[:] = live
+        return self.snapshot
+
+# Same layout as the AC page but backed by a normal file, so the read path can be benchmarked on linux
+class FilePhysicsMap(PhysicsMap):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def _open_mmap(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.size:
+            with open(self.path, "wb") as f:
+                f.write(b"\0" * self.size)
+        # Writable so publish can stand in for AC, reading works the same either way
+        with open(self.path, "r+b") as f:
+            return mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_WRITE)
+
+    def publish(self, physics):
+        # Writes a frame into the file the same way AC would
+        self.open()
+        self.live[:] = memoryview(physics).cast("B")
+
+def _wstr(chars):
+    return bytes(chars).decode("utf-16-le", "ignore").split("\0", 1)[0]
+
+def decode_graphics(g):
+    return {
+        "status": AC_STATUS.get(g.status, g.status),
+        "session": AC_SESSION_TYPES.get(g.session, g.session),
+        "completed_laps": g.completedLaps,
+        "position": g.position,
+        "current_ms": g.iCurrentTime,
+        "last_ms": g.iLastTime,
+        "best_ms": g.iBestTime,
+        "current_time": _wstr(g.currentTime),
+        "last_time": _wstr(g.lastTime),
+        "best_time": _wstr(g.bestTime),
+        "sector": g.currentSectorIndex,
+        "last_sector_ms": g.lastSectorTime,
+        "number_of_laps": g.numberOfLaps,
+        "session_time_left": round(g.sessionTimeLeft, 1),
+        "distance_traveled": round(g.distanceTraveled, 1),
+        "lap_position": round(g.normalizedCarPosition, 4),
+        "tyre_compound": _wstr(g.tyreCompound),
+        "in_pit": bool(g.isInPit),
+        "in_pit_lane": bool(g.isInPitLane),
+        "flag": g.flag,
+        "tc_level": g.TC,
+        "abs_level": g.ABS,
+        "engine_map": g.EngineMap,
+        "fuel_per_lap": round(g.fuelXLap, 3),
+    }
+
+def decode_static(st):
+    return {
+        "sm_version": _wstr(st.smVersion),
+        "ac_version": _wstr(st.acVersion),
+        "car_model": _wstr(st.carModel),
+        "track": _wstr(st.track),
+        "track_configuration": _wstr(st.trackConfiguration),
+        "track_length": round(st.trackSPlineLength, 1),
+        "player": " ".join(n for n in (_wstr(st.playerName), _wstr(st.playerSurname)) if n),
+        "max_rpm": st.maxRpm,
+        "max_fuel": round(st.maxFuel, 1),
+        "max_power": round(st.maxPower, 1),
+        "max_torque": round(st.maxTorque, 1),
+        "max_turbo_boost": round(st.maxTurboBoost, 2),
+        "sector_count": st.sectorCount,
+        "has_drs": bool(st.hasDRS),
+        "has_ers": bool(st.hasERS),
+        "has_kers": bool(st.hasKERS),
+    }
+
+# The slow pages next to the physics fast path. Graphics is checked every AC_GRAPHICS_INTERVAL and only decoded when
+# its packetId moved, static is read once per session (again if the session or status changes, or it was still
+# empty because AC hadnt finished loading). Both results are swapped in whole so the web side can just read them
+class AcSessionPages:
+    def __init__(self, graphics_map=None, static_map=None, interval=AC_GRAPHICS_INTERVAL):
+        self.graphics_map = graphics_map or GraphicsMap()
+        self.static_map = static_map or StaticMap()
+        self.interval = interval
+        self.next_poll = 0.0
+        self.graphics_packet = None
+        self.session_key = None
+        self.graphics = None
+        self.static = None
+        self.lap = None
+        self.graphics_reads = 0
+        self.graphics_updates = 0
+        self.static_reads = 0
+
+    def poll(self, now):
+        if now < self.next_poll:
+            return
+        self.next_poll = now + self.interval
+        try:
+            self.graphics_map.open()
+            self.static_map.open()
+        except Exception:
+            return
+        g = self.graphics_map.read()
+        self.graphics_reads += 1
+        if g.packetId == self.graphics_packet:
+            return
+        self.graphics_packet = g.packetId
+        graphics = decode_graphics(g)
+        self.graphics = graphics
+        self.lap = (g.completedLaps, g.normalizedCarPosition)
+        self.graphics_updates += 1
+
+        key = (graphics["session"], graphics["status"])
+        if self.static is None or not self.static["car_model"] or key != self.session_key:
+            self.session_key = key
+            self.static = decode_static(self.static_map.read())
+            self.static_reads += 1
+
+    def close(self):
+        # AC went away, whatever was cached belonged to that session
+        self.graphics_map.close()
+        self.static_map.close()
+        self.graphics_packet = None
+        self.session_key = None
+        self.graphics = None
+        self.static = None
+        self.lap = None
+        self.next_poll = 0.0
+
+    def status(self):
+        return {
+            "graphics": self.graphics,
+            "static": self.static,
+            "graphics_reads": self.graphics_reads,
+            "graphics_updates": self.graphics_updates,
+            "static_reads": self.static_reads,
+        }
+
+# Recording
+def ctypes_layout(struct_type):
+    # Field list for a recording header, enough to rebuild the layout without importing this file
+    fields = []
+    for name, ctype in struct_type._fields_:
+        count = getattr(ctype, "_length_", 1)
+        base = ctype._type_ if hasattr(ctype, "_length_") else ctype
+        code = {ctypes.c_float: "<f4", ctypes.c_int32: "<i4"}.get(base)
+        if code is None:
+            raise ValueError(f"Unsupported field type for {name}")
+        fields.append({
+            "name": name,
+            "dtype": code,
+            "count": count,
+            "offset": getattr(struct_type, name).offset,
+            "size": ctypes.sizeof(ctype),
+        })
+    return fields
+
+def new_recording_path():
+    os.makedirs(RECORDINGS_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    return os.path.join(RECORDINGS_DIR, f"session_{stamp}.sxr")
+
+def list_recordings():
+    if not os.path.isdir(RECORDINGS_DIR):
+        return []
+    out = []
+    for name in sorted(os.listdir(RECORDINGS_DIR)):
+        if not name.endswith(".sxr"):
+            continue
+        path = os.path.join(RECORDINGS_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        out.append({"name": name, "path": path, "bytes": st.st_size, "modified": st.st_mtime})
+    return out
+
+# Streams MemMap snapshots to an append only, chunked, columnar file. push() is the only thing the sender calls and
+# it never touches the disk, a full queue just drops the frame and counts it
+class SessionRecorder(threading.Thread):
+    def __init__(self, path, fields=None, compress=True, meta=None,
+                 chunk_records=RECORDING_CHUNK_RECORDS, flush_interval=RECORDING_FLUSH_INTERVAL):
+        super().__init__(daemon=True)
+        layout = ctypes_layout(MemMap)
+        if fields:
+            known = {f["name"] for f in layout}
+            unknown = [name for name in fields if name not in known]
+            if unknown:
+                raise ValueError("Unknown fields: " + ", ".join(unknown))
+            layout = [f for f in layout if f["name"] in fields]
+        self.path = path
+        self.columns = layout + [
+            {"name": "completedLaps", "dtype": "<i4", "count": 1, "offset": PHYSICS_SIZE, "size": 4, "page": "graphics"},
+            {"name": "normalizedCarPosition", "dtype": "<f4", "count": 1, "offset": PHYSICS_SIZE + 4, "size": 4, "page": "graphics"},
+        ]
+        self.compress = compress
+        self.meta = meta or {}
+        self.chunk_records = chunk_records
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=RECORDING_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.t0 = None
+        self.records = 0
+        self.dropped = 0
+        self.chunks = 0
+        self.bytes_written = 0
+        self.error = None
+
+    def push(self, physics, now, lap=None, block=False):
+        # lap is (completedLaps, normalizedCarPosition) from the graphics page if there is one. block is for offline
+        # writers that would rather wait than drop, the sender never blocks
+        if self.t0 is None:
+            self.t0 = now
+        record = ctypes.string_at(ctypes.addressof(physics), PHYSICS_SIZE) + RECORDING_LAP.pack(*(lap or (-1, -1.0)))
+        try:
+            self.queue.put((now - self.t0, record), block)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        self.stop_event.set()
+
+    def status(self):
+        return {
+            "recording": self.is_alive(),
+            "path": self.path,
+            "records": self.records,
+            "dropped": self.dropped,
+            "chunks": self.chunks,
+            "bytes_written": self.bytes_written,
+            "error": self.error,
+        }
+
+    def _header(self):
+        return json.dumps({
+            "version": RECORDING_VERSION,
+            "layout": "MemMap",
+            "record_size": PHYSICS_SIZE + RECORDING_LAP.size,
+            "compression": "zlib" if self.compress else "none",
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "fields": self.columns,
+            "meta": self.meta,
+        }).encode("utf-8")
+
+    def _write_chunk(self, f, batch):
+        stamps = struct.pack(f"<{len(batch)}d", *(t for t, _raw in batch))
+        cols = [stamps]
+        for col in self.columns:
+            start = col["offset"]
+            end = start + col["size"]
+            cols.append(b"".join(raw[start:end] for _t, raw in batch))
+        raw = b"".join(cols)
+        stored = zlib.compress(raw, 6) if self.compress else raw
+        f.write(CHUNK_HEADER.pack(CHUNK_TAG, len(batch), len(stored), len(raw)))
+        f.write(stored)
+        f.flush()
+        self.records += len(batch)
+        self.chunks += 1
+        self.bytes_written += CHUNK_HEADER.size + len(stored)
+
+    def run(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "wb") as f:
+                header = self._header()
+                f.write(RECORDING_PREAMBLE.pack(RECORDING_MAGIC, RECORDING_VERSION, len(header)))
+                f.write(header)
+                self.bytes_written = RECORDING_PREAMBLE.size + len(header)
+
+                batch = []
+                last_flush = time.monotonic()
+                while True:
+                    stopping = self.stop_event.is_set()
+                    try:
+                        batch.append(self.queue.get(timeout=0.2))
+                        while len(batch) < self.chunk_records:
+                            batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        pass
+                    now = time.monotonic()
+                    if batch and (len(batch) >= self.chunk_records or now - last_flush >= self.flush_interval or stopping):
+                        self._write_chunk(f, batch)
+                        batch = []
+                        last_flush = now
+                    if stopping and self.queue.empty() and not batch:
+                        break
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            self.error = str(e)
+            if DEBUG_VERBOSE:
+                print(f"Recorder error: {e}")
+
+def start_recording(worker, fields=None, compress=True):
+    global recorder
+    with recorder_lock:
+        if recorder and recorder.is_alive():
+            return recorder
+        rec = SessionRecorder(new_recording_path(), fields=fields, compress=compress)
+        rec.start()
+        recorder = rec
+        worker.recorder = rec
+        return rec
+
+def stop_recording():
+    with recorder_lock:
+        rec = recorder
+        worker = telemetry_worker
+        if rec and worker and worker.recorder is rec:
+            worker.recorder = None
+        if rec:
+            rec.stop()
+    if rec:
+        rec.join(5)
+    return rec
+
+def read_recording_header(f):
+    magic, version, header_len = RECORDING_PREAMBLE.unpack(f.read(RECORDING_PREAMBLE.size))
+    if magic != RECORDING_MAGIC:
+        raise ValueError("Not a ScreenX recording")
+    if version != RECORDING_VERSION:
+        raise ValueError(f"Unsupported recording version {version}")
+    return json.loads(f.read(header_len).decode("utf-8"))
+
+def iter_recording_chunks(path):
+    # Yields (header, records, raw column bytes). A chunk cut short by a crash ends the session there
+    with open(path, "rb") as f:
+        header = read_recording_header(f)
+        compressed = header.get("compression") == "zlib"
+        while True:
+            head = f.read(CHUNK_HEADER.size)
+            if len(head) < CHUNK_HEADER.size:
+                return
+            tag, count, stored_len, raw_len = CHUNK_HEADER.unpack(head)
+            if tag != CHUNK_TAG:
+                return
+            stored = f.read(stored_len)
+            if len(stored) < stored_len:
+                return
+            raw = zlib.decompress(stored) if compressed else stored
+            if len(raw) != raw_len:
+                return
+            yield header, count, raw
+
+def _recording_columns(header):
+    cols = [("t", "<f8", 1, 8)]
+    for field in header["fields"]:
+        cols.append((field["name"], field["dtype"], field["count"], field["size"]))
+    return cols
+
+def recording_rows(path):
+    # Row count from the chunk headers alone, seeks over the data instead of decompressing it
+    total = 0
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        read_recording_header(f)
+        while True:
+            head = f.read(CHUNK_HEADER.size)
+            if len(head) < CHUNK_HEADER.size:
+                return total
+            tag, count, stored_len, _raw_len = CHUNK_HEADER.unpack(head)
+            if tag != CHUNK_TAG or f.tell() + stored_len > size:
+                return total
+            f.seek(stored_len, os.SEEK_CUR)
+            total += count
+
+def evict_recording_caches(directory, keep=None, max_bytes=RECORDING_CACHE_MAX_BYTES):
+    # Caches whose recording is gone are always removed, the rest oldest use first until under max_bytes
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    caches = []
+    for name in names:
+        if not name.endswith(".sxr.cols"):
+            continue
+        cache_dir = os.path.join(directory, name)
+        if not os.path.isfile(cache_dir[:-len(".cols")]):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            continue
+        try:
+            used = os.path.getmtime(os.path.join(cache_dir, ".source_mtime"))
+        except OSError:
+            used = 0.0
+        size = 0
+        for entry in os.scandir(cache_dir):
+            try:
+                size += entry.stat().st_size
+            except OSError:
+                pass
+        caches.append((used, size, cache_dir))
+    total = sum(size for _used, size, _dir in caches)
+    for _used, size, cache_dir in sorted(caches):
+        if total <= max_bytes:
+            break
+        if keep and os.path.abspath(cache_dir) == os.path.abspath(keep):
+            continue
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        total -= size
+
+def expand_recording(path, fields=None, cache_dir=None):
+    # Decompresses the asked for columns (all of them if fields is None) into one .npy each so they can be
+    # np.load(mmap_mode="r")'d from then on. Columns already expanded for this version of the file are reused
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("numpy not installed")
+    cache_dir = cache_dir or path + ".cols"
+    with open(path, "rb") as f:
+        header = read_recording_header(f)
+    cols = _recording_columns(header)
+    stamp_path = os.path.join(cache_dir, ".source_mtime")
+    source_mtime = str(os.path.getmtime(path))
+    try:
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            fresh = f.read() == source_mtime
+    except OSError:
+        fresh = False
+    if not fresh and os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # Offsets are worked out over every column, only the wanted ones get written
+    wanted = set(fields) | {"t"} if fields else None
+    layout = []
+    pos = 0
+    for name, dtype, n, size in cols:
+        if (wanted is None or name in wanted) and not os.path.isfile(os.path.join(cache_dir, name + ".npy")):
+            layout.append((name, dtype, n, size, pos))
+        pos += size
+
+    if layout:
+        total = recording_rows(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        arrays = {}
+        for name, dtype, n, _size, _pos in layout:
+            shape = (total,) if n == 1 else (total, n)
+            arrays[name] = np.lib.format.open_memmap(os.path.join(cache_dir, name + ".npy.part"), mode="w+", dtype=dtype, shape=shape)
+        # One decompress per chunk, every wanted column is copied out of it while it's in memory
+        row = 0
+        for _h, count, raw in iter_recording_chunks(path):
+            rows = min(count, total - row)
+            for name, dtype, n, _size, col_pos in layout:
+                chunk = np.frombuffer(raw, dtype=dtype, count=rows * n, offset=col_pos * count)
+                arrays[name][row:row + rows] = chunk.reshape(arrays[name][row:row + rows].shape)
+            row += rows
+        # Memmaps have to be gone before the rename, windows wont replace a file thats still mapped
+        for name in list(arrays):
+            arr = arrays.pop(name)
+            arr.flush()
+            if row < total:
+                # A chunk header promised more than its data held, keep what actually decoded
+                np.save(os.path.join(cache_dir, name + ".npy.tmp"), np.array(arr[:row]))
+                del arr
+                os.replace(os.path.join(cache_dir, name + ".npy.tmp.npy"), os.path.join(cache_dir, name + ".npy.part"))
+            else:
+                del arr
+        for name, _dtype, _n, _size, _pos in layout:
+            os.replace(os.path.join(cache_dir, name + ".npy.part"), os.path.join(cache_dir, name + ".npy"))
+    if os.path.isdir(cache_dir):
+        # The stamp's mtime doubles as last used for evict_recording_caches
+        with open(stamp_path, "w", encoding="utf-8") as f:
+            f.write(source_mtime)
+        evict_recording_caches(os.path.dirname(os.path.abspath(path)), keep=cache_dir)
+    return cache_dir, header
+
+def load_recording(path, fields=None):
+    # Dict of column name -> memory mapped numpy array, "t" is seconds since the recording started
+    with open(path, "rb") as f:
+        header = read_recording_header(f)
+    names = ["t"] + [f["name"] for f in header["fields"]]
+    if fields:
+        names = ["t"] + [n for n in names[1:] if n in fields]
+    cache_dir, header = expand_recording(path, names)
+    return {name: np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r") for name in names}, header
+
+# Analysis
+# Post session numbers from a recording, all whole column numpy passes over the memory mapped arrays.
+# Laps come from the graphics page lap counter when the recording has it. Otherwise they come from distance:
+# integrate speed, find the lap length from where the speed-over-distance trace repeats, then line each lap start up
+# against the first lap so drift doesnt build up. Those laps are measured from wherever the recording started,
+# not the start/finish line
+ANALYSIS_FIELDS = (
+    "speedKmh", "fuel", "TireWear", "brakeTemp", "wheelSlip", "abs", "tc", "gas", "brake", "pitLimiterOn",
+    "completedLaps", "normalizedCarPosition",
+)
+
+def _analysis_lap_length(speed_grid, step):
+    # Strongest repeat in the speed trace between ANALYSIS_MIN_LAP_M and half the session (need 2 laps to see it)
+    n = len(speed_grid)
+    lo = int(ANALYSIS_MIN_LAP_M / step)
+    hi = min(int(ANALYSIS_MAX_LAP_M / step), n // 2)
+    if hi <= lo:
+        return None
+    s = speed_grid - speed_grid.mean()
+    spectrum = np.fft.rfft(s, 2 * n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    # Per overlapping sample so long lags arent penalised for having less overlap
+    ac = ac / (np.arange(n, 0, -1) * (ac[0] / n or 1.0))
+    window = ac[lo:hi]
+    best = window.max()
+    if best < ANALYSIS_MIN_CORRELATION:
+        return None
+    # Every multiple of the lap repeats too, and with pit stops every few laps one of those can beat the lap itself.
+    # So the lap is the shortest lag that is a local peak and scores close to the best, not the best one
+    radius = max(1, int(ANALYSIS_PEAK_RADIUS_M / step))
+    around = np.full(hi - lo + 2 * radius, -np.inf)
+    src_lo = max(0, lo - radius)
+    src_hi = min(n, hi + radius)
+    around[src_lo - (lo - radius):src_hi - (lo - radius)] = ac[src_lo:src_hi]
+    local_max = np.lib.stride_tricks.sliding_window_view(around, 2 * radius + 1).max(axis=1)
+    peaks = np.flatnonzero((window >= local_max) & (window >= max(ANALYSIS_MIN_CORRELATION, best * ANALYSIS_PEAK_FRACTION)))
+    return (lo + int(peaks[0])) * step
+
+def _analysis_lap_starts(speed_grid, step, lap_length):
+    # Lap k starts near k * lap_length, nudged to wherever the first stretch of lap one matches best
+    n = len(speed_grid)
+    lap = int(round(lap_length / step))
+    head = min(lap, max(1, int(ANALYSIS_MATCH_M / step)))
+    search = max(1, int(lap * ANALYSIS_LAP_SEARCH))
+    template = speed_grid[:head]
+    starts = [0]
+    while True:
+        expected = starts[-1] + lap
+        lo = max(starts[-1] + 1, expected - search)
+        hi = min(expected + search, n - head)
+        if hi <= lo:
+            break
+        windows = np.lib.stride_tricks.sliding_window_view(speed_grid[lo:hi + head], head)
+        err = ((windows - template) ** 2).mean(axis=1)
+        starts.append(lo + int(np.argmin(err)))
+    return np.asarray(starts) * step
+
+def _edges(active):
+    # Rising edges of a bool array, i.e. separate interventions rather than frames spent in one
+    edges = np.empty(len(active), dtype=np.int64)
+    if len(active):
+        edges[0] = active[0]
+        edges[1:] = active[1:] & ~active[:-1]
+    return edges
+
+def _drops(values):
+    # How much a column went down sample to sample, refuels and tire changes (going up) dont count against it
+    out = np.zeros(values.shape, dtype=np.float64)
+    out[1:] = np.clip(values[:-1] - values[1:], 0.0, None)
+    return out
+
+def analyze_recording(path, lap_length=None):
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("numpy not installed")
+    started = time.perf_counter()
+    cols, header = load_recording(path, ANALYSIS_FIELDS)
+    t = np.asarray(cols["t"], dtype=np.float64)
+    samples = len(t)
+    out = {
+        "name": os.path.basename(path),
+        "samples": samples,
+        "duration_s": round(float(t[-1] - t[0]), 3) if samples else 0.0,
+        "rate_hz": round((samples - 1) / float(t[-1] - t[0]), 1) if samples > 1 and t[-1] > t[0] else None,
+        "lap_length_m": None,
+        "lap_length_source": None,
+        "laps": [],
+        "stints": [],
+        "totals": {},
+    }
+    if samples < 2 or "speedKmh" not in cols:
+        out["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return out
+
+    # Distance in metres, gaps (paused, dropped frames) count as standing still
+    dt = np.diff(t, prepend=t[0])
+    dt[(dt < 0) | (dt > ANALYSIS_MAX_DT)] = 0.0
+    speed = np.asarray(cols["speedKmh"], dtype=np.float64)
+    dist = np.cumsum(np.clip(speed, 0.0, None) / 3.6 * dt)
+
+    step = ANALYSIS_GRID_M
+    grid = np.arange(0.0, dist[-1], step)
+    speed_grid = np.interp(grid, dist, speed) if len(grid) else grid
+    # Lap counter off the graphics page, -1 where AC wasnt giving it. Needs two line crossings to know the lap length
+    crossed = np.array([], dtype=np.intp)
+    if "completedLaps" in cols and not lap_length:
+        completed = np.asarray(cols["completedLaps"], dtype=np.int64)
+        valid = completed >= 0
+        crossed = np.flatnonzero((np.diff(completed) > 0) & valid[1:] & valid[:-1]) + 1
+    game_laps = len(crossed) >= 2
+    if game_laps:
+        out["lap_length_source"] = "game"
+        lap_length = float(np.median(np.diff(dist[crossed])))
+    elif lap_length:
+        out["lap_length_source"] = "given"
+    elif len(grid):
+        lap_length = _analysis_lap_length(speed_grid, step)
+        out["lap_length_source"] = "estimated" if lap_length else None
+    if game_laps:
+        out["lap_length_m"] = round(lap_length, 1)
+        # Whatever was driven before the first crossing counts as lap 1, so it and the last one are partial
+        starts = np.append(0, crossed)
+    elif lap_length:
+        out["lap_length_m"] = round(float(lap_length), 1)
+        lap_starts = _analysis_lap_starts(speed_grid, step, float(lap_length))
+        starts = np.unique(np.searchsorted(dist, lap_starts))
+    else:
+        starts = np.array([0])
+    starts = starts[starts < samples]
+    ends = np.append(starts[1:], samples)
+
+    # Per sample flags and drops, then one reduceat per metric turns them into per lap numbers
+    per_lap = {}
+    if "fuel" in cols:
+        per_lap["fuel_used"] = np.add.reduceat(_drops(np.asarray(cols["fuel"], dtype=np.float64)), starts)
+    if "TireWear" in cols:
+        per_lap["wear"] = np.add.reduceat(_drops(np.asarray(cols["TireWear"], dtype=np.float64)), starts, axis=0)
+    if "brakeTemp" in cols:
+        per_lap["brake_temp_peak"] = np.maximum.reduceat(np.asarray(cols["brakeTemp"]), starts, axis=0)
+    if all(name in cols for name in ("wheelSlip", "abs", "tc", "gas", "brake")):
+        slip = np.abs(np.asarray(cols["wheelSlip"])).max(axis=1)
+        gas = np.asarray(cols["gas"])
+        brake = np.asarray(cols["brake"])
+        slipping = slip > SLIP_THRESHOLD
+        # Same heuristic the live ABS/TC alert uses, see the ABS/TC rows in TELEMETRY_FIELDS
+        abs_on = (np.asarray(cols["abs"]) > 0) & slipping & (brake > 0.5) & (brake > gas)
+        tc_on = (np.asarray(cols["tc"]) > 0) & slipping & (gas > 0.5) & (gas > brake)
+        per_lap["abs_events"] = np.add.reduceat(_edges(abs_on), starts)
+        per_lap["tc_events"] = np.add.reduceat(_edges(tc_on), starts)
+        per_lap["abs_s"] = np.add.reduceat(np.where(abs_on, dt, 0.0), starts)
+        per_lap["tc_s"] = np.add.reduceat(np.where(tc_on, dt, 0.0), starts)
+    if "pitLimiterOn" in cols:
+        per_lap["pit"] = np.maximum.reduceat(np.asarray(cols["pitLimiterOn"]) != 0, starts)
+    top_speed = np.maximum.reduceat(speed, starts)
+    lap_dist = dist[ends - 1] - np.append(0.0, dist[ends[:-1] - 1])
+    lap_time = t[ends - 1] - t[starts]
+
+    laps = []
+    for i in range(len(starts)):
+        lap = {
+            "lap": i + 1,
+            "start_s": round(float(t[starts[i]] - t[0]), 3),
+            "time_s": round(float(lap_time[i]), 3),
+            "distance_m": round(float(lap_dist[i]), 1),
+            # The last one usually stops part way round
+            "complete": bool(0 < i < len(starts) - 1) if game_laps else
+                bool(lap_length) and bool(i < len(starts) - 1 or lap_dist[i] >= 0.98 * lap_length),
+            "top_speed": round(float(top_speed[i]), 1),
+        }
+        for name, values in per_lap.items():
+            value = values[i]
+            if name == "pit":
+                lap[name] = bool(value)
+            elif np.ndim(value):
+                lap[name] = np.round(value, 2).tolist()
+            elif name.endswith("_events"):
+                lap[name] = int(value)
+            else:
+                lap[name] = round(float(value), 3)
+        laps.append(lap)
+    out["laps"] = laps
+
+    # Stints end where the car got fuel or fresh tires, ie a column jumped up
+    if "fuel" in cols or "TireWear" in cols:
+        refill = np.zeros(samples, dtype=bool)
+        if "fuel" in cols:
+            refill[1:] |= np.diff(np.asarray(cols["fuel"], dtype=np.float64)) > ANALYSIS_REFUEL_L
+        if "TireWear" in cols:
+            refill[1:] |= (np.diff(np.asarray(cols["TireWear"], dtype=np.float64), axis=0) > ANALYSIS_TIRE_CHANGE).any(axis=1)
+        stint_starts = np.append(0, np.flatnonzero(refill))
+        stint_ends = np.append(stint_starts[1:], samples)
+        stints = []
+        for i, (a, b) in enumerate(zip(stint_starts, stint_ends)):
+            stint_dist = float(dist[b - 1] - dist[a])
+            stint_laps = stint_dist / lap_length if lap_length else None
+            stint = {
+                "stint": i + 1,
+                "start_s": round(float(t[a] - t[0]), 3),
+                "time_s": round(float(t[b - 1] - t[a]), 3),
+                "laps": round(stint_laps, 2) if stint_laps is not None else None,
+            }
+            if "fuel" in cols:
+                used = float(_drops(np.asarray(cols["fuel"][a:b], dtype=np.float64)).sum())
+                stint["fuel_used"] = round(used, 3)
+                stint["fuel_per_lap"] = round(used / stint_laps, 3) if stint_laps else None
+            if "TireWear" in cols:
+                worn = _drops(np.asarray(cols["TireWear"][a:b], dtype=np.float64)).sum(axis=0)
+                stint["wear"] = np.round(worn, 2).tolist()
+                stint["wear_per_lap"] = np.round(worn / stint_laps, 3).tolist() if stint_laps else None
+            stints.append(stint)
+        out["stints"] = stints
+
+    totals = {"distance_m": round(float(dist[-1]), 1)}
+    for name in ("fuel_used", "abs_events", "tc_events"):
+        if name in per_lap:
+            value = per_lap[name].sum()
+            totals[name] = int(value) if name.endswith("_events") else round(float(value), 3)
+    if "brake_temp_peak" in per_lap:
+        totals["brake_temp_peak"] = np.round(per_lap["brake_temp_peak"].max(axis=0), 1).tolist()
+    out["totals"] = totals
+    out["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return out
+
+def cached_analysis(path, lap_length=None):
+    key = (path, os.path.getmtime(path), lap_length)
+    with analysis_lock:
+        result = analysis_cache.get(key)
+        if result is None:
+            result = analyze_recording(path, lap_length)
+            if len(analysis_cache) >= 8:
+                analysis_cache.clear()
+            analysis_cache[key] = result
+    return result
+
+# Plays a recorded session back through the real sender. It stands in for both the physics map and the AC watcher,
+# so TelemetrySender runs exactly the same decode/packet path it would against the game.
+# speed 1 = real time, N = N times faster, 0 = as fast as the sender can take frames
+class ReplaySource:
+    def __init__(self, path, speed=1.0, loop=False):
+        self.path = path
+        self.speed = float(speed)
+        self.loop = loop
+        self.snapshot = MemMap()
+        self.chunks = None
+        self.raw = None
+        self.times = ()
+        self.copies = ()
+        self.count = 0
+        self.row = 0
+        self.clock_start = 0.0
+        self.t_base = None
+        self.frames = 0
+        self.laps = 0
+        self.released_at = 0.0
+        self.finished = False
+        # Watcher side, running from the start until the recording runs out
+        self.running = True
+        self.pid = "replay"
+
+    def status(self):
+        return {
+            "running": self.running,
+            "pid": None,
+            "backend": "replay",
+            "path": self.path,
+            "speed": self.speed,
+            "frames": self.frames,
+            "finished": self.finished,
+        }
+
+    def is_open(self):
+        return self.chunks is not None
+
+    def open(self):
+        if self.chunks is not None:
+            return
+        self.chunks = iter_recording_chunks(self.path)
+        self.count = 0
+        self.row = 0
+        self.t_base = None
+        self.clock_start = time.monotonic()
+
+    def close(self):
+        if self.chunks is not None:
+            self.chunks.close()
+        self.chunks = None
+        self.raw = None
+
+    def _next_chunk(self):
+        while True:
+            try:
+                header, count, raw = next(self.chunks)
+            except StopIteration:
+                if not self.loop:
+                    self.finished = True
+                    self.running = False
+                    return False
+                self.close()
+                self.open()
+                self.laps += 1
+                continue
+            if count:
+                break
+        # Columns are back to back in the chunk, work out where each one lands in MemMap once per chunk
+        self.raw = (ctypes.c_char * len(raw)).from_buffer_copy(raw)
+        self.times = struct.unpack_from(f"<{count}d", raw, 0)
+        pos = 8 * count
+        copies = []
+        for field in header["fields"]:
+            # Graphics page columns ride along after the MemMap bytes, the physics snapshot has nowhere to put them
+            if field.get("page", "physics") == "physics":
+                copies.append((field["offset"], pos, field["size"]))
+            pos += field["size"] * count
+        self.copies = copies
+        self.count = count
+        self.row = 0
+        if self.t_base is None:
+            self.t_base = self.times[0]
+        return True
+
+    def _peek_time(self):
+        if self.row >= self.count and not self._next_chunk():
+            return None
+        return self.times[self.row]
+
+    def _emit(self):
+        dst = ctypes.addressof(self.snapshot)
+        src = ctypes.addressof(self.raw)
+        row = self.row
+        for offset, col, size in self.copies:
+            ctypes.memmove(dst + offset, src + col + row * size, size)
+        self.row += 1
+        self.frames += 1
+        # Recordings dont have to include packetId, and loops would repeat it, so number frames ourselves
+        self.snapshot.packetId = self.frames
+        self.released_at = time.monotonic()
+
+    def read(self):
+        if self.chunks is None or self.finished:
+            return self.snapshot
+        if self.speed <= 0:
+            if self._peek_time() is not None:
+                self._emit()
+            return self.snapshot
+
+        t = self._peek_time()
+        if t is None:
+            return self.snapshot
+        target = self.t_base + (time.monotonic() - self.clock_start) * self.speed
+        if t > target:
+            return self.snapshot
+        # Frames we slept through are skipped, the game wouldnt have waited for us either
+        while self.row + 1 < self.count and self.times[self.row + 1] <= target:
+            self.row += 1
+        self._emit()
+        return self.snapshot
+
+# Made up but deterministic game for load testing: scripted laps with gear changes, one ABS and one TC event per lap,
+# tire wear, fuel burn and a pit stop (limiter on) every pit_every laps. Same frame n always comes out the same, so
+# expected() can say what the sender should have made of it. Stands in for the map and the watcher like ReplaySource
+class SyntheticSource:
+    MIN_RATE_HZ = 60.0
+    MAX_RATE_HZ = 1000.0
+    # Lap script as fractions of the lap, speed is interpolated between these points
+    SPEED_POINTS = ((0.0, 90.0), (0.30, 255.0), (0.36, 85.0), (0.50, 85.0), (0.56, 165.0), (0.88, 235.0), (0.92, 120.0), (1.0, 90.0))
+    # (start, end, gas, brake)
+    PEDALS = ((0.0, 0.30, 1.0, 0.0), (0.30, 0.36, 0.0, 0.9), (0.36, 0.50, 0.35, 0.0), (0.50, 0.88, 1.0, 0.0),
+              (0.88, 0.92, 0.0, 0.6), (0.92, 1.0, 0.5, 0.0))
+    ABS_WINDOW = (0.31, 0.35)
+    TC_WINDOW = (0.51, 0.54)
+    DRS_WINDOW = (0.60, 0.85)
+    PIT_ENTRY = 0.90
+    PIT_SPEED = 60.0
+    WEAR_FACTOR = (1.0, 1.0, 0.8, 0.8)
+    FUEL_START = 60.0
+    FUEL_PER_LAP = 2.4
+
+    def __init__(self, rate_hz=333.0, speed=1.0, laps=10, lap_time=90.0, wear_per_lap=7.5, pit_every=2, seed=1):
+        self.rate_hz = _clamp(float(rate_hz), self.MIN_RATE_HZ, self.MAX_RATE_HZ)
+        self.speed = float(speed)
+        self.laps = int(laps)
+        self.lap_time = float(lap_time)
+        self.wear_per_lap = float(wear_per_lap)
+        self.pit_every = int(pit_every)
+        self.seed = int(seed)
+        self.total = int(self.laps * self.lap_time * self.rate_hz)
+        self.snapshot = MemMap()
+        self.opened = False
+        self.next_frame = 0
+        self.clock_start = 0.0
+        self.frames = 0
+        self.published = 0
+        self.released_at = 0.0
+        self.finished = False
+        self.lap_params = (None, None)
+        self.running = True
+        self.pid = "synthetic"
+
+    def status(self):
+        return {
+            "running": self.running,
+            "pid": None,
+            "backend": "synthetic",
+            "rate_hz": self.rate_hz,
+            "speed": self.speed,
+            "frames": self.frames,
+            "published": self.published,
+            "finished": self.finished,
+        }
+
+    def is_open(self):
+        return self.opened
+
+    def open(self):
+        if not self.opened:
+            self.opened = True
+            self.clock_start = time.monotonic()
+
+    def close(self):
+        self.opened = False
+
+    def _lap(self, lap):
+        # Small per lap variation, seeded so its the same every run
+        if self.lap_params[0] != lap:
+            rng = random.Random(self.seed * 1000003 + lap)
+            self.lap_params = (lap, (rng.uniform(1.2, 1.8), rng.uniform(1.1, 1.6), rng.uniform(-8.0, 8.0)))
+        return self.lap_params[1]
 
-# Flashing
-class FlashJob:
-    def __init__(self):
-        self.lines = []
-        self.done = False
-        self.ok = False
+    def _pit_lap(self, lap):
+        return self.pit_every > 0 and lap % self.pit_every == self.pit_every - 1
 
-    def add(self, line):
-        if len(self.lines) < 1000:
-            self.lines.append(line)
+    def _in(self, window, pos):
+        return window[0] <= pos < window[1]
 
-class FlashRunner(threading.Thread):
-    def __init__(self, job_id, chip, port, baud, bin_path):
-        super().__init__(daemon=True)
-        self.job_id = job_id
-        self.chip = chip
-        self.port = port
-        self.baud = baud
-        self.bin_path = bin_path
+    def _stint(self, lap, pos):
+        # Tires and fuel start fresh after every pit stop
+        return (lap % self.pit_every if self.pit_every > 0 else lap) + pos
 
-    def run(self):
-        base_args = [
-            "--chip",
-            self.chip,
-            "--port",
-            self.port,
-            "--baud",
-            str(self.baud),
-            "write-flash",
-            "0x0",
-            self.bin_path,
-        ]
+    def expected(self, n):
+        # What the sender should make of frame n, worked out from the script instead of the MemMap numbers
+        t = n / self.rate_hz
+        lap = int(t // self.lap_time)
+        pos = (t % self.lap_time) / self.lap_time
+        stint = self._stint(lap, pos)
+        low = []
+        display = []
+        for i in range(4):
+            wear = ctypes.c_float(max(0.0, 100.0 - self.wear_per_lap * stint * self.WEAR_FACTOR[i])).value
+            low.append(int(wear < TIRE_LOW_WEAR))
+            display.append(int(round(_clamp((wear - TIRE_DISPLAY_EMPTY_AT) / (100.0 - TIRE_DISPLAY_EMPTY_AT), 0.0, 1.0) * 100.0)))
+        return {
+            "ABS": int(self._in(self.ABS_WINDOW, pos)),
+            "TC": int(self._in(self.TC_WINDOW, pos)),
+            "PIT": int(self._pit_lap(lap) and pos >= self.PIT_ENTRY),
+            "T0": low[0], "T1": low[1], "T2": low[2], "T3": low[3],
+            "W0": display[0], "W1": display[1], "W2": display[2], "W3": display[3],
+        }
 
-        if getattr(sys, "frozen", False):
-            py_launcher = shutil.which("py")
-            python_cmd = shutil.which("python")
-            esptool_exe = shutil.which("esptool") or shutil.which("esptool.exe")
+    def frame(self, n):
+        t = n / self.rate_hz
+        lap = int(t // self.lap_time)
+        pos = (t % self.lap_time) / self.lap_time
+        abs_slip, tc_slip, top_trim = self._lap(lap)
+        p = self.snapshot
+        p.packetId = n + 1
 
-            if py_launcher:
-                cmd = [py_launcher, "-m", "esptool", *base_args]
-            elif python_cmd:
-                cmd = [python_cmd, "-m", "esptool", *base_args]
-            elif esptool_exe:
-                cmd = [esptool_exe, *base_args]
-            else:
-                cmd = None
+        points = self.SPEED_POINTS
+        for i in range(1, len(points)):
+            if pos < points[i][0]:
+                (x0, v0), (x1, v1) = points[i - 1], points[i]
+                if x0 == 0.30:
+                    v0 += top_trim
+                if x1 == 0.30:
+                    v1 += top_trim
+                speed = v0 + (v1 - v0) * (pos - x0) / (x1 - x0)
+                break
         else:
-            cmd = [sys.executable, "-m", "esptool", *base_args]
+            speed = points[-1][1]
+        gas = brake = 0.0
+        for start, end, g, b in self.PEDALS:
+            if start <= pos < end:
+                gas, brake = g, b
+                break
+        pit = self._pit_lap(lap) and pos >= self.PIT_ENTRY
+        if pit:
+            speed, gas, brake = self.PIT_SPEED, 0.3, 0.0
 
-        with flash_lock:
-            job = flash_jobs.get(self.job_id)
-        if not job:
-            return
+        slip = 0.1 + 0.2 * abs(math.sin(t * 7.0))
+        if self._in(self.ABS_WINDOW, pos):
+            slip = abs_slip
+        elif self._in(self.TC_WINDOW, pos):
+            slip = tc_slip
 
-        if cmd is None:
-            job.add("Flash error: cannot find Python launcher or esptool in PATH")
-            job.add("Install esptool with: pip install esptool")
-            job.done = True
-            job.ok = False
-            return
+        gear = min(6, 1 + int(speed // 42.0))
+        p.gear = gear + 1
+        p.rpms = int(3000 + 5000 * min(1.0, (speed - (gear - 1) * 42.0) / 42.0))
+        p.gas = gas
+        p.brake = brake
+        p.clutch = 0.0
+        p.speedKmh = speed
+        p.steerAngle = 0.0 if gas == 1.0 else math.sin(pos * 40.0) * 0.4
+        for i in range(4):
+            p.wheelSlip[i] = slip if i < 2 else slip * 0.5
 
-        job.add("Running: " + " ".join(cmd))
-        if DEBUG_VERBOSE:
-            print("Running flash command:", " ".join(cmd))
+        stint = self._stint(lap, pos)
+        for i in range(4):
+            p.TireWear[i] = max(0.0, 100.0 - self.wear_per_lap * stint * self.WEAR_FACTOR[i])
+            p.brakeTemp[i] = 300.0 + 500.0 * brake
+        p.fuel = max(0.0, self.FUEL_START - self.FUEL_PER_LAP * stint)
+        p.abs = 1.0
+        p.tc = 1.0
+        p.pitLimiterOn = int(pit)
+        p.drsEnabled = int(self._in(self.DRS_WINDOW, pos))
+        p.drsAvailable = p.drsEnabled
+        p.turboBoost = 0.8 * gas
+        p.airTemp = 24.0
+        p.roadTemp = 31.0
+        p.numberOfTiresOut = 0
+        return p
 
-        creationflags = 0
-        startupinfo = None
-        if os.name == "nt":
-            creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = 0
+    def read(self):
+        if not self.opened or self.finished:
+            return self.snapshot
+        if self.speed <= 0:
+            n = self.next_frame
+        else:
+            # Whatever frame the game would be on by now, anything in between was published and missed
+            n = int((time.monotonic() - self.clock_start) * self.rate_hz * self.speed)
+            if n < self.next_frame:
+                return self.snapshot
+        if n >= self.total:
+            self.finished = True
+            self.running = False
+            return self.snapshot
+        self.frame(n)
+        self.next_frame = n + 1
+        self.frames += 1
+        self.published = n + 1
+        self.released_at = time.monotonic() if self.speed <= 0 else self.clock_start + n / (self.rate_hz * self.speed)
+        return self.snapshot
 
-        try:
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                startupinfo=startupinfo,
-                creationflags=creationflags,
-            )
-        except Exception as e:
-            job.add(f"Flash error: Failed to start esptool: {e}")
-            if "esptool" in str(e).lower() or "module" in str(e).lower():
-                job.add("Make sure esptool is installed: pip install esptool")
-            job.done = True
-            job.ok = False
-            return
+# Local UDP receiver for replays and benchmarks. frame_clock, if given, returns when the newest frame was released,
+# so arrival minus that is roughly how long a frame took to get through the companion
+class UdpSink(threading.Thread):
+    LATENCY_SAMPLES = 20000
 
-        try:
-            for line in proc.stdout:
-                job.add(line.rstrip())
-        except Exception as e:
-            job.add(f"Error reading output: {e}")
+    def __init__(self, host="127.0.0.1", port=0, frame_clock=None):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.2)
+        self.host = host
+        self.port = self.sock.getsockname()[1]
+        self.frame_clock = frame_clock
+        self.stop_event = threading.Event()
+        self.packets = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self.latencies = collections.deque(maxlen=self.LATENCY_SAMPLES)
+        self.on_packet = None
 
-        rc = proc.wait()
-        job.done = True
-        job.ok = (rc == 0)
+    def stop(self):
+        self.stop_event.set()
 
-# Shared memory map, more of these may be added later to the esp32's gui, it depends on demand for specific features
-class MemMap(ctypes.Structure):
-    _pack_ = 4
-    _fields_ = [
-        ("packetId", ctypes.c_int32),
-        ("gas", ctypes.c_float),
-        ("brake", ctypes.c_float),
-        ("fuel", ctypes.c_float),
-        ("gear", ctypes.c_int32),
-        ("rpms", ctypes.c_int32),
-        ("steerAngle", ctypes.c_float),
-        ("speedKmh", ctypes.c_float),
-        ("velocity", ctypes.c_float * 3),
-        ("accG", ctypes.c_float * 3),
-        ("wheelSlip", ctypes.c_float * 4),
-        ("wheelLoad", ctypes.c_float * 4),
-        ("wheelsPressure", ctypes.c_float * 4),
-        ("wheelAngularSpeed", ctypes.c_float * 4),
-        ("TireWear", ctypes.c_float * 4),
-        ("TireDirtyLevel", ctypes.c_float * 4),
-        ("TireCoreTemperature", ctypes.c_float * 4),
-        ("camberRAD", ctypes.c_float * 4),
-        ("suspensionTravel", ctypes.c_float * 4),
-        ("drs", ctypes.c_float),
-        ("tc", ctypes.c_float),
-        ("heading", ctypes.c_float),
-        ("pitch", ctypes.c_float),
-        ("roll", ctypes.c_float),
-        ("cgHeight", ctypes.c_float),
-        ("carDamage", ctypes.c_float * 5),
-        ("numberOfTiresOut", ctypes.c_int32),
-        ("pitLimiterOn", ctypes.c_int32),
-        ("abs", ctypes.c_float),
-        ("kersCharge", ctypes.c_float),
-        ("kersInput", ctypes.c_float),
-        ("autoShifterOn", ctypes.c_int32),
-        ("rideHeight", ctypes.c_float * 2),
-        ("turboBoost", ctypes.c_float),
-        ("ballast", ctypes.c_float),
-        ("airDensity", ctypes.c_float),
-        ("airTemp", ctypes.c_float),
-        ("roadTemp", ctypes.c_float),
-        ("localAngularVel", ctypes.c_float * 3),
-        ("finalFF", ctypes.c_float),
-        ("performanceMeter", ctypes.c_float),
-        ("engineBrake", ctypes.c_int32),
-        ("ersRecoveryLevel", ctypes.c_int32),
-        ("ersPowerLevel", ctypes.c_int32),
-        ("ersHeatCharging", ctypes.c_int32),
-        ("ersIsCharging", ctypes.c_int32),
-        ("kersCurrentKJ", ctypes.c_float),
-        ("drsAvailable", ctypes.c_int32),
-        ("drsEnabled", ctypes.c_int32),
-        ("brakeTemp", ctypes.c_float * 4),
-        ("clutch", ctypes.c_float),
-    ]
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            now = time.monotonic()
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self.packets += 1
+            self.bytes += len(data)
+            if self.frame_clock is not None:
+                self.latencies.append(now - self.frame_clock())
+            if self.on_packet is not None:
+                self.on_packet(self.sock, data, addr)
+        self.sock.close()
 
-PHYSICS_SIZE = ctypes.sizeof(MemMap)
+    def stats(self):
+        span = (self.last - self.first) if self.first is not None and self.last != self.first else 0.0
+        lat = sorted(self.latencies)
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "packets_per_sec": round(self.packets / span, 1) if span else None,
+            "bytes_per_sec": round(self.bytes / span, 1) if span else None,
+            "latency_ms": {
+                "p50": round(_percentile(lat, 50) * 1000, 3),
+                "p95": round(_percentile(lat, 95) * 1000, 3),
+                "p99": round(_percentile(lat, 99) * 1000, 3),
+                "max": round(lat[-1] * 1000, 3),
+            } if lat else None,
+        }
+
+def drive_source(source, speed, ip=None, port=None, wire_format="text", duration=None, poll_hz=None):
+    # Runs a real TelemetrySender against a stand in source, into a local sink unless ip/port are given
+    sink = None
+    if ip is None:
+        sink = UdpSink(frame_clock=lambda: source.released_at)
+        sink.start()
+        ip, port = sink.host, sink.port
+    # As fast as possible means dont sleep between polls at all
+    pacing = PacingScheduler(poll_hz or (1e6 if speed <= 0 else DEFAULT_POLL_HZ), DEFAULT_IDLE_POLL_HZ, DEFAULT_IDLE_AFTER)
+    sender = TelemetrySender(ip, int(port or DEFAULT_PORT), False, SnapshotChannel(), physics_map=source,
+                             ac_watcher=source, pacing=pacing, wire_format=wire_format)
+    started = time.monotonic()
+    sender.start()
+    while sender.is_alive() and not source.finished:
+        if duration and time.monotonic() - started >= duration:
+            break
+        time.sleep(0.05)
+    sender.stop()
+    sender.join(5)
+    elapsed = time.monotonic() - started
+    if sink:
+        time.sleep(0.1)
+        sink.stop()
+        sink.join(2)
+    return {
+        "speed": speed,
+        "elapsed_s": round(elapsed, 3),
+        "frames": source.frames,
+        "frames_per_sec": round(source.frames / elapsed, 1) if elapsed else None,
+        "sender": sender.counters(),
+        "pacing": pacing.stats(),
+        "sink": sink.stats() if sink else None,
+    }
+
+def run_replay(path, speed=0.0, loop=False, ip=None, port=None, wire_format="text", duration=None, poll_hz=None):
+    # Replays a session into a local sink (or a real wheel if ip/port are given) and returns what happened
+    source = ReplaySource(path, speed=speed, loop=loop)
+    result = {"path": path}
+    result.update(drive_source(source, speed, ip, port, wire_format, duration, poll_hz))
+    return result
+
+def run_synthetic(rate_hz=333.0, speed=1.0, laps=2, ip=None, port=None, wire_format="text", duration=None, poll_hz=None, seed=1):
+    # Pushes the sender with generated frames, published vs frames is how many it couldnt keep up with
+    source = SyntheticSource(rate_hz, speed=speed, laps=laps, seed=seed)
+    result = {"rate_hz": source.rate_hz, "laps": laps}
+    result.update(drive_source(source, speed, ip, port, wire_format, duration, poll_hz))
+    result["published"] = source.published
+    result["missed"] = source.published - source.frames
+    return result
+
+def check_synthetic(rate_hz=1000.0, laps=5, seed=1, max_report=20):
+    # Every generated frame through decode_physics, compared with what the script says it should be.
+    # Catches the ABS/TC slip logic or the wear remap drifting without needing the game or a wheel
+    source = SyntheticSource(rate_hz, speed=0, laps=laps, seed=seed)
+    checked = ("ABS", "TC", "PIT", "T0", "T1", "T2", "T3", "W0", "W1", "W2", "W3")
+    index = [(key, PACKET_INDEX[key]) for key in checked]
+    mismatches = 0
+    report = []
+    events = {"ABS": 0, "TC": 0, "PIT": 0}
+    previous = {}
+    for n in range(source.total):
+        values = decode_physics(source.frame(n))
+        want = source.expected(n)
+        for key, i in index:
+            if values[i] != want[key]:
+                mismatches += 1
+                if len(report) < max_report:
+                    report.append({"frame": n, "field": key, "expected": want[key], "got": values[i]})
+        for key in events:
+            if want[key] and not previous.get(key):
+                events[key] += 1
+            previous[key] = want[key]
+    return {
+        "rate_hz": source.rate_hz,
+        "laps": laps,
+        "frames": source.total,
+        "events": events,
+        "mismatches": mismatches,
+        "first_mismatches": report,
+        "ok": mismatches == 0,
+    }
 
 # Web server side of things
 class CompanionServer(server.SimpleHTTPRequestHandler):
@@ -673,6 +3824,72 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
         except Exception:
             return {}
 
+    def _stream_events(self):
+        # Server sent events, one connection pushing telemetry and heartbeat at the rate the page asks for.
+        # Each tick only looks at the newest snapshot, a page that falls behind just skips the ones in between
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            hz = _clamp(float(params.get("hz", [STREAM_DEFAULT_HZ])[0]), 1.0, STREAM_MAX_HZ)
+        except ValueError:
+            hz = STREAM_DEFAULT_HZ
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        token = object()
+        set_stream_rate(token, hz)
+        interval = 1.0 / hz
+        seen = None
+        hb_seen = None
+        hb_sent = 0.0
+        next_at = time.monotonic()
+        try:
+            while True:
+                out = []
+                if telemetry_channel.version != seen:
+                    seen, status, last = telemetry_channel.read()
+                    out.append(b"event: telemetry\ndata: " + json.dumps({"status": status, "last": last}).encode() + b"\n\n")
+                now = time.monotonic()
+                hb = get_heartbeat_status()
+                hb_key = (hb["running"], hb["connected"], hb["ever_seen"])
+                if hb_key != hb_seen or now - hb_sent >= STREAM_KEEPALIVE:
+                    hb_seen = hb_key
+                    hb_sent = now
+                    out.append(b"event: heartbeat\ndata: " + json.dumps(hb).encode() + b"\n\n")
+                # Heartbeat goes out at least once a second, so that doubles as the keepalive
+                if out:
+                    self.wfile.write(b"".join(out))
+                    self.wfile.flush()
+                next_at += interval
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_at = time.monotonic()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+        finally:
+            set_stream_rate(token, None)
+
+    def _flash_steps(self, data, port, chip, baud, bin_path):
+        mode = data.get("runner", "auto")
+        if mode not in ("auto", "inprocess", "subprocess"):
+            raise ValueError("runner must be auto, inprocess or subprocess")
+        steps = [FlashRunner(chip, port, baud, bin_path,
+                             compress=bool(data.get("compress", True)),
+                             skip_unchanged=bool(data.get("skip_unchanged", True)),
+                             mode=mode)]
+        wifi = data.get("wifi")
+        if wifi:
+            if not isinstance(wifi, dict) or not wifi.get("ssid"):
+                raise ValueError("wifi needs an ssid")
+            if not SERIAL_AVAILABLE:
+                raise ValueError("pyserial not installed")
+            steps.append(WifiStep(port, int(wifi.get("baud", DEFAULT_BAUD)), wifi["ssid"], wifi.get("password", ""),
+                                  delay=FLASH_WIFI_BOOT_DELAY))
+        return steps
+
     def do_GET(self):
         try:
             if self.path.startswith("/api/"):
@@ -733,18 +3950,107 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
             query = urllib.parse.urlparse(self.path).query
             params = urllib.parse.parse_qs(query)
             job_id = params.get("job", [""])[0]
+            try:
+                since = max(0, int(params.get("since", ["0"])[0]))
+                wait = _clamp(float(params.get("wait", ["0"])[0]), 0.0, FLASH_STATUS_MAX_WAIT)
+            except ValueError:
+                return self._send_json({"ok": False, "error": "Invalid since or wait"}, 400)
+            evict_flash_jobs()
             with flash_lock:
                 job = flash_jobs.get(job_id)
             if not job:
-                return self._send_json({"ok": False, "done": True, "lines": ["Unknown job"]})
-            return self._send_json({"ok": job.ok, "done": job.done, "lines": job.lines})
+                return self._send_json({"ok": False, "done": True, "lines": ["Unknown job"], "next": 0, "progress": None})
+            return self._send_json(job.read(since, wait))
+
+        if self.path.startswith("/api/flash/queue"):
+            return self._send_json({"ok": True, **flash_scheduler.status()})
+
+        if self.path.startswith("/api/flash/cached"):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            path = cached_firmware(params.get("sha256", [""])[0])
+            return self._send_json({"ok": path is not None, "path": path})
 
         if self.path.startswith("/api/telemetry/status"):
-            return self._send_json({"status": telemetry_status, "last": telemetry_last})
+            worker = telemetry_worker
+            counters = worker.counters() if worker else None
+            pacing = worker.pacing.stats() if worker else None
+            ac = worker.ac_watcher.status() if worker else None
+            transport = worker.transport.stats() if worker and worker.transport else None
+            seq, status, last = telemetry_channel.read()
+            return self._send_json({
+                "seq": seq,
+                "status": status,
+                "last": last,
+                "counters": counters,
+                "pacing": pacing,
+                "ac": ac,
+                "transport": transport,
+            })
+
+        if self.path.startswith("/api/telemetry/targets"):
+            worker = telemetry_worker
+            targets = []
+            if worker and worker.is_alive():
+                for target in worker.targets:
+                    info = target.counters()
+                    info["primary"] = target.primary
+                    info["heartbeat"] = target.heartbeat.status() if target.heartbeat else get_heartbeat_status()
+                    targets.append(info)
+            return self._send_json({"targets": targets})
+
+        if self.path.startswith("/api/metrics"):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            if params.get("format", [""])[0] == "json":
+                return self._send_json(telemetry_metrics.to_dict())
+            out = telemetry_metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+            return
+
+        if self.path.startswith("/api/session"):
+            worker = telemetry_worker
+            pages = worker.session_pages if worker and worker.is_alive() else None
+            if pages is None:
+                return self._send_json({"ok": True, "running": False, "graphics": None, "static": None})
+            out = pages.status()
+            out["ok"] = True
+            out["running"] = True
+            return self._send_json(out)
 
         if self.path.startswith("/api/heartbeat/status"):
             return self._send_json(get_heartbeat_status())
 
+        if self.path.startswith("/api/stream"):
+            return self._stream_events()
+
+        if self.path.startswith("/api/record/status"):
+            rec = recorder
+            return self._send_json({"ok": True, "status": rec.status() if rec else None})
+
+        if self.path.startswith("/api/recordings/analysis"):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            name = os.path.basename(params.get("name", [""])[0])
+            path = os.path.join(RECORDINGS_DIR, name)
+            if not name or not os.path.isfile(path):
+                return self._send_json({"ok": False, "error": "Recording not found"}, 404)
+            if not NUMPY_AVAILABLE:
+                return self._send_json({"ok": False, "error": "numpy not installed"}, 501)
+            try:
+                lap_length = float(params["lap_length"][0]) if params.get("lap_length") else None
+            except ValueError:
+                return self._send_json({"ok": False, "error": "Invalid lap_length"}, 400)
+            try:
+                result = cached_analysis(path, lap_length)
+            except (OSError, ValueError) as e:
+                return self._send_json({"ok": False, "error": str(e)}, 400)
+            return self._send_json({"ok": True, "analysis": result})
+
+        if self.path.startswith("/api/recordings"):
+            return self._send_json({"ok": True, "recordings": list_recordings()})
+
         if self.path.startswith("/api/layout/current"):
             state = load_state()
             layout = state.get("current_layout", None)
@@ -757,7 +4063,7 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
         self.send_error(404)
 
     def _handle_api_post(self):
-        global telemetry_worker, telemetry_status, heartbeat_worker
+        global telemetry_worker, heartbeat_worker
         if self.path.startswith("/api/onboarding_seen"):
             state = load_state()
             state["onboarding_seen"] = True
@@ -770,10 +4076,9 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
                 content_len = int(self.headers.get("Content-Length", "0") or "0")
                 if content_len <= 0:
                     return self._send_json({"ok": False, "error": "No file data provided"}, 400)
-                if content_len > 10 * 1024 * 1024:
+                if content_len > FIRMWARE_MAX_UPLOAD:
                     return self._send_json({"ok": False, "error": "File too large (>10MB)"}, 413)
 
-                file_data = b""
                 filename = "firmware.bin"
 
                 if "application/octet-stream" in content_type:
@@ -781,8 +4086,9 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
                     params = urllib.parse.parse_qs(query)
                     if "filename" in params and params["filename"]:
                         filename = params["filename"][0] or filename
-                    file_data = self.rfile.read(content_len)
+                    stream, length = self.rfile, content_len
                 else:
+                    # Old base64 json upload, still accepted but the raw body is the way to go
                     data = self._read_json()
                     if not data or "data" not in data:
                         return self._send_json({"ok": False, "error": "No file data provided"}, 400)
@@ -791,25 +4097,18 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
                         file_data = base64.b64decode(data["data"])
                     except Exception as b64_err:
                         return self._send_json({"ok": False, "error": f"Invalid base64: {str(b64_err)}"}, 400)
+                    if not file_data:
+                        return self._send_json({"ok": False, "error": "Empty file"}, 400)
                     filename = data.get("filename", filename)
-
-                if not file_data:
-                    return self._send_json({"ok": False, "error": "Empty file"}, 400)
+                    stream, length = io.BytesIO(file_data), len(file_data)
 
                 suffix = os.path.splitext(filename)[1] or ".bin"
-                fd, path = tempfile.mkstemp(prefix="wheel_", suffix=suffix)
-                
                 try:
-                    with os.fdopen(fd, "wb") as f:
-                        f.write(file_data)
+                    path, sha, reused = store_firmware(stream, length, suffix)
                 except Exception as write_err:
-                    try:
-                        os.unlink(path)
-                    except:
-                        pass
                     return self._send_json({"ok": False, "error": f"Failed to write file: {str(write_err)}"}, 500)
-                
-                return self._send_json({"ok": True, "path": path})
+
+                return self._send_json({"ok": True, "path": path, "sha256": sha, "cached": reused})
             except Exception as e:
                 if DEBUG_VERBOSE:
                     print(f"Upload error: {e}")
@@ -830,17 +4129,32 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
                 return self._send_json({"ok": False, "error": "No firmware file provided"}, 400)
             if not os.path.exists(bin_path):
                 return self._send_json({"ok": False, "error": f"Firmware file not found: {bin_path}"}, 400)
+            try:
+                steps = self._flash_steps(data, port, chip, baud, bin_path)
+            except ValueError as e:
+                return self._send_json({"ok": False, "error": str(e)}, 400)
 
-            global flash_seq
-            with flash_lock:
-                flash_seq += 1
-                job_id = f"job_{flash_seq}"
-                flash_jobs[job_id] = FlashJob()
-
-            worker = FlashRunner(job_id, chip, port, baud, bin_path)
-            worker.start()
+            job_id = flash_scheduler.submit(port, steps, bin_path)
             return self._send_json({"ok": True, "job": job_id})
 
+        if self.path.startswith("/api/flash/batch"):
+            # Same image to several boards at once, one job per port, optionally followed by wifi on each
+            data = self._read_json()
+            ports = data.get("ports") or []
+            baud = int(data.get("baud", DEFAULT_FLASH_BAUD))
+            chip = data.get("chip", DEFAULT_CHIP)
+            bin_path = data.get("path", "")
+            if not isinstance(ports, list) or not ports:
+                return self._send_json({"ok": False, "error": "No COM ports selected"}, 400)
+            if not bin_path or not os.path.exists(bin_path):
+                return self._send_json({"ok": False, "error": f"Firmware file not found: {bin_path}"}, 400)
+            try:
+                plans = [(port, self._flash_steps(data, port, chip, baud, bin_path)) for port in dict.fromkeys(ports)]
+            except ValueError as e:
+                return self._send_json({"ok": False, "error": str(e)}, 400)
+            jobs = {port: flash_scheduler.submit(port, steps, bin_path) for port, steps in plans}
+            return self._send_json({"ok": True, "jobs": jobs})
+
         if self.path.startswith("/api/wifi/send"):
             if not SERIAL_AVAILABLE:
                 return self._send_json({"ok": False, "error": "pyserial not installed"}, 500)
@@ -851,71 +4165,101 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
             pwd = data.get("password", "")
             if not port or not ssid:
                 return self._send_json({"ok": False, "error": "Missing port or SSID"}, 400)
-            payload = f"{ssid},{pwd}\n"
-
-            with flash_lock:
-                flashing = any(not j.done for j in flash_jobs.values())
-            if flashing:
-                return self._send_json({"ok": False, "error": "Flash still running. Wait for flash to finish first."}, 409)
 
-            last_err = None
-            for attempt in range(3):
-                try:
-                    with serial.Serial(port, baud, timeout=2, write_timeout=2) as ser:
-                        try:
-                            ser.dtr = False
-                            ser.rts = False
-                        except Exception:
-                            pass
+            # Only this port matters, other boards can keep flashing
+            if flash_scheduler.busy(port):
+                return self._send_json({"ok": False, "error": "Flash still running on this port. Wait for flash to finish first."}, 409)
 
-                        if attempt == 0:
-                            time.sleep(1.2)
-                        else:
-                            time.sleep(0.35)
+            ok, msg = send_wifi_credentials(port, baud, ssid, pwd)
+            if ok:
+                return self._send_json({"ok": True})
+            return self._send_json({"ok": False, "error": msg}, 500)
 
-                        try:
-                            ser.reset_input_buffer()
-                            ser.reset_output_buffer()
-                        except Exception:
-                            pass
-
-                        raw = payload.encode("utf-8")
-                        ser.write(raw)
-                        ser.flush()
-                        time.sleep(0.2)
-                        ser.write(raw)
-                        ser.flush()
-                        time.sleep(0.2)
-                    return self._send_json({"ok": True})
-                except Exception as e:
-                    last_err = e
-                    time.sleep(0.35)
+        if self.path.startswith("/api/telemetry/targets/remove"):
+            data = self._read_json()
+            worker = telemetry_worker
+            if not worker or not worker.is_alive():
+                return self._send_json({"ok": False, "error": "Telemetry not running"}, 409)
+            try:
+                removed = worker.remove_target(data.get("ip", ""), int(data.get("port", DEFAULT_PORT)))
+            except (TypeError, ValueError):
+                return self._send_json({"ok": False, "error": "Invalid port"}, 400)
+            if not removed:
+                return self._send_json({"ok": False, "error": "No such target"}, 404)
+            return self._send_json({"ok": True})
 
-            msg = str(last_err) if last_err else "Unknown serial error"
-            lower = msg.lower()
-            if "permission" in lower or "access is denied" in lower or "writefile failed" in lower:
-                msg = (
-                    "COM port is busy or wrong interface selected. Close Serial Monitor/other apps, "
-                    "pick the USB Serial port (not JTAG), unplug/replug the board, then retry. "
-                    f"Raw error: {last_err}"
-                )
-            elif "does not recognize the command" in lower or "device does not understand the command" in lower:
-                msg = (
-                    "Windows rejected write on this COM interface. Select the USB Serial port (not JTAG) and retry. "
-                    f"Raw error: {last_err}"
+        if self.path.startswith("/api/telemetry/targets"):
+            data = self._read_json()
+            worker = telemetry_worker
+            if not worker or not worker.is_alive():
+                return self._send_json({"ok": False, "error": "Start telemetry before adding displays"}, 409)
+            primary = worker.primary
+            try:
+                target = make_fanout_target(
+                    data, load_state().get("current_layout"), None, primary.wire_format,
+                    primary.delta is not None,
+                    primary.delta.keyframe_interval if primary.delta else DEFAULT_KEYFRAME_INTERVAL,
+                    primary.min_send_interval, primary.heartbeat_interval,
                 )
-            return self._send_json({"ok": False, "error": msg}, 500)
+            except (AttributeError, TypeError, ValueError) as e:
+                return self._send_json({"ok": False, "error": f"Invalid target: {e}"}, 400)
+            if not worker.add_target(target):
+                return self._send_json({"ok": False, "error": "Already sending to that display"}, 409)
+            target.heartbeat.start()
+            return self._send_json({"ok": True})
 
         if self.path.startswith("/api/telemetry/start"):
             data = self._read_json()
             ip = data.get("ip", DEFAULT_IP)
             port = int(data.get("port", DEFAULT_PORT))
             Tire_live = bool(data.get("Tire_live", False))
+            wire_format = data.get("wire_format", "auto")
+            if wire_format not in WIRE_FORMATS:
+                return self._send_json({"ok": False, "error": "wire_format must be auto or text"}, 400)
             if telemetry_worker and telemetry_worker.is_alive():
                 return self._send_json({"ok": True, "status": "running"})
-            telemetry_worker = TelemetrySender(ip, port, Tire_live, telemetry_queue)
+            try:
+                pacing = PacingScheduler(
+                    float(data.get("poll_hz", DEFAULT_POLL_HZ)),
+                    float(data.get("idle_poll_hz", DEFAULT_IDLE_POLL_HZ)),
+                    float(data.get("idle_after", DEFAULT_IDLE_AFTER)),
+                )
+                min_send_interval = float(data.get("min_send_interval", MIN_SEND_INTERVAL))
+                heartbeat_interval = float(data.get("heartbeat_interval", HEARTBEAT_INTERVAL))
+                keyframe_interval = float(data.get("keyframe_interval", DEFAULT_KEYFRAME_INTERVAL))
+                filters = data.get("filters") if isinstance(data.get("filters"), dict) else None
+                max_hz = float(data["max_hz"]) if data.get("max_hz") else None
+            except (TypeError, ValueError):
+                return self._send_json({"ok": False, "error": "Invalid pacing settings"}, 400)
+            delta = bool(data.get("delta", False))
+            layout = data.get("layout") or load_state().get("current_layout")
+            # Extra displays fed from the same physics read, each with its own layout, rate cap and format
+            extra = []
+            try:
+                for spec in data.get("targets") or []:
+                    extra.append(make_fanout_target(
+                        spec, layout, filters, wire_format, delta,
+                        keyframe_interval, min_send_interval, heartbeat_interval,
+                    ))
+            except (AttributeError, TypeError, ValueError) as e:
+                return self._send_json({"ok": False, "error": f"Invalid target: {e}"}, 400)
+            telemetry_worker = TelemetrySender(
+                ip, port, Tire_live, telemetry_channel,
+                pacing=pacing,
+                min_send_interval=min_send_interval,
+                heartbeat_interval=heartbeat_interval,
+                wire_format=wire_format,
+                delta=delta,
+                keyframe_interval=keyframe_interval,
+                layout=layout,
+                filters=filters,
+                max_hz=max_hz,
+            )
+            for target in extra:
+                if telemetry_worker.add_target(target):
+                    target.heartbeat.start()
             telemetry_worker.start()
-            telemetry_status = "Starting"
+            telemetry_channel.set_status("Starting")
             if heartbeat_worker and heartbeat_worker.is_alive():
                 heartbeat_worker.stop()
             reset_heartbeat_state()
@@ -929,10 +4273,11 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
             return self._send_json({"ok": True})
 
         if self.path.startswith("/api/telemetry/stop"):
+            stop_recording()
             if telemetry_worker:
                 telemetry_worker.stop()
                 telemetry_worker = None
-            telemetry_status = "Stopped"
+            telemetry_channel.set_status("Stopped")
             if heartbeat_worker:
                 heartbeat_worker.stop()
                 heartbeat_worker = None
@@ -942,6 +4287,55 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
             save_state(state)
             return self._send_json({"ok": True})
 
+        if self.path.startswith("/api/record/start"):
+            data = self._read_json()
+            worker = telemetry_worker
+            if not worker or not worker.is_alive():
+                return self._send_json({"ok": False, "error": "Start telemetry before recording"}, 409)
+            try:
+                rec = start_recording(worker, data.get("fields") or None, bool(data.get("compress", True)))
+            except ValueError as e:
+                return self._send_json({"ok": False, "error": str(e)}, 400)
+            return self._send_json({"ok": True, "status": rec.status()})
+
+        if self.path.startswith("/api/record/stop"):
+            rec = stop_recording()
+            return self._send_json({"ok": True, "status": rec.status() if rec else None})
+
+        if self.path.startswith("/api/replay/start"):
+            data = self._read_json()
+            name = os.path.basename(data.get("name", ""))
+            path = os.path.join(RECORDINGS_DIR, name)
+            if not name or not os.path.isfile(path):
+                return self._send_json({"ok": False, "error": "Recording not found"}, 404)
+            wire_format = data.get("wire_format", "auto")
+            if wire_format not in WIRE_FORMATS:
+                return self._send_json({"ok": False, "error": "wire_format must be auto or text"}, 400)
+            if telemetry_worker and telemetry_worker.is_alive():
+                return self._send_json({"ok": False, "error": "Stop telemetry before replaying"}, 409)
+            ip = data.get("ip", DEFAULT_IP)
+            port = int(data.get("port", DEFAULT_PORT))
+            try:
+                speed = float(data.get("speed", 1.0))
+            except (TypeError, ValueError):
+                return self._send_json({"ok": False, "error": "Invalid speed"}, 400)
+            source = ReplaySource(path, speed=speed, loop=bool(data.get("loop", False)))
+            telemetry_worker = TelemetrySender(
+                ip, port, bool(data.get("Tire_live", False)), telemetry_channel,
+                physics_map=source,
+                ac_watcher=source,
+                wire_format=wire_format,
+                layout=load_state().get("current_layout"),
+            )
+            telemetry_worker.start()
+            telemetry_channel.set_status("Replaying")
+            if heartbeat_worker and heartbeat_worker.is_alive():
+                heartbeat_worker.stop()
+            reset_heartbeat_state()
+            heartbeat_worker = HeartbeatSender(ip, port)
+            heartbeat_worker.start()
+            return self._send_json({"ok": True, "replay": source.status()})
+
         if self.path.startswith("/api/layout/presets/delete"):
             data = self._read_json()
             name = data.get("name", "")
@@ -970,15 +4364,268 @@ class CompanionServer(server.SimpleHTTPRequestHandler):
             layout = data.get("layout", {})
             ok = send_layout(ip, port, layout)
             if ok:
-                state = load_state()
-                state["current_layout"] = layout
-                save_state(state)
+                worker = telemetry_worker
+                target = worker.find_target(ip, port) if worker else None
+                if target:
+                    target.send_filter.set_layout(layout)
+                # The saved layout is the primary wheel's, extra displays only keep theirs for this session
+                if not target or target.primary:
+                    state = load_state()
+                    state["current_layout"] = layout
+                    save_state(state)
                 return self._send_json({"ok": True})
             else:
                 return self._send_json({"ok": False, "error": "UDP send failed"}, 500)
 
         self.send_error(404)
 
+# Benchmarks
+# Everything runs on the same seeded synthetic laps, so result files from two checkouts compare like for like.
+# Each timed case is a few rounds over the frame set, best round is the headline number (least disturbed by the OS)
+BENCH_CASES = ("snapshot", "decode", "packet", "change", "end_to_end", "http")
+
+def bench_frames(count=2000, seed=1):
+    # Spread over two laps so ABS/TC windows, pit stops and gear changes all show up
+    source = SyntheticSource(1000.0, speed=0, laps=2, seed=seed)
+    step = max(1, source.total // count)
+    return [bytes(source.frame(n * step)) for n in range(count)]
+
+def _bench_rounds(fn, items, seconds, rounds=5):
+    # fn(items) does one pass, returns per round ns/op plus how many ops that was all together
+    per_round = max(seconds / rounds, 0.01)
+    results = []
+    total_ops = 0
+    for _ in range(rounds):
+        ops = 0
+        started = time.perf_counter()
+        while True:
+            fn(items)
+            ops += len(items)
+            elapsed = time.perf_counter() - started
+            if elapsed >= per_round:
+                break
+        results.append(elapsed * 1e9 / ops)
+        total_ops += ops
+    results.sort()
+    return {
+        "ops": total_ops,
+        "ns_per_op": round(results[0], 1),
+        "ns_per_op_median": round(results[len(results) // 2], 1),
+        "per_sec": round(1e9 / results[0], 1),
+    }
+
+def bench_snapshot(frames, seconds):
+    # The torn read safe copy out of a file backed page, same code path as the AC mapping
+    tmp = tempfile.NamedTemporaryFile(suffix=".acpmf", delete=False)
+    tmp.close()
+    physics_map = FilePhysicsMap(tmp.name)
+    try:
+        physics_map.publish(MemMap.from_buffer_copy(frames[0]))
+
+        def run(items):
+            read = physics_map.read
+            for _ in items:
+                read()
+        return {"read": _bench_rounds(run, frames, seconds)}
+    finally:
+        physics_map.close()
+        os.unlink(tmp.name)
+
+def bench_decode(frames, seconds):
+    structs = [MemMap.from_buffer_copy(raw) for raw in frames]
+
+    def from_buffer(items):
+        for raw in items:
+            decode_physics(MemMap.from_buffer_copy(raw))
+
+    def decode_only(items):
+        for physics in items:
+            decode_physics(physics)
+    return {
+        "from_buffer": _bench_rounds(from_buffer, frames, seconds / 2),
+        "decode_only": _bench_rounds(decode_only, structs, seconds / 2),
+    }
+
+def bench_packet(frames, seconds):
+    values = [decode_physics(MemMap.from_buffer_copy(raw)) for raw in frames]
+    buf = bytearray(TELEMETRY_BIN.size)
+    parts = [packet_parts(v) for v in values]
+
+    def text(items):
+        for v in items:
+            encode_text(v)
+
+    def binary(items):
+        for v in items:
+            pack_binary_frame(buf, v)
+            bytes(buf)
+
+    def delta(items):
+        # Acked every frame so it stays on the delta path instead of repeating keyframes
+        encoder = DeltaEncoder(keyframe_interval=1e9)
+        now = 0.0
+        for p in items:
+            encoder.encode(p, now)
+            encoder.on_reply(f"KACK:{encoder.seq}".encode())
+            now += 0.001
+    return {
+        "text": _bench_rounds(text, values, seconds / 3),
+        "binary": _bench_rounds(binary, values, seconds / 3),
+        "delta": _bench_rounds(delta, parts, seconds / 3),
+    }
+
+def bench_change(frames, seconds):
+    values = [decode_physics(MemMap.from_buffer_copy(raw)) for raw in frames]
+    hits = [0]
+
+    def run(items):
+        send_filter = SendFilter()
+        now = 0.0
+        for v in items:
+            v = list(v)
+            send_filter.quantize(v)
+            if send_filter.should_send(v, now):
+                send_filter.mark_sent(v, now)
+                hits[0] += 1
+            now += 0.001
+    out = _bench_rounds(run, values, seconds)
+    out["send_ratio"] = round(hits[0] / out["ops"], 3)
+    return {"quantize_and_check": out}
+
+def bench_end_to_end(seconds, wire_format="text"):
+    # The whole sender loop flat out into a local sink, loop iterations per second is frames_per_sec
+    source = SyntheticSource(1000.0, speed=0, laps=100)
+    result = drive_source(source, 0, wire_format=wire_format, duration=seconds)
+    sink = result["sink"] or {}
+    return {
+        "loop": {
+            "per_sec": result["frames_per_sec"],
+            "frames": result["frames"],
+            "elapsed_s": result["elapsed_s"],
+            "frames_sent": result["sender"]["frames_sent"],
+            "packets_received": sink.get("packets"),
+            "latency_ms": sink.get("latency_ms"),
+        }
+    }
+
+class _QuietCompanionServer(CompanionServer):
+    def log_message(self, format, *args):
+        pass
+
+def bench_http(seconds, concurrency=(1, 8, 32), paths=None):
+    # Real CompanionServer on a free port, N client threads hammering one endpoint at a time
+    paths = paths or ("/api/state", "/api/telemetry/status", "/api/heartbeat/status", "/api/layout/current", "/index.html")
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _QuietCompanionServer)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    host, port = httpd.server_address
+    out = {}
+    try:
+        for path in paths:
+            for clients in concurrency:
+                latencies = []
+                errors = [0]
+                lock = threading.Lock()
+                deadline = time.monotonic() + seconds / (len(paths) * len(concurrency))
+
+                def client():
+                    mine = []
+                    while time.monotonic() < deadline:
+                        started = time.perf_counter()
+                        try:
+                            conn = http_client.HTTPConnection(host, port, timeout=5)
+                            conn.request("GET", path)
+                            resp = conn.getresponse()
+                            resp.read()
+                            conn.close()
+                            if resp.status != 200:
+                                raise OSError(resp.status)
+                        except OSError:
+                            with lock:
+                                errors[0] += 1
+                            continue
+                        mine.append(time.perf_counter() - started)
+                    with lock:
+                        latencies.extend(mine)
+
+                started = time.monotonic()
+                threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed = time.monotonic() - started
+                latencies.sort()
+                out[f"{path} x{clients}"] = {
+                    "requests": len(latencies),
+                    "errors": errors[0],
+                    "per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+                    "latency_ms": {
+                        "p50": round(_percentile(latencies, 50) * 1000, 3),
+                        "p95": round(_percentile(latencies, 95) * 1000, 3),
+                        "p99": round(_percentile(latencies, 99) * 1000, 3),
+                        "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+                    },
+                }
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return out
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmarks(cases=None, seconds=2.0, frame_count=2000):
+    cases = [c for c in (cases or BENCH_CASES) if c in BENCH_CASES]
+    frames = bench_frames(frame_count)
+    results = {}
+    for case in cases:
+        if case == "snapshot":
+            results[case] = bench_snapshot(frames, seconds)
+        elif case == "decode":
+            results[case] = bench_decode(frames, seconds)
+        elif case == "packet":
+            results[case] = bench_packet(frames, seconds)
+        elif case == "change":
+            results[case] = bench_change(frames, seconds)
+        elif case == "end_to_end":
+            results[case] = bench_end_to_end(seconds)
+        elif case == "http":
+            results[case] = bench_http(seconds * 5)
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "seconds": seconds,
+            "frames": frame_count,
+        },
+        "results": results,
+    }
+
+def compare_benchmarks(old, new):
+    # per_sec is higher is better for every case, change is new vs old in percent
+    out = {}
+    for case, entries in new.get("results", {}).items():
+        for name, entry in entries.items():
+            before = old.get("results", {}).get(case, {}).get(name)
+            if not before or not before.get("per_sec") or entry.get("per_sec") is None:
+                continue
+            out[f"{case}/{name}"] = {
+                "old": before["per_sec"],
+                "new": entry["per_sec"],
+                "change_pct": round((entry["per_sec"] / before["per_sec"] - 1.0) * 100.0, 1),
+            }
+    return out
+
 class WindowApi:
     def __init__(self):
         self.maximized = False
@@ -1007,8 +4654,7 @@ class WindowApi:
 # This definition deserves to be at the bottom (most because everything would break)
 def run_server():
     os.makedirs(DATA_DIR, exist_ok=True)
-    thread = threading.Thread(target=telemetry_sender, daemon=True)
-    thread.start()
+    threading.Thread(target=load_esptool, daemon=True).start()
 
     url = f"http://127.0.0.1:{SERVER_PORT}/"
     httpd = ThreadingHTTPServer(("127.0.0.1", SERVER_PORT), CompanionServer)
@@ -1049,4 +4695,50 @@ def run_server():
 
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="ScreenX companion")
+    parser.add_argument("--replay", metavar="PATH", help="replay a recorded session instead of starting the app")
+    parser.add_argument("--analyze", metavar="PATH", help="print lap and stint analysis of a recorded session as JSON")
+    parser.add_argument("--lap-length", type=float, default=None, help="with --analyze, track length in metres instead of guessing it")
+    parser.add_argument("--synthetic", action="store_true", help="drive the sender with generated laps instead of the game")
+    parser.add_argument("--check", action="store_true", help="with --synthetic, check the ABS/TC and wear logic frame by frame")
+    parser.add_argument("--rate", type=float, default=333.0, help="synthetic physics rate, 60 to 1000 Hz")
+    parser.add_argument("--laps", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=0.0, help="1.0 is realtime, 0 is as fast as possible")
+    parser.add_argument("--loop", action="store_true")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--poll-hz", type=float, default=None, help="sender poll rate, defaults to flat out at speed 0")
+    parser.add_argument("--ip", default=None, help="send to a real wheel instead of a local sink")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--wire-format", default="text", choices=WIRE_FORMATS)
+    parser.add_argument("--bench", nargs="?", const=",".join(BENCH_CASES), default=None, metavar="CASES",
+                        help="run the benchmarks (comma separated subset of " + ", ".join(BENCH_CASES) + ") and print JSON")
+    parser.add_argument("--bench-seconds", type=float, default=2.0, help="time spent on each benchmark case")
+    parser.add_argument("--out", default=None, help="with --bench, also write the results to this file")
+    parser.add_argument("--compare", default=None, metavar="PATH", help="with --bench, compare against an earlier results file")
+    args, _ = parser.parse_known_args()
+    if args.bench:
+        result = run_benchmarks(args.bench.split(","), seconds=args.bench_seconds)
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                result["compare"] = compare_benchmarks(json.load(f), result)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+        print(json.dumps(result, indent=2))
+    elif args.analyze:
+        print(json.dumps(analyze_recording(args.analyze, args.lap_length), indent=2))
+    elif args.synthetic and args.check:
+        result = check_synthetic(args.rate, laps=args.laps, seed=args.seed)
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result["ok"] else 1)
+    elif args.synthetic:
+        print(json.dumps(run_synthetic(args.rate, speed=args.speed, laps=args.laps, ip=args.ip, port=args.port,
+                                       wire_format=args.wire_format, duration=args.duration,
+                                       poll_hz=args.poll_hz, seed=args.seed), indent=2))
+    elif args.replay:
+        print(json.dumps(run_replay(args.replay, speed=args.speed, loop=args.loop, ip=args.ip, port=args.port,
+                                    wire_format=args.wire_format, duration=args.duration,
+                                    poll_hz=args.poll_hz), indent=2))
+    else:
+        run_server()
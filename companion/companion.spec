@@ -1,5 +1,7 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+from PyInstaller.utils.hooks import collect_data_files, collect_submodules
+
 block_cipher = None
 
 a = Analysis(
@@ -9,8 +11,10 @@ a = Analysis(
     datas=[
         ('web', 'web'),
         ('logo.ico', '.'),
+        # esptool runs in-process, it needs its stub flasher json files
+        *collect_data_files('esptool'),
     ],
-    hiddenimports=[],
+    hiddenimports=collect_submodules('esptool'),
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
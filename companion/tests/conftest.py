@@ -0,0 +1,5 @@
+import os
+import sys
+
+# companion.py is a script, not a package, so put its folder on the path for the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,116 @@
+import os
+import re
+
+import pytest
+
+import companion
+
+FIRMWARE = os.path.join(os.path.dirname(__file__), "..", "..", "firmware", "firmware.ino")
+# parseBinaryPacket field names -> wire keys
+FIRMWARE_KEYS = {
+    "speed": "SPD", "rpm": "RPM", "throttle": "THR", "brake": "BRK", "clutch": "CLT", "fuel": "FUEL",
+    "boost": "BST", "airTemp": "ATMP", "roadTemp": "RTMP", "steer": "STR", "brakeTemp": "BTMP",
+    "pit": "PIT", "abs": "ABS", "tc": "TC", "drs": "DRS",
+}
+
+
+def firmware_layout():
+    # Offsets, sizes and scales straight out of parseBinaryPacket so the two sides cant drift apart unnoticed
+    with open(FIRMWARE, encoding="utf-8") as f:
+        source = f.read()
+    body = source[source.index("bool parseBinaryPacket(const uint8_t* p, int len) {"):]
+    body = body[:body.index("\n}\n")]
+    size = int(re.search(r"const int BIN_FRAME_SIZE = (\d+);", source).group(1))
+    fields = {}
+    for name, kind, offset, scale in re.findall(r"telem\.(\w+) = read([UI])16\(p \+ (\d+)\)(?: / ([\d.]+)f)?;", body):
+        fields[FIRMWARE_KEYS[name]] = ("<" + kind.replace("U", "H").replace("I", "h"), int(offset), float(scale or 1))
+    for name, offset in re.findall(r"telem\.(\w+) = p\[(\d+)\];", body):
+        fields[FIRMWARE_KEYS[name]] = ("<B", int(offset), 1.0)
+    clutch = re.search(r"telem\.clutch = .*p\[(\d+)\]", body)
+    fields["CLT"] = ("<B", int(clutch.group(1)), 1.0)
+    flags = {FIRMWARE_KEYS[name]: int(mask, 16) for name, mask in re.findall(r"telem\.(\w+) = flags & 0x([0-9A-Fa-f]+);", body)}
+    return size, fields, flags
+
+
+def frame(**changes):
+    p = companion.MemMap()
+    p.packetId = 1
+    p.gear = 4
+    p.rpms = 7234
+    p.speedKmh = 187.26
+    p.gas = 0.75
+    p.brake = 0.0
+    p.clutch = 0.25
+    p.fuel = 41.37
+    p.turboBoost = -0.35
+    p.airTemp = 24.4
+    p.roadTemp = -3.6
+    p.steerAngle = -0.42
+    p.drsEnabled = 1
+    p.pitLimiterOn = 1
+    for i, wear in enumerate((99.0, 97.0, 93.5, 80.0)):
+        p.TireWear[i] = wear
+        p.brakeTemp[i] = 400.0 + i * 10
+    for name, value in changes.items():
+        setattr(p, name, value)
+    return p
+
+
+def test_layout_matches_firmware():
+    size, fields, flags = firmware_layout()
+    assert companion.TELEMETRY_BIN.size == size
+    assert [flags[key] for key in ("PIT", "ABS", "TC", "DRS")] == [
+        1 << companion.BIN_FLAG_KEYS.index(key) for key in ("PIT", "ABS", "TC", "DRS")
+    ]
+    offset = 5
+    for key, code, scale in companion.BIN_FIELDS:
+        if key in fields:
+            assert fields[key] == ("<" + code, offset, float(scale)), key
+        offset += companion.struct.calcsize("<" + code)
+    assert offset == size
+
+
+def test_pack_reads_back_at_firmware_offsets():
+    size, fields, flags = firmware_layout()
+    values = companion.decode_physics(frame())
+    buf = bytearray(companion.TELEMETRY_BIN.size)
+    companion.pack_binary_frame(buf, values)
+    assert buf[0] == companion.BIN_MAGIC and buf[1] == companion.BIN_VERSION
+    assert companion.struct.unpack_from("<b", buf, 4)[0] == 3
+
+    def read(key):
+        code, offset, scale = fields[key]
+        return companion.struct.unpack_from(code, buf, offset)[0] / scale
+
+    assert read("SPD") == pytest.approx(187.3)
+    assert read("RPM") == 7234
+    assert read("THR") == 75
+    assert read("CLT") == 25
+    assert read("FUEL") == pytest.approx(41.4)
+    assert read("BST") == pytest.approx(-0.35)
+    assert read("ATMP") == 24
+    assert read("RTMP") == -4
+    assert read("STR") == pytest.approx(-0.42)
+    assert read("BTMP") == 415
+    flag_bits = companion.struct.unpack_from("<H", buf, 2)[0]
+    assert flag_bits & flags["PIT"] and flag_bits & flags["DRS"]
+    assert not flag_bits & flags["ABS"]
+    # Wear: 99 and 97 are fine, 93.5 and 80 are past TIRE_LOW_WEAR, display is scaled between 86 and 100
+    assert list(buf[5:9]) == [93, 79, 54, 0]
+    assert [bool(flag_bits & (0x80 << i)) for i in range(4)] == [False, True, True, True]
+
+
+@pytest.mark.parametrize("gear,expected", [(0, -1), (1, 0), (2, 1), (200, 127)])
+def test_gear_byte(gear, expected):
+    buf = bytearray(companion.TELEMETRY_BIN.size)
+    companion.pack_binary_frame(buf, companion.decode_physics(frame(gear=gear)))
+    assert companion.struct.unpack_from("<b", buf, 4)[0] == expected
+
+
+def test_out_of_range_values_clamp():
+    buf = bytearray(companion.TELEMETRY_BIN.size)
+    companion.pack_binary_frame(buf, companion.decode_physics(frame(rpms=90000, speedKmh=-5.0, turboBoost=900.0)))
+    size, fields, _flags = firmware_layout()
+    assert companion.struct.unpack_from("<H", buf, fields["RPM"][1])[0] == 65535
+    assert companion.struct.unpack_from("<H", buf, fields["SPD"][1])[0] == 0
+    assert companion.struct.unpack_from("<h", buf, fields["BST"][1])[0] == 32767
@@ -0,0 +1,114 @@
+import companion
+
+
+class Wheel:
+    # The firmware side of delta mode (parseKeyframe/parseDelta): last two keyframes, deltas apply on top of one
+    def __init__(self):
+        self.slots = []
+        self.fields = None
+        self.replies = []
+
+    def receive(self, packet):
+        head, *parts = packet.decode().split("|")
+        fields = dict(part.split(":", 1) for part in parts)
+        if head.startswith("K:"):
+            self.slots = (self.slots + [(int(head[2:]), fields)])[-2:]
+            self.fields = dict(fields)
+            self.replies.append(f"KACK:{int(head[2:])}:0".encode())
+            return
+        _d, _seq, key = head.split(":")
+        for seq, base in self.slots:
+            if seq == int(key):
+                self.fields = dict(base, **fields)
+                return
+        self.replies.append(b"RESYNC")
+
+    def reply_to(self, encoder):
+        for reply in self.replies:
+            encoder.on_reply(reply)
+        self.replies = []
+
+
+def frames(count):
+    source = companion.SyntheticSource(100.0)
+    for n in range(count):
+        parts = companion.packet_parts(companion.decode_physics(source.frame(n * 7)))
+        yield parts, dict(part.split(":", 1) for part in parts)
+
+
+def test_deltas_rebuild_every_frame():
+    encoder = companion.DeltaEncoder(keyframe_interval=10.0)
+    wheel = Wheel()
+    for n, (parts, expected) in enumerate(frames(50)):
+        packet = encoder.encode(parts, n * 0.01)
+        assert packet.startswith(b"K:") == (n == 0)
+        wheel.receive(packet)
+        wheel.reply_to(encoder)
+        assert wheel.fields == expected
+    assert encoder.keyframes == 1 and encoder.acks == 1 and encoder.deltas == 49
+
+
+def test_delta_only_carries_changed_fields():
+    encoder = companion.DeltaEncoder(keyframe_interval=10.0)
+    wheel = Wheel()
+    (parts, _expected), = frames(1)
+    wheel.receive(encoder.encode(parts, 0.0))
+    wheel.reply_to(encoder)
+    changed = list(parts)
+    changed[companion.PACKET_INDEX["RPM"]] = "RPM:1234"
+    assert encoder.encode(changed, 0.01) == b"D:2:1|RPM:1234"
+    assert encoder.encode(parts, 0.02) == b"D:3:1"
+
+
+def test_lost_packets_dont_corrupt_state():
+    encoder = companion.DeltaEncoder(keyframe_interval=0.1)
+    wheel = Wheel()
+    for n, (parts, expected) in enumerate(frames(60)):
+        packet = encoder.encode(parts, n * 0.01)
+        # Every third packet and every other KACK go missing, deltas are against an acked keyframe so that's fine
+        if n % 3 == 2:
+            continue
+        wheel.receive(packet)
+        if n % 2:
+            wheel.reply_to(encoder)
+        else:
+            wheel.replies = []
+        assert wheel.fields == expected
+    assert encoder.resyncs == 0
+
+
+def test_resync_after_wheel_forgets_keyframes():
+    encoder = companion.DeltaEncoder(keyframe_interval=10.0)
+    wheel = Wheel()
+    stream = frames(4)
+    parts, _expected = next(stream)
+    wheel.receive(encoder.encode(parts, 0.0))
+    wheel.reply_to(encoder)
+
+    # Wheel rebooted, the next delta points at a keyframe it doesnt have
+    wheel = Wheel()
+    parts, _expected = next(stream)
+    packet = encoder.encode(parts, 0.01)
+    assert packet.startswith(b"D:")
+    wheel.receive(packet)
+    assert wheel.replies == [b"RESYNC"]
+    wheel.reply_to(encoder)
+    assert encoder.resyncs == 1
+
+    parts, expected = next(stream)
+    packet = encoder.encode(parts, 0.02)
+    assert packet.startswith(b"K:")
+    wheel.receive(packet)
+    assert wheel.fields == expected
+
+
+def test_keyframe_interval():
+    encoder = companion.DeltaEncoder(keyframe_interval=0.5)
+    wheel = Wheel()
+    kinds = []
+    for n, (parts, _expected) in enumerate(frames(12)):
+        packet = encoder.encode(parts, n * 0.1)
+        kinds.append(packet[:1])
+        wheel.receive(packet)
+        wheel.reply_to(encoder)
+    assert kinds == [b"K", b"D", b"D", b"D", b"D", b"K", b"D", b"D", b"D", b"D", b"K", b"D"]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import companion
+
+
+def test_cursor_reads_only_new_lines():
+    job = companion.FlashJob()
+    for line in ("Connecting...", "Chip is ESP32-C3", "Erasing flash..."):
+        job.add(line)
+    first = job.read(0)
+    assert first["lines"] == ["Connecting...", "Chip is ESP32-C3", "Erasing flash..."]
+    assert first["next"] == 3 and first["skipped"] == 0 and not first["done"]
+    assert job.read(3)["lines"] == []
+    job.add("Leaving...")
+    job.finish(True)
+    last = job.read(3)
+    assert last["lines"] == ["Leaving..."] and last["next"] == 4
+    assert last["done"] and last["ok"]
+
+
+def test_ring_drops_old_lines_and_says_how_many(monkeypatch):
+    monkeypatch.setattr(companion, "FLASH_LOG_LINES", 5)
+    job = companion.FlashJob()
+    for i in range(8):
+        job.add(f"line {i}")
+    behind = job.read(0)
+    assert behind["lines"] == ["line 3", "line 4", "line 5", "line 6", "line 7"]
+    assert behind["skipped"] == 3 and behind["next"] == 8
+    caught_up = job.read(6)
+    assert caught_up["lines"] == ["line 6", "line 7"] and caught_up["skipped"] == 0
+
+
+def test_progress_from_esptool_output():
+    job = companion.FlashJob()
+    assert job.read()["progress"] is None
+    job.add("Writing at 0x00010000... (12 %)")
+    assert job.read()["progress"] == 12.0
+    job.add("Writing at 0x00020000 [=====>      ]  45.5% 196608/432112 bytes...")
+    assert job.read()["progress"] == 45.5
+    # Percentages on other lines dont count
+    job.add("Compressed 432112 bytes to 250000 (57 %)")
+    assert job.read()["progress"] == 45.5
+    job.add("Hash of data verified.")
+    assert job.read()["progress"] == 100.0
+
+
+def test_read_waits_for_the_next_line():
+    job = companion.FlashJob()
+    job.add("Connecting...")
+    threading.Timer(0.05, job.add, ("Connected",)).start()
+    started = time.monotonic()
+    result = job.read(1, wait=2.0)
+    assert result["lines"] == ["Connected"]
+    assert time.monotonic() - started < 1.0
+
+
+def test_read_doesnt_wait_once_done():
+    job = companion.FlashJob()
+    job.finish(False)
+    started = time.monotonic()
+    result = job.read(0, wait=2.0)
+    assert result["done"] and not result["ok"]
+    assert time.monotonic() - started < 0.5
+
+
+def test_evict_keeps_running_and_newest_finished(monkeypatch):
+    monkeypatch.setattr(companion, "FLASH_JOBS_KEEP", 2)
+    jobs = {}
+    for job_id in ("a", "b", "c", "d"):
+        jobs[job_id] = companion.FlashJob()
+        jobs[job_id].finish(True)
+        time.sleep(0.001)
+    jobs["running"] = companion.FlashJob()
+    monkeypatch.setattr(companion, "flash_jobs", dict(jobs))
+    companion.evict_flash_jobs()
+    assert sorted(companion.flash_jobs) == ["c", "d", "running"]
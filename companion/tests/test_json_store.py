@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import companion
+
+
+@pytest.fixture
+def fast_flush(monkeypatch):
+    monkeypatch.setattr(companion, "STORE_FLUSH_DELAY", 0.05)
+    monkeypatch.setattr(companion, "STORE_FLUSH_MAX_DELAY", 0.3)
+
+
+def wait_for(check, timeout=3.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if check():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_default_and_copies(tmp_path):
+    store = companion.JsonStore(str(tmp_path / "state.json"), {"seen": False}, dict)
+    value = store.get()
+    assert value == {"seen": False}
+    value["seen"] = True
+    assert store.get() == {"seen": False}
+
+
+def test_wrong_kind_on_disk_uses_default(tmp_path):
+    path = tmp_path / "presets.json"
+    path.write_text('{"not": "a list"}', encoding="utf-8")
+    assert companion.JsonStore(str(path), [], list).get() == []
+
+
+def test_puts_are_debounced_into_one_write(tmp_path, fast_flush):
+    path = str(tmp_path / "state.json")
+    store = companion.JsonStore(path, {}, dict)
+    for i in range(5):
+        store.put({"n": i})
+    # Served from memory straight away, the file comes later
+    assert store.get() == {"n": 4}
+    assert wait_for(lambda: store.flushes == 1)
+    assert read(path) == {"n": 4}
+    time.sleep(0.1)
+    assert store.flushes == 1
+
+
+def test_steady_puts_still_flush_by_max_delay(tmp_path, fast_flush):
+    path = str(tmp_path / "state.json")
+    store = companion.JsonStore(path, {}, dict)
+    end = time.monotonic() + 0.6
+    i = 0
+    while time.monotonic() < end:
+        store.put({"n": i})
+        i += 1
+        time.sleep(0.02)
+    assert store.flushes >= 1
+    assert os.path.exists(path)
+
+
+def test_flush_writes_now_and_is_a_no_op_when_clean(tmp_path):
+    path = str(tmp_path / "state.json")
+    store = companion.JsonStore(path, {}, dict)
+    store.flush()
+    assert not os.path.exists(path)
+    store.put({"a": 1})
+    store.flush()
+    assert read(path) == {"a": 1}
+    store.flush()
+    assert store.flushes == 1
+
+
+def test_failed_write_leaves_the_old_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    store = companion.JsonStore(path, {}, dict)
+    store.put({"a": 1})
+    store.flush()
+    store.put({"a": object()})
+    with pytest.raises(TypeError):
+        store.flush()
+    assert read(path) == {"a": 1}
+    assert os.listdir(str(tmp_path)) == ["state.json"]
+
+
+def test_slow_disk_doesnt_block_get_and_put(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.json")
+    store = companion.JsonStore(path, {}, dict)
+    writing = threading.Event()
+    release = threading.Event()
+    real_write = companion._atomic_write_json
+
+    def slow_write(target, payload):
+        writing.set()
+        release.wait(3.0)
+        real_write(target, payload)
+
+    monkeypatch.setattr(companion, "_atomic_write_json", slow_write)
+    # Keep the background flush out of the way, this test does its own
+    monkeypatch.setattr(companion, "STORE_FLUSH_DELAY", 30.0)
+    monkeypatch.setattr(companion, "STORE_FLUSH_MAX_DELAY", 30.0)
+    store.put({"n": 1})
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    assert writing.wait(3.0)
+    # Mid-write, the store still answers straight away
+    start = time.monotonic()
+    store.put({"n": 2})
+    assert store.get() == {"n": 2}
+    assert time.monotonic() - start < 0.5
+    release.set()
+    flusher.join(3.0)
+    # The file has the snapshot, the newer put is still waiting for its own write
+    assert read(path) == {"n": 1}
+    assert store.dirty_since is not None
+    store.flush()
+    assert read(path) == {"n": 2}
+    assert store.dirty_since is None
@@ -0,0 +1,72 @@
+import pytest
+
+import companion
+
+
+def heartbeats(stats, count, rtt, start=0.0, every=0.5, lose=()):
+    # Sends count heartbeats, each echoed back rtt later unless its index is in lose
+    now = start
+    for seq in range(count):
+        now = start + seq * every
+        stats.on_send(seq, now)
+        if seq not in lose:
+            stats.on_ack(seq, int(now * 1e6), now + rtt)
+    return now
+
+
+def test_rtt_from_echoed_send_time():
+    stats = companion.LinkStats()
+    heartbeats(stats, 12, rtt=0.02)
+    status = stats.status()
+    assert status["echo"] is True
+    assert status["samples"] == 12 and status["loss"] == 0.0
+    assert status["rtt_ms"]["p50"] == pytest.approx(20.0, abs=0.01)
+    assert status["rtt_ms"]["max"] == pytest.approx(20.0, abs=0.01)
+    assert status["jitter_ms"] == pytest.approx(0.0, abs=0.01)
+    assert status["level"] == "ok" and stats.send_interval == 0.0
+
+
+def test_no_echo_means_unknown_not_lost():
+    # Older firmware never echoes, unanswered heartbeats mustnt look like a dead link
+    stats = companion.LinkStats()
+    for seq in range(20):
+        stats.on_send(seq, seq * 1.0)
+    status = stats.status()
+    assert status["echo"] is False and status["samples"] == 0
+    assert status["level"] == "unknown" and stats.send_interval == 0.0
+
+
+def test_late_and_duplicate_acks_are_ignored():
+    stats = companion.LinkStats()
+    stats.on_send(1, 0.0)
+    stats.on_ack(1, 0, 0.01)
+    stats.on_ack(1, 0, 0.02)
+    stats.on_ack(99, 0, 0.03)
+    assert stats.status()["samples"] == 1
+
+
+def test_slow_link_is_degraded():
+    stats = companion.LinkStats()
+    heartbeats(stats, 20, rtt=0.15)
+    assert stats.status()["level"] == "degraded"
+    assert stats.send_interval == pytest.approx(1.0 / companion.LINK_DEGRADED_SEND_HZ)
+    assert stats.status()["send_hz_cap"] == companion.LINK_DEGRADED_SEND_HZ
+
+
+def test_lossy_link_is_bad():
+    stats = companion.LinkStats()
+    # Unanswered ones only count as lost once they are ESP_HEARTBEAT_TIMEOUT old
+    end = heartbeats(stats, 40, rtt=0.01, lose=range(0, 40, 2))
+    stats.on_send(1000, end + companion.ESP_HEARTBEAT_TIMEOUT + 1.0)
+    status = stats.status()
+    assert status["loss"] >= companion.LINK_BAD_LOSS
+    assert status["level"] == "bad"
+    assert stats.send_interval == pytest.approx(1.0 / companion.LINK_BAD_SEND_HZ)
+
+
+def test_reset():
+    stats = companion.LinkStats()
+    heartbeats(stats, 20, rtt=0.3)
+    stats.reset()
+    assert stats.status()["samples"] == 0 and stats.status()["level"] == "unknown"
+    assert stats.send_interval == 0.0
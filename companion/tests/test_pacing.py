@@ -0,0 +1,74 @@
+import pytest
+
+import companion
+
+
+def drive(pacing, start, seconds, frame_hz, active=True):
+    # Polls at whatever interval the scheduler asks for, AC publishes at frame_hz in between
+    now = start
+    next_frame = start
+    end = start + seconds
+    while now < end:
+        new_frame = now >= next_frame
+        if new_frame:
+            next_frame += 1.0 / frame_hz
+        pacing.tick(now, new_frame, active and new_frame)
+        now += pacing.interval
+    return now
+
+
+def test_polls_twice_per_ac_frame():
+    pacing = companion.PacingScheduler(target_hz=1000, idle_hz=10, idle_after=2.0)
+    drive(pacing, pacing.last_active, 2.0, frame_hz=100)
+    assert pacing.interval == pytest.approx(0.005, rel=0.1)
+    assert not pacing.idle()
+
+
+def test_target_rate_is_the_floor():
+    pacing = companion.PacingScheduler(target_hz=200, idle_hz=10, idle_after=2.0)
+    drive(pacing, pacing.last_active, 2.0, frame_hz=333)
+    assert pacing.interval == pytest.approx(0.005)
+
+
+def test_backs_off_to_idle_rate():
+    pacing = companion.PacingScheduler(target_hz=200, idle_hz=10, idle_after=1.0)
+    now = pacing.last_active
+    # Nothing moving, stays fast until idle_after then grows by half each poll up to the idle interval
+    pacing.tick(now + 0.5, False, False)
+    assert pacing.interval == pytest.approx(0.005)
+    steps = []
+    for i in range(20):
+        pacing.tick(now + 1.0 + i * 0.01, False, False)
+        steps.append(pacing.interval)
+    assert steps[0] == pytest.approx(0.0075)
+    assert steps == sorted(steps)
+    assert steps[-1] == pytest.approx(0.1)
+    assert pacing.idle()
+
+
+def test_stats():
+    pacing = companion.PacingScheduler(target_hz=200, idle_hz=10, idle_after=1.0)
+    end = drive(pacing, pacing.last_active, 1.5, frame_hz=100)
+    pacing.tick(end, False, False)
+    stats = pacing.stats()
+    assert stats["target_hz"] == 200.0
+    assert stats["idle_hz"] == 10.0
+    assert stats["ac_frame_hz"] == pytest.approx(100, rel=0.1)
+    assert stats["achieved_hz"] == pytest.approx(200, rel=0.1)
+    assert stats["idle"] is False
+
+
+def test_recovers_straight_away_after_a_pause():
+    pacing = companion.PacingScheduler(target_hz=200, idle_hz=10, idle_after=1.0)
+    now = drive(pacing, pacing.last_active, 2.0, frame_hz=333)
+    # Sat in the pits for 30 s, AC stops publishing
+    end = now + 30.0
+    while now < end:
+        pacing.tick(now, False, False)
+        now += pacing.interval
+    assert pacing.idle()
+    # The gap doesn't leak into the frame rate, first frame back is already at the target rate
+    pacing.tick(now, True, True)
+    assert pacing.interval == pytest.approx(0.005)
+    drive(pacing, now, 0.05, frame_hz=333)
+    assert pacing.interval == pytest.approx(0.005)
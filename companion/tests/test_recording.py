@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+import companion
+
+np = pytest.importorskip("numpy")
+
+RATE_HZ = 60.0
+LAPS = 6
+
+
+def record(path, source, game_laps=False):
+    rec = companion.SessionRecorder(path)
+    rec.start()
+    for n in range(source.total):
+        physics = source.frame(n)
+        lap = None
+        if game_laps:
+            t = n / source.rate_hz
+            lap = (int(t // source.lap_time), (t % source.lap_time) / source.lap_time)
+        rec.push(physics, n / source.rate_hz, lap, block=True)
+    rec.stop()
+    rec.join()
+    assert rec.error is None
+    return rec
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "session.sxr")
+    source = companion.SyntheticSource(RATE_HZ, laps=1, lap_time=20.0)
+    rec = record(path, source, game_laps=True)
+    assert companion.recording_rows(path) == source.total == rec.records
+
+    cols, header = companion.load_recording(path)
+    assert header["record_size"] == companion.PHYSICS_SIZE + companion.RECORDING_LAP.size
+    assert len(cols["t"]) == source.total
+    np.testing.assert_allclose(cols["t"][:3], [0.0, 1 / RATE_HZ, 2 / RATE_HZ])
+    for n in (0, source.total // 2, source.total - 1):
+        physics = source.frame(n)
+        assert cols["packetId"][n] == physics.packetId
+        assert cols["speedKmh"][n] == np.float32(physics.speedKmh)
+        np.testing.assert_array_equal(cols["TireWear"][n], np.array(physics.TireWear[:], dtype=np.float32))
+    assert cols["completedLaps"][0] == 0
+    assert cols["normalizedCarPosition"][source.total // 2] == pytest.approx(0.5, abs=0.01)
+
+
+def test_replay_skips_graphics_columns(tmp_path):
+    path = str(tmp_path / "session.sxr")
+    source = companion.SyntheticSource(RATE_HZ, laps=1, lap_time=5.0)
+    record(path, source, game_laps=True)
+    replay = companion.ReplaySource(path, speed=0)
+    replay.open()
+    physics = replay.read()
+    assert physics.packetId == source.frame(0).packetId
+    assert physics.speedKmh == pytest.approx(source.frame(0).speedKmh)
+    replay.close()
+
+
+def test_expand_only_asked_columns(tmp_path):
+    path = str(tmp_path / "session.sxr")
+    record(path, companion.SyntheticSource(RATE_HZ, laps=1, lap_time=5.0))
+    cache_dir, _header = companion.expand_recording(path, ["t", "speedKmh"])
+    assert sorted(n for n in os.listdir(cache_dir) if n.endswith(".npy")) == ["speedKmh.npy", "t.npy"]
+    companion.expand_recording(path, ["t", "fuel"])
+    assert "fuel.npy" in os.listdir(cache_dir)
+
+
+def test_cache_evicted_with_recording(tmp_path):
+    path = str(tmp_path / "session.sxr")
+    record(path, companion.SyntheticSource(RATE_HZ, laps=1, lap_time=5.0))
+    cache_dir, _header = companion.expand_recording(path, ["t", "speedKmh"])
+    os.remove(path)
+    companion.evict_recording_caches(str(tmp_path))
+    assert not os.path.exists(cache_dir)
+
+
+@pytest.mark.parametrize("pit_every,seed", [(0, 1), (2, 2), (3, 2), (2, 3), (3, 6)])
+def test_laps_from_distance(tmp_path, pit_every, seed):
+    # Pit stops every few laps make a multiple of the lap repeat better than the lap itself, it must not win
+    path = str(tmp_path / "session.sxr")
+    source = companion.SyntheticSource(RATE_HZ, laps=LAPS, pit_every=pit_every, seed=seed)
+    record(path, source)
+    out = companion.analyze_recording(path)
+    assert out["lap_length_source"] == "estimated"
+    assert len(out["laps"]) == LAPS
+    assert 3800 < out["lap_length_m"] < 4100
+    for lap in out["laps"]:
+        assert lap["fuel_used"] == pytest.approx(source.FUEL_PER_LAP, abs=0.1)
+
+
+def test_laps_from_game_counter(tmp_path):
+    path = str(tmp_path / "session.sxr")
+    source = companion.SyntheticSource(RATE_HZ, laps=4, pit_every=2)
+    record(path, source, game_laps=True)
+    out = companion.analyze_recording(path)
+    assert out["lap_length_source"] == "game"
+    assert [round(lap["start_s"]) for lap in out["laps"]] == [0, 90, 180, 270]
+    # The recording started on the line here, but analysis cant know that so lap 1 counts as partial
+    assert [lap["complete"] for lap in out["laps"]] == [False, True, True, False]
+    assert [lap["pit"] for lap in out["laps"]] == [False, True, False, True]
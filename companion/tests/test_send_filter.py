@@ -0,0 +1,82 @@
+import companion
+
+INDEX = companion.PACKET_INDEX
+
+
+def packet(**fields):
+    values = [0] * len(companion.PACKET_FIELDS)
+    values[INDEX["G"]] = "N"
+    for key, value in fields.items():
+        values[INDEX[key]] = value
+    return values
+
+
+def sent(send_filter, values, now):
+    values = list(values)
+    send_filter.quantize(values)
+    if send_filter.should_send(values, now):
+        send_filter.mark_sent(values, now)
+        return True
+    return False
+
+
+def test_quantize():
+    values = packet(RPM=7234, FUEL=41.37, SPD=187.6, BST=0.456, THR=83)
+    companion.SendFilter().quantize(values)
+    assert values[INDEX["RPM"]] == 7230
+    assert round(values[INDEX["FUEL"]], 6) == 41.4
+    assert values[INDEX["SPD"]] == 188
+    assert round(values[INDEX["BST"]], 6) == 0.46
+    # Step 0 means the value goes through as it is
+    assert values[INDEX["THR"]] == 83
+
+
+def test_first_frame_always_sends_then_only_changes():
+    send_filter = companion.SendFilter()
+    assert sent(send_filter, packet(RPM=5000), 0.0)
+    assert not sent(send_filter, packet(RPM=5000), 0.01)
+    assert sent(send_filter, packet(RPM=5000, G="3"), 0.02)
+
+
+def test_deadband_and_max_stale():
+    send_filter = companion.SendFilter()
+    assert sent(send_filter, packet(RPM=5000), 0.0)
+    # RPM: step 10, deadband 20, max staleness 0.25s
+    assert not sent(send_filter, packet(RPM=5010), 0.1)
+    assert not sent(send_filter, packet(RPM=5010), 0.2)
+    assert sent(send_filter, packet(RPM=5010), 0.26)
+    assert sent(send_filter, packet(RPM=5030), 0.27)
+
+
+def test_only_fields_on_screen_trigger_a_send():
+    layout = {"left": {"primary": "gear"}, "middle": {}, "right": {}}
+    send_filter = companion.SendFilter(layout)
+    assert sent(send_filter, packet(RPM=5000), 0.0)
+    assert not sent(send_filter, packet(RPM=9000, SPD=250), 0.1)
+    assert not sent(send_filter, packet(RPM=9000, SPD=250), 5.0)
+    assert sent(send_filter, packet(RPM=9000, SPD=250, G="2"), 5.1)
+
+
+def test_hidden_fields_never_trigger():
+    # RL/P1/P2 arent shown by any widget, even with no layout known
+    send_filter = companion.SendFilter()
+    assert sent(send_filter, packet(), 0.0)
+    assert not sent(send_filter, packet(RL=1, P1=1, P2=1), 0.1)
+
+
+def test_new_layout_sends_straight_away():
+    send_filter = companion.SendFilter({"left": {"primary": "gear"}})
+    assert sent(send_filter, packet(), 0.0)
+    assert not sent(send_filter, packet(), 0.1)
+    send_filter.set_layout({"left": {"primary": "rpm"}})
+    assert sent(send_filter, packet(), 0.2)
+
+
+def test_overrides():
+    send_filter = companion.SendFilter(overrides={"RPM": {"step": 100, "deadband": 500, "max_stale": None}, "NOPE": {"step": 1}})
+    values = packet(RPM=7234)
+    send_filter.quantize(values)
+    assert values[INDEX["RPM"]] == 7200
+    assert sent(send_filter, packet(RPM=5000), 0.0)
+    assert not sent(send_filter, packet(RPM=5400), 10.0)
+    assert sent(send_filter, packet(RPM=5500), 10.1)
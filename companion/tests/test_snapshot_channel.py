@@ -0,0 +1,65 @@
+import companion
+
+
+def values(rpm=5000):
+    p = companion.MemMap()
+    p.gear = 4
+    p.rpms = rpm
+    return companion.decode_physics(p), p.TireWear
+
+
+def publish(channel, rpm):
+    record = channel.begin()
+    record.fill(*values(rpm))
+    channel.commit()
+
+
+def test_empty_channel():
+    channel = companion.SnapshotChannel()
+    assert channel.read() == (0, "Idle", None)
+
+
+def test_publish_and_status_bump_version():
+    channel = companion.SnapshotChannel()
+    publish(channel, 5000)
+    version, status, last = channel.read()
+    assert version == 1 and status == "Idle"
+    assert last["ac_running"] is True and last["gear"] == "3" and last["rpm"] == 5000
+    channel.set_status("Running")
+    assert channel.read()[:2] == (2, "Running")
+    publish(channel, 6000)
+    version, _status, last = channel.read()
+    assert version == 3 and last["rpm"] == 6000
+
+
+def test_read_retries_when_a_write_lands_mid_read():
+    channel = companion.SnapshotChannel()
+    publish(channel, 5000)
+    real = channel.record
+    calls = []
+
+    class Racing:
+        # The sender publishes a whole new frame while the reader is building its dict
+        def fill(self, values, wear):
+            real.fill(values, wear)
+
+        def to_dict(self):
+            calls.append(1)
+            snapshot = real.to_dict()
+            if len(calls) == 1:
+                publish(channel, 7000)
+            return snapshot
+
+    channel.record = Racing()
+    _version, _status, last = channel.read()
+    assert len(calls) == 2
+    assert last["rpm"] == 7000
+
+
+def test_stuck_writer_gives_the_last_good_read():
+    channel = companion.SnapshotChannel()
+    publish(channel, 5000)
+    good = channel.read()
+    # Sender died between begin() and commit(), readers give up after a few tries instead of spinning
+    channel.begin()
+    assert channel.read() == good
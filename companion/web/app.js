@@ -288,7 +288,23 @@ async function autodetect() {
 }
 
 // Flash 
+async function firmwareHash(file) {
+  if (!window.crypto || !crypto.subtle) return null;
+  try {
+    const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+  } catch {
+    return null;
+  }
+}
+
 async function uploadFirmware(file) {
+  // Same image as last time (or for the last wheel) is already on disk, skip sending it again
+  const sha = await firmwareHash(file);
+  if (sha) {
+    const cached = await api(`/api/flash/cached?sha256=${sha}`);
+    if (cached.ok && cached.path) return cached.path;
+  }
   const q = encodeURIComponent(file.name || "firmware.bin");
   const res = await api(`/api/flash/upload?filename=${q}`, {
     method: "POST",
@@ -346,12 +362,32 @@ async function startFlash(fileInput, portSel, baudInput, chipSel, statusEl, prog
   }
 }
 
-async function pollFlash(job, statusEl, progressEl) {
+function setFlashProgress(progressEl, pct) {
+  const fill = progressEl.querySelector(".ProgressFill");
+  if (!fill) return;
+  if (pct == null) {
+    fill.style.animation = "";
+    fill.style.transform = "";
+    fill.style.width = "";
+  } else {
+    fill.style.animation = "none";
+    fill.style.transform = "none";
+    fill.style.width = pct + "%";
+  }
+}
+
+// Asks only for lines after the last one it saw, the server holds the request open until there is something new
+async function pollFlash(job, statusEl, progressEl, cursor = 0) {
   if (!job) return;
+  if (cursor === 0) setFlashProgress(progressEl, null);
   try {
-    const res = await api(`/api/flash/status?job=${job}`);
-    const lines = res.lines || [];
-    lines.slice(-4).forEach((line) => log(line));
+    const res = await api(`/api/flash/status?job=${job}&since=${cursor}&wait=5`);
+    if (res.skipped) log(`... ${res.skipped} lines not shown`);
+    (res.lines || []).forEach((line) => log(line));
+    if (res.progress != null) {
+      setFlashProgress(progressEl, res.progress);
+      SetNotif(statusEl, `Flashing... ${Math.round(res.progress)}%`, "Busy");
+    }
     if (res.done) {
       progressEl.classList.add("Hidden");
       if (res.ok) {
@@ -364,9 +400,11 @@ async function pollFlash(job, statusEl, progressEl) {
       }
       return;
     }
-    setTimeout(() => pollFlash(job, statusEl, progressEl), 800);
+    // No cursor back means the request itself failed, back off like before
+    const next = res.next != null ? res.next : cursor;
+    setTimeout(() => pollFlash(job, statusEl, progressEl, next), res.next != null ? 100 : 1200);
   } catch {
-    setTimeout(() => pollFlash(job, statusEl, progressEl), 1200);
+    setTimeout(() => pollFlash(job, statusEl, progressEl, cursor), 1200);
   }
 }
 
@@ -450,9 +488,8 @@ function TireClass(pct) {
   return "Bad";
 }
 
-async function pollTelemetry() {
+function applyTelemetry(res) {
   try {
-    const res = await api("/api/telemetry/status");
     if (res.status === "running") {
       SetNotif(telemetryStatus, "Running", "Ok");
     }
@@ -550,13 +587,11 @@ async function pollTelemetry() {
       }
     }
   } catch {}
-  setTimeout(pollTelemetry, 1000);
 }
 
-async function pollHeartbeat() {
+function applyHeartbeat(res) {
   if (!deviceDisconnect) return;
   try {
-    const res = await api("/api/heartbeat/status");
     const show = res.running && res.ever_seen && !res.connected;
     deviceDisconnect.classList.toggle("Hidden", !show);
 
@@ -569,7 +604,41 @@ async function pollHeartbeat() {
   } catch {
     deviceDisconnect.classList.add("Hidden");
   }
-  setTimeout(pollHeartbeat, 1000);
+}
+
+// Old polling, only used if the webview has no EventSource. Always re-armed so one bad response doesnt end it
+async function pollTelemetry() {
+  try {
+    applyTelemetry(await api("/api/telemetry/status"));
+  } finally {
+    setTimeout(pollTelemetry, 1000);
+  }
+}
+
+async function pollHeartbeat() {
+  try {
+    applyHeartbeat(await api("/api/heartbeat/status"));
+  } finally {
+    setTimeout(pollHeartbeat, 1000);
+  }
+}
+
+// One connection for telemetry and heartbeat, the server only ever sends the newest values
+const STREAM_HZ = 30;
+
+function connectStream() {
+  if (typeof EventSource === "undefined") {
+    pollTelemetry();
+    pollHeartbeat();
+    return;
+  }
+  const stream = new EventSource(`/api/stream?hz=${STREAM_HZ}`);
+  stream.addEventListener("telemetry", (e) => applyTelemetry(JSON.parse(e.data)));
+  stream.addEventListener("heartbeat", (e) => applyHeartbeat(JSON.parse(e.data)));
+  // EventSource reconnects by itself, just dont leave a stale disconnect banner up meanwhile
+  stream.onerror = () => {
+    if (deviceDisconnect) deviceDisconnect.classList.add("Hidden");
+  };
 }
 
 // File zones
@@ -851,8 +920,7 @@ async function init() {
     showView("onboarding");
   }
 
-  pollTelemetry();
-  pollHeartbeat();
+  connectStream();
 
   populateZoneSelects();
   let restoredLayout = null;
@@ -39,6 +39,13 @@ WiFiUDP udp;
 const uint16_t localPort = 8888;
 const uint32_t HB_TIMEOUT_MS = 3000;
 
+// Binary telemetry frame, same layout as TELEMETRY_BIN in companion.py (little endian, fixed offsets)
+// The companion only sends these after we answer its HB with our caps, otherwise it stays on the text packets
+const char* WIRE_CAPS = "BIN1,DELTA1";
+const uint8_t BIN_MAGIC = 0xB5;
+const uint8_t BIN_VERSION = 1;
+const int BIN_FRAME_SIZE = 28;
+
 enum Widget : uint8_t {
   W_NONE = 0,
   W_GEAR,
@@ -103,6 +110,9 @@ void saveLayout();
 void loadLayout();
 void parseLayoutPacket(const char* pkt);
 void parsePacket(const String& line);
+bool parseBinaryPacket(const uint8_t* p, int len);
+void parseKeyframe(const String& pkt);
+void parseDelta(const String& pkt);
 void drawWidget(Widget wid, int x, int y, int w, int h, bool isPrimary);
 void drawZone(const Zone& zone, int x, int y, int w, int h);
 void drawScreen();
@@ -128,6 +138,18 @@ struct Telemetry {
   uint8_t TireDisplayPct[4] = {100, 100, 100, 100};
 } telem;
 
+// Delta mode keeps the last two keyframes, the companion diffs against whichever one it last got a KACK for
+struct KeySlot {
+  bool valid = false;
+  uint16_t seq = 0;
+  Telemetry t;
+};
+KeySlot keySlots[2];
+uint8_t keySlotNext = 0;
+bool seqSeen = false;
+uint16_t lastSeq = 0;
+uint32_t framesLost = 0;
+
 bool firstPacketReceived = false;
 bool bootFinished = false;
 uint8_t bootProgress = 0;
@@ -233,13 +255,18 @@ String extractValue(const String& pkt, const char* key) {
   return pkt.substring(start, end);
 }
 
+// Keys and formats match TELEMETRY_FIELDS in companion.py, a new field goes in both
 void parsePacket(const String& line) {
   String g = extractValue(line, "G:");
   if (g.length() > 0) telem.gear = g;
 
-  telem.pit = extractValue(line, "PIT:").toInt() != 0;
-  telem.abs = extractValue(line, "ABS:").toInt() != 0;
-  telem.tc = extractValue(line, "TC:").toInt() != 0;
+  // Only touch fields that are actually in the packet, deltas leave the rest alone
+  String pt = extractValue(line, "PIT:");
+  if (pt.length()) telem.pit = pt.toInt() != 0;
+  String ab = extractValue(line, "ABS:");
+  if (ab.length()) telem.abs = ab.toInt() != 0;
+  String tc = extractValue(line, "TC:");
+  if (tc.length()) telem.tc = tc.toInt() != 0;
   String sp = extractValue(line, "SPD:");
   if (sp.length()) telem.speed = sp.toFloat();
   String rp = extractValue(line, "RPM:");
@@ -268,10 +295,14 @@ void parsePacket(const String& line) {
   String bt = extractValue(line, "BTMP:");
   if (bt.length()) telem.brakeTemp = bt.toInt();
   
-  telem.TireLow[0] = extractValue(line, "T0:").toInt() != 0;
-  telem.TireLow[1] = extractValue(line, "T1:").toInt() != 0;
-  telem.TireLow[2] = extractValue(line, "T2:").toInt() != 0;
-  telem.TireLow[3] = extractValue(line, "T3:").toInt() != 0;
+  String t0 = extractValue(line, "T0:");
+  String t1 = extractValue(line, "T1:");
+  String t2 = extractValue(line, "T2:");
+  String t3 = extractValue(line, "T3:");
+  if (t0.length()) telem.TireLow[0] = t0.toInt() != 0;
+  if (t1.length()) telem.TireLow[1] = t1.toInt() != 0;
+  if (t2.length()) telem.TireLow[2] = t2.toInt() != 0;
+  if (t3.length()) telem.TireLow[3] = t3.toInt() != 0;
   
   heartbeatSeen = true;
   lastHeartbeatMs = millis();
@@ -288,6 +319,94 @@ void parsePacket(const String& line) {
   firstPacketReceived = true;
 }
 
+void replyUdp(const char* msg) {
+  udp.beginPacket(udp.remoteIP(), udp.remotePort());
+  udp.write((const uint8_t*)msg, strlen(msg));
+  udp.endPacket();
+}
+
+void noteSeq(uint16_t seq) {
+  if (seqSeen) {
+    uint16_t gap = seq - lastSeq;
+    if (gap > 1 && gap < 0x8000) framesLost += gap - 1;
+  }
+  seqSeen = true;
+  lastSeq = seq;
+}
+
+// "K:<seq>|G:3|PIT:0|..." full keyframe
+void parseKeyframe(const String& pkt) {
+  uint16_t seq = (uint16_t)pkt.substring(2).toInt();
+  noteSeq(seq);
+  parsePacket(pkt);
+  KeySlot& slot = keySlots[keySlotNext];
+  keySlotNext ^= 1;
+  slot.valid = true;
+  slot.seq = seq;
+  slot.t = telem;
+  char ack[32];
+  snprintf(ack, sizeof(ack), "KACK:%u:%lu", seq, (unsigned long)framesLost);
+  replyUdp(ack);
+}
+
+// "D:<seq>:<key>|RPM:7000|..." only what changed since keyframe <key>
+void parseDelta(const String& pkt) {
+  int sep = pkt.indexOf(':', 2);
+  if (sep < 0) return;
+  int bar = pkt.indexOf('|', sep);
+  uint16_t seq = (uint16_t)pkt.substring(2, sep).toInt();
+  uint16_t key = (uint16_t)pkt.substring(sep + 1, bar < 0 ? pkt.length() : bar).toInt();
+  noteSeq(seq);
+  for (int i = 0; i < 2; i++) {
+    if (keySlots[i].valid && keySlots[i].seq == key) {
+      telem = keySlots[i].t;
+      parsePacket(pkt);
+      return;
+    }
+  }
+  // We never got that keyframe, ask for a fresh one
+  replyUdp("RESYNC");
+}
+
+static inline uint16_t readU16(const uint8_t* p) { return (uint16_t)p[0] | ((uint16_t)p[1] << 8); }
+static inline int16_t readI16(const uint8_t* p) { return (int16_t)readU16(p); }
+
+bool parseBinaryPacket(const uint8_t* p, int len) {
+  if (len < BIN_FRAME_SIZE || p[0] != BIN_MAGIC || p[1] != BIN_VERSION) return false;
+
+  uint16_t flags = readU16(p + 2);
+  int8_t gear = (int8_t)p[4];
+  if (gear < 0) telem.gear = "R";
+  else if (gear == 0) telem.gear = "N";
+  else telem.gear = String(gear);
+
+  telem.pit = flags & 0x0001;
+  telem.abs = flags & 0x0002;
+  telem.tc = flags & 0x0004;
+  telem.drs = flags & 0x0040;
+  for (int i = 0; i < 4; i++) {
+    telem.TireLow[i] = flags & (0x0080 << i);
+    telem.TireDisplayPct[i] = min(p[5 + i], (uint8_t)100);
+  }
+
+  telem.speed = readU16(p + 9) / 10.0f;
+  telem.rpm = readU16(p + 11);
+  telem.throttle = p[13];
+  telem.brake = p[14];
+  telem.clutch = 100 - constrain((int)p[15], 0, 100);
+  telem.fuel = readU16(p + 16) / 10.0f;
+  telem.boost = readI16(p + 18) / 100.0f;
+  telem.airTemp = readI16(p + 20);
+  telem.roadTemp = readI16(p + 22);
+  telem.steer = readI16(p + 24) / 100.0f;
+  telem.brakeTemp = readU16(p + 26);
+
+  heartbeatSeen = true;
+  lastHeartbeatMs = millis();
+  firstPacketReceived = true;
+  return true;
+}
+
 // Draw the widgets!!!
 void drawTire(int x, int y, int w, int h, uint8_t pct) {
   u8g2.drawRFrame(x, y, w, h, 2);
@@ -891,6 +1010,12 @@ void loop() {
     if (len <= 0) continue;
     buf[len] = '\0';
 
+    // Binary frames can have zeros in them so check before it gets turned into a String
+    if ((uint8_t)buf[0] == BIN_MAGIC) {
+      parseBinaryPacket((const uint8_t*)buf, len);
+      continue;
+    }
+
     String packet(buf);
 
     if (packet.startsWith("LAYOUT:")) {
@@ -898,10 +1023,24 @@ void loop() {
     } else if (packet.startsWith("HB")) {
       heartbeatSeen = true;
       lastHeartbeatMs = millis();
+      // Anything after | is the companions seq:timestamp, sent straight back so it can time the round trip
+      const char* echo = strchr(buf, '|');
+      if (echo && strlen(echo) > 40) echo = nullptr;
+      char ack[80];
+      int n;
+      if (packet.startsWith("HB:")) {
+        // Companion offered caps, tell it what we can take
+        n = snprintf(ack, sizeof(ack), "HB_ACK:%s%s", WIRE_CAPS, echo ? echo : "");
+      } else {
+        n = snprintf(ack, sizeof(ack), "HB_ACK%s", echo ? echo : "");
+      }
       udp.beginPacket(udp.remoteIP(), udp.remotePort());
-      const uint8_t ack[] = {'H','B','_','A','C','K'};
-      udp.write(ack, sizeof(ack));
+      udp.write((const uint8_t*)ack, n);
       udp.endPacket();
+    } else if (packet.startsWith("K:")) {
+      parseKeyframe(packet);
+    } else if (packet.startsWith("D:")) {
+      parseDelta(packet);
     } else {
       parsePacket(packet);
     }